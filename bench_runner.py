@@ -0,0 +1,248 @@
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import statistics
+import tempfile
+
+# Add the 'js/metrics' directory to the Python path so we can import 'calc_p'
+metrics_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'js', 'metrics'))
+if metrics_path not in sys.path:
+    sys.path.append(metrics_path)
+
+import numpy as np
+import calc_p
+
+workspace_root = os.path.dirname(os.path.abspath(__file__))
+assets_dir = os.path.join(workspace_root, 'assets')
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '5M': 5_000_000}
+QUICK_SIZES = ['10k', '100k']
+
+# Stages below this median are compared only if they also regress by more than this absolute amount
+NOISE_FLOOR_S = 0.0005
+
+
+# ---------------------------------------------------------------------------
+# Timing
+# ---------------------------------------------------------------------------
+def time_stage(fn, min_total_s=0.2, max_reps=50, min_reps=3):
+    """Run fn repeatedly (at least min_reps, until min_total_s or max_reps); return timing stats."""
+    times = []
+    t_start = time.perf_counter()
+    while len(times) < min_reps or (len(times) < max_reps and time.perf_counter() - t_start < min_total_s):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'reps': len(times)}
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+def write_height_field_stl(path, n_vertices, bounds, z0=0.0):
+    """Binary STL of a wavy height field over bounds=(xmin, xmax, ymin, ymax) with ~n_vertices unique vertices."""
+    m = max(2, int(round(np.sqrt(n_vertices))))
+    xs = np.linspace(bounds[0], bounds[1], m, dtype=np.float32)
+    ys = np.linspace(bounds[2], bounds[3], m, dtype=np.float32)
+    X, Y = np.meshgrid(xs, ys, indexing='ij')
+    Z = (z0 + 2.0 * np.sin(X / 7.0) * np.cos(Y / 9.0) + 0.02 * X).astype(np.float32)
+    V = np.stack([X, Y, Z], axis=-1)
+    a, b, c, d = V[:-1, :-1], V[1:, :-1], V[1:, 1:], V[:-1, 1:]
+    T = np.concatenate([np.stack([a, b, c], axis=-2).reshape(-1, 3, 3),
+                        np.stack([a, c, d], axis=-2).reshape(-1, 3, 3)])
+    rec = np.zeros(len(T), dtype=calc_p.STL_RECORD_DTYPE)
+    rec['v'] = T
+    with open(path, 'wb') as f:
+        f.write(b'synthetic height field'.ljust(80, b' '))
+        f.write(np.uint32(len(T)).tobytes())
+        rec.tofile(f)
+    return m * m
+
+
+def landmark_bounds(lm, pad_mm=5.0):
+    P = lm.xyz[lm.valid]
+    lo, hi = P.min(axis=0) - pad_mm, P.max(axis=0) + pad_mm
+    return (float(lo[0]), float(hi[0]), float(lo[1]), float(hi[1])), float(P[:, 2].mean())
+
+
+def asset_cases():
+    cases = []
+    for c in calc_p.discover_cases(assets_dir):
+        if c['upper_json'] and c['lower_json']:
+            cases.append(c)
+    return cases
+
+
+def ensure_synthetic_meshes(data_dir, case, sizes):
+    """One synthetic upper/lower mesh pair per size, shaped to the case's landmark extents (reused across runs)."""
+    up = calc_p._load_landmarks_json(case['upper_json'])
+    lo = calc_p._load_landmarks_json(case['lower_json'])
+    out = {}
+    for label in sizes:
+        n = SIZES[label]
+        pair = {}
+        for arch, lm in (('upper', up), ('lower', lo)):
+            path = os.path.join(data_dir, f"case{case['case']}_{label}_{arch}.stl")
+            if not os.path.exists(path):
+                bounds, z0 = landmark_bounds(lm)
+                print(f"  generating {os.path.basename(path)} ...", flush=True)
+                write_height_field_stl(path, n // 2, bounds, z0)
+            pair[arch] = path
+        out[label] = pair
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+def bench_case(case, meshes, results):
+    cid = case['case']
+    prefix = f"assets/{cid}"
+    print(f"[case {cid}]", flush=True)
+    results[f"{prefix}/load_landmarks_json"] = time_stage(
+        lambda: (calc_p._load_landmarks_json(case['upper_json']), calc_p._load_landmarks_json(case['lower_json'])))
+
+    lm = calc_p._merge_landmarks(calc_p._load_landmarks_json(case['upper_json']),
+                                 calc_p._load_landmarks_json(case['lower_json']))
+    results[f"{prefix}/build_occlusal_frame[landmarks]"] = time_stage(lambda: calc_p.build_occlusal_frame(lm))
+
+    pair = meshes[min(meshes, key=lambda k: SIZES[k])]
+    P = calc_p._combine_and_sample_points(pair['upper'], pair['lower'])
+    frame_res = calc_p.build_occlusal_frame(lm, geom_points=P)
+    frame, local = frame_res['frame'], frame_res['local']
+    for name in calc_p.brief_metrics():
+        spec = calc_p.METRIC_REGISTRY[name]
+        results[f"{prefix}/{spec.compute.__name__}"] = time_stage(
+            lambda spec=spec: spec.compute(lm, frame, local=local, **spec.params))
+    results[f"{prefix}/make_brief_report"] = time_stage(lambda: calc_p.make_brief_report(lm, frame, local=local))
+    results[f"{prefix}/generate_metrics"] = time_stage(
+        lambda: calc_p.generate_metrics(pair['upper'], pair['lower'], case['upper_json'], case['lower_json'],
+                                        cfg={'memo': False, 'mesh_cache': False}))
+
+
+def bench_scale(case, meshes, results, cache_dir):
+    lm = calc_p._merge_landmarks(calc_p._load_landmarks_json(case['upper_json']),
+                                 calc_p._load_landmarks_json(case['lower_json']))
+    frame_cfg = {}
+    for label, pair in sorted(meshes.items(), key=lambda kv: SIZES[kv[0]]):
+        prefix = f"synthetic/{label}"
+        print(f"[{label} vertices]", flush=True)
+        reps = {'max_reps': 3 if SIZES[label] >= 1_000_000 else 20}
+
+        results[f"{prefix}/_load_stl_points"] = time_stage(lambda: calc_p._load_stl_points(pair['upper']), **reps)
+        cache = calc_p.MeshCache(cache_dir)
+        cache.prewarm([pair['upper']])
+        results[f"{prefix}/_load_stl_points[cached]"] = time_stage(
+            lambda: calc_p._load_stl_points(pair['upper'], cache=cache), **reps)
+        results[f"{prefix}/_combine_and_sample_points"] = time_stage(
+            lambda: calc_p._combine_and_sample_points(pair['upper'], pair['lower']), **reps)
+
+        P = calc_p._combine_and_sample_points(pair['upper'], pair['lower'])
+        results[f"{prefix}/_build_frame_from_geometry"] = time_stage(
+            lambda: calc_p._build_frame_from_geometry(P, frame_cfg))
+        results[f"{prefix}/_build_frame_from_stl_stream"] = time_stage(
+            lambda: calc_p._build_frame_from_stl_stream([pair['upper'], pair['lower']], frame_cfg), **reps)
+        results[f"{prefix}/build_occlusal_frame"] = time_stage(
+            lambda: calc_p.build_occlusal_frame(lm, geom_points=P, cfg=frame_cfg))
+        results[f"{prefix}/generate_metrics"] = time_stage(
+            lambda: calc_p.generate_metrics(pair['upper'], pair['lower'], case['upper_json'], case['lower_json'],
+                                            cfg={'memo': False, 'mesh_cache': False}), **reps)
+
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+def compare(current, baseline, threshold):
+    """Return rows (stage, base_s, cur_s, ratio, regressed) for stages present in both runs."""
+    rows = []
+    for stage, cur in current.items():
+        base = baseline.get(stage)
+        if not base:
+            continue
+        b, c = base['median_s'], cur['median_s']
+        ratio = c / b if b > 0 else float('inf')
+        regressed = ratio > 1.0 + threshold and (c - b) > NOISE_FLOOR_S
+        rows.append((stage, b, c, ratio, regressed))
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark loaders, frame estimation and metrics")
+    ap.add_argument("--sizes", default=",".join(SIZES), help=f"synthetic mesh sizes ({', '.join(SIZES)})")
+    ap.add_argument("--quick", action="store_true", help=f"only {', '.join(QUICK_SIZES)}")
+    ap.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), 'landmark-bench'),
+                    help="where synthetic STL files are generated and reused")
+    ap.add_argument("--out", default=os.path.join(workspace_root, 'bench_results.json'))
+    ap.add_argument("--baseline", default=os.path.join(workspace_root, 'bench_baseline.json'))
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = +25%%)")
+    ap.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    args = ap.parse_args(argv)
+
+    sizes = QUICK_SIZES if args.quick else [s.strip() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        ap.error(f"unknown sizes: {unknown}")
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    cases = asset_cases()
+    if not cases:
+        print(f"Error: no <case>_U.json / <case>_L.json pairs found in {assets_dir}")
+        return 1
+
+    results = {}
+    meshes_by_case = {c['case']: ensure_synthetic_meshes(args.data_dir, c, [min(sizes, key=SIZES.get)]) for c in cases}
+    for c in cases:
+        bench_case(c, meshes_by_case[c['case']], results)
+    scale_meshes = ensure_synthetic_meshes(args.data_dir, cases[0], sizes)
+    with tempfile.TemporaryDirectory(prefix='landmark-bench-cache-') as cache_dir:
+        bench_scale(cases[0], scale_meshes, results, cache_dir)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'sizes': sizes,
+        },
+        'stages': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'stage':<58} {'median':>10} {'min':>10} {'reps':>5}")
+    for stage, r in results.items():
+        print(f"{stage:<58} {r['median_s'] * 1e3:>8.2f}ms {r['min_s'] * 1e3:>8.2f}ms {r['reps']:>5}")
+    print(f"\nResults have been saved to: {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f).get('stages', {})
+    rows = compare(results, baseline, args.threshold)
+    failed = [r for r in rows if r[4]]
+    print(f"\nCompared {len(rows)} stages with {args.baseline} (threshold +{args.threshold:.0%}):")
+    for stage, b, c, ratio, regressed in rows:
+        if regressed or ratio < 1.0 / (1.0 + args.threshold):
+            tag = 'REGRESSION' if regressed else 'faster'
+            print(f"  {tag:<10} {stage:<58} {b * 1e3:>8.2f}ms -> {c * 1e3:>8.2f}ms ({ratio:.2f}x)")
+    if failed:
+        print(f"{len(failed)} stage(s) regressed past the threshold.")
+        return 1
+    print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,83 @@
-import numpy as np
-import json, os
+import contextlib, contextvars, functools, json, os, re, sys, threading
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
 
+# ==========================================
+# Daemon client：命令行先尝试交给常驻进程（python calc_p.py daemon），
+# 在导入 numpy 之前完成，脚本化的逐例流水线不再重复付解释器 / numpy 启动代价。
+# 常驻进程不可用（未启动、socket 失效或不属本用户、超时、非 POSIX）或其加载的代码与本脚本不一致时
+# 照常在本进程执行；--no-daemon 强制本地。
+# ==========================================
+DAEMON_SOCKET_ENV = 'LANDMARK_DAEMON_SOCKET'
+
+def daemon_socket_path() -> str:
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.environ.get(DAEMON_SOCKET_ENV) or os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp', f"landmark-calc-{uid}.sock")
+
+DAEMON_CONNECT_TIMEOUT = 2.0    # 秒：连不上 / 不接受连接即视为没有常驻进程
+DAEMON_REPLY_TIMEOUT_ENV = 'LANDMARK_DAEMON_TIMEOUT'
+DAEMON_REPLY_TIMEOUT = 3600.0   # 秒：等回复的上限（缺省；超时视为常驻进程挂起，回退本地执行）
+
+def _daemon_socket_ok(path: str) -> bool:
+    """只连本用户建的 Unix socket：路径须是 socket（不跟随符号链接）且属主为当前用户。"""
+    import stat
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and (not hasattr(os, 'getuid') or st.st_uid == os.getuid())
+
+def _source_digest() -> str:
+    """本脚本源码的内容哈希（blake2b-128）：客户端与常驻进程比对，代码改过即不再交给旧进程。"""
+    import hashlib
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+def _daemon_request(req: Dict, path: Optional[str] = None) -> Optional[Dict]:
+    """发一条 JSON 请求给常驻进程并等回复；连不上、超时或回复残缺都返回 None。只用标准库。"""
+    import socket
+    path = path or daemon_socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not _daemon_socket_ok(path):
+        return None
+    try:
+        reply_timeout = float(os.environ.get(DAEMON_REPLY_TIMEOUT_ENV) or DAEMON_REPLY_TIMEOUT)
+    except ValueError:
+        reply_timeout = DAEMON_REPLY_TIMEOUT
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sk:
+            sk.settimeout(DAEMON_CONNECT_TIMEOUT)
+            sk.connect(path)
+            sk.settimeout(reply_timeout)
+            sk.sendall(json.dumps(req).encode('utf-8') + b"\n")
+            with sk.makefile('rb') as f:
+                line = f.readline()
+        resp = json.loads(line)
+        if not isinstance(resp, dict) or not isinstance(resp.get('code'), int):
+            return None
+    except (OSError, ValueError):
+        return None
+    return resp
+
+def _daemon_handoff(argv: List[str]) -> Optional[int]:
+    env = {k: v for k, v in os.environ.items() if k.startswith('LANDMARK_')}
+    try:
+        source = _source_digest()
+    except OSError:
+        return None
+    resp = _daemon_request({'argv': argv, 'cwd': os.getcwd(), 'env': env, 'source': source})
+    if resp is None or resp.get('stale'):
+        return None
+    sys.stdout.write(str(resp.get('stdout', '')))
+    sys.stderr.write(str(resp.get('stderr', '')))
+    return resp['code']
+
+if __name__ == "__main__" and sys.argv[1:2] not in (['daemon'], ['--daemon']) and '--no-daemon' not in sys.argv:
+    _code = _daemon_handoff(sys.argv[1:])
+    if _code is not None:
+        raise SystemExit(_code)
+
+import numpy as np
+
 # ==========================================
 # Public API: generate_metrics
 # 输入：上/下 STL + 上/下 JSON
@@ -23,44 +99,573 @@ def generate_metrics(
       ... 共 11 条 ...
     }
     若提供 out_path，则同时写盘（UTF-8，无转义）。
+    cfg['mesh_cache']：网格缓存目录或 MeshCache（缺省读环境变量 LANDMARK_MESH_CACHE；False 关闭）
+    cfg['dtype']：'float32' 时点云以 float32 传递（超大扫描省一半内存）
+    cfg['sampler']：{'mode': 'random'|'voxel'|'area', 'seed': 0, 'budget': max_points}，确定性下采样
+    cfg['stream_geometry']：True 用流式两遍 PCA 估计咬合平面（固定内存）；
+        'auto'（默认）在上下颌 STL 合计超过 cfg['stream_threshold_bytes']（默认 256MB）时启用
+    cfg['metrics']：只计算其中几项（注册名，如 ['overjet', 'overbite']）；缺省为全部 11 项
+    cfg['memo']：结果缓存目录 / ResultMemo / True（仅进程内）：坐标系、各项指标与接触报告都经其复用；
+        缺省读环境变量 LANDMARK_MEMO_CACHE，再缺省只在进程内缓存坐标系；False 全部关闭
+    upper_json_path / lower_json_path 也可以是 .lmk 容器（'x.lmk' 或 'cohort.lmk#1_U'，见 LmkFile）。
+    cfg['strict_labels']：True 时地标 JSON 中出现 dict.json 协议外或重复的标签即抛 ValueError（缺省只收为额外标签）
+    cfg['result']：'brief'（缺省，上面的 {键: 文案}）或 'structured'：
+        {'brief': {键: 文案}, 'metrics': {注册名: compute_* 的完整数值结果}, 'frame': {origin/ex/ey/ez, quality, warnings}}
+    cfg['uncertainty']：True / 样本数 / {'samples', 'sigma_mm', 'seed', 'ci'}（缺省见 UNCERTAINTY_DEFAULTS）：
+        地标加高斯噪声做蒙特卡洛，各指标的置信区间与类别翻转概率放在 '_uncertainty'（结构化结果为 'uncertainty'），
+        见 landmark_uncertainty
+    cfg['frame_bootstrap']：True / 重采样次数 / {'resamples', 'seed', 'ci', 'max_angle_deg'}（缺省见 BOOTSTRAP_DEFAULTS）：
+        对几何平面的采样点做 bootstrap，给出 ez/ex 夹角离散度与各指标敏感度，放在 '_frame_bootstrap'
+        （结构化结果为 frame['bootstrap']）；不稳定时坐标系 warnings 中加一条，见 geometry_frame_bootstrap
+    cfg['surface']：True / 'flag' / 'snap' / {'mode', 'tol_mm', 'max_snap_mm'}（缺省见 SURFACE_DEFAULTS）：
+        上下颌地标分别查到各自 STL 表面的距离，离面的记入 '_surface'（结构化结果为 'surface'）；
+        'snap' 时把离面不远的地标移到表面再建坐标系，见 check_landmarks_on_surface
+    cfg['contacts']：True / 接触阈值（mm）/ {'contact_mm', 'max_dist_mm', 'workers'}（缺省见 CONTACT_DEFAULTS）：
+        上下颌网格逐顶点互查表面距离，给出接触面积、按牙位的接触与接触斑（咬合坐标系），并用实际接触复核
+        锁牙合 / 覆𬌗的地标判定，放在 '_contacts'（结构化结果为 'contacts'），见 occlusal_contacts、contact_checks
+    cfg['metric_workers']：>1 时贴面检查（'flag'）/ 咬合接触这类网格指标在线程池中与其余指标并行（见 run_metrics）
+    cfg['trace']：StageTracer / 回调（逐阶段事件）/ True（事件列表附在返回值的 '_trace' 下，不写入 out_path）
     """
     cfg = cfg or {}
+    memo = memo_from_cfg(cfg)
+    frame_memo = frame_memo_from_cfg(cfg)
+    own_tracer = bool(cfg.get('trace')) and not isinstance(cfg.get('trace'), StageTracer)
+    tracer = tracer_from_cfg(cfg) or _ACTIVE_TRACER.get()
+    try:
+        with use_tracer(tracer), trace_stage('generate_metrics'):
+            kv = _generate_metrics_traced(upper_stl_path, lower_stl_path, upper_json_path, lower_json_path,
+                                          out_path, cfg, memo, frame_memo)
+    finally:
+        if own_tracer and tracer is not None:
+            tracer.close()
+    if cfg.get('trace') is True and tracer is not None:
+        kv['_trace'] = tracer.summary()
+    return kv
 
+def _generate_metrics_traced(upper_stl_path: str, lower_stl_path: str, upper_json_path: str,
+                             lower_json_path: str, out_path: str, cfg: Dict,
+                             memo: Optional['ResultMemo'], frame_memo: Optional['ResultMemo']) -> Dict:
     # 1) 读取 landmarks（复用上面提供的 I/O 小函数）
-    lm_upper = _load_landmarks_json(upper_json_path)
-    lm_lower = _load_landmarks_json(lower_json_path)
-    landmarks = _merge_landmarks(lm_upper, lm_lower)
-
-    # 2) 读取并合并 STL 点云（可为空；假设已配准）
-    geom_points = _combine_and_sample_points(
-        upper_stl_path, lower_stl_path,
-        max_points=cfg.get('max_points', 8000)
-    )
-
-    # 3) 咬合坐标系
-    frame_res = build_occlusal_frame(landmarks, geom_points=geom_points, cfg=cfg.get('frame'))
+    with trace_stage('load_landmarks') as info:
+        strict = bool(cfg.get('strict_labels', False))
+        lm_upper, info_upper = load_markups(upper_json_path, strict)
+        lm_lower, info_lower = load_markups(lower_json_path, strict)
+        landmarks = _merge_landmarks(lm_upper, lm_lower)
+        info['backend'] = info_upper['backend']
+        info['unknown_labels'] = info_upper['unknown_labels'] + info_lower['unknown_labels']
+
+    # 1b) 可选：地标吸附（改动地标，须在坐标系之前；只做检查时作为 'surface' 指标在第 4 步执行）
+    scfg = surface_cfg(cfg.get('surface'))
+    surface_report = None
+    if scfg is not None and scfg['mode'] == 'snap':
+        with trace_stage('surface_check', mode=scfg['mode']):
+            surface_report = {}
+            cache = mesh_cache_from_cfg(cfg)
+            for arch, lm_arch, path in (('upper', lm_upper, upper_stl_path), ('lower', lm_lower, lower_stl_path)):
+                index = surface_index(path, cache)
+                if index is None:
+                    surface_report[arch] = None
+                    continue
+                lm_new, surface_report[arch] = check_landmarks_on_surface(lm_arch, index, **scfg)
+                if arch == 'upper':
+                    lm_upper = lm_new
+                else:
+                    lm_lower = lm_new
+            landmarks = _merge_landmarks(lm_upper, lm_lower)
+
+    # 2)+3) STL 点云 → 咬合坐标系（memo 命中时跳过读取/采样/PCA）
+    with trace_stage('occlusal_frame'):
+        frame_res = _case_occlusal_frame(landmarks, upper_stl_path, lower_stl_path, cfg, frame_memo)
     frame = frame_res.get('frame')
+    structured = cfg.get('result', 'brief') == 'structured'
     if frame is None:
         kv = {"错误": "坐标系缺失，无法生成报告"}
+        if structured:
+            kv = {'brief': kv, 'metrics': {}, 'frame': _frame_summary(frame_res)}
         if out_path:
             with open(out_path, "w", encoding="utf-8") as f:
                 json.dump(kv, f, ensure_ascii=False, indent=2)
         return kv
 
-    # 4) 生成 brief 列表，并转成 {键: 值}
-    brief_lines = make_brief_report(landmarks, frame)
+    # 4) 生成 brief 列表，并转成 {键: 值}（显式开启 memo 时各 compute_* 结果经其复用）；
+    #    可选的贴面检查 / 咬合接触作为网格指标同批调度（workers>1 时与其余指标并行）
+    wanted = brief_metrics() if cfg.get('metrics') is None else list(cfg['metrics'])
+    extra, params = [], {}
+    if scfg is not None and scfg['mode'] == 'flag':
+        extra.append('surface')
+        params['surface'] = {k: scfg[k] for k in ('tol_mm', 'max_snap_mm')}
+    ccfg = contacts_cfg(cfg.get('contacts'))
+    if ccfg is not None:
+        extra.append('contacts')
+        params['contacts'] = ccfg
+    meshes = CaseMeshes(upper_stl_path, lower_stl_path, mesh_cache_from_cfg(cfg))
+    with trace_stage('metrics'), use_memo(memo):
+        # structured：一次 compute，brief 行由 format_* 从同一份结果排出
+        res = run_metrics(wanted + extra, landmarks, frame, local=frame_res.get('local'), mesh=meshes,
+                          kind='compute' if structured else 'report', workers=cfg.get('metric_workers'),
+                          params=params)
+    if 'surface' in extra:
+        surface_report = res['surface']
+    if structured:
+        computed = {n: r for n, r in res.items() if n in wanted}
+        brief_lines = [METRIC_REGISTRY[n].format(r) if METRIC_REGISTRY[n].format is not None
+                       else METRIC_REGISTRY[n].report(landmarks, frame, local=frame_res.get('local'))
+                       for n, r in computed.items()]
+    else:
+        brief_lines = [line for n, line in res.items() if n in wanted]
     kv = _brief_lines_to_kv(brief_lines)
+    if structured:
+        kv = {'brief': kv, 'metrics': computed, 'frame': _frame_summary(frame_res)}
+
+    if not structured and 'bootstrap' in frame_res:
+        kv['_frame_bootstrap'] = frame_res['bootstrap']
+    if surface_report is not None:
+        kv['surface' if structured else '_surface'] = surface_report
+
+    # 4b) 可选：标注噪声下的置信区间与类别翻转概率
+    ucfg = uncertainty_cfg(cfg.get('uncertainty'))
+    if ucfg is not None:
+        with trace_stage('uncertainty', samples=ucfg['samples']):
+            kv['uncertainty' if structured else '_uncertainty'] = landmark_uncertainty(
+                landmarks, frame_res.get('geom_base'), **ucfg)
+
+    # 4c) 可选：上下颌网格的咬合接触图，并用实际接触复核锁牙合 / 覆𬌗（第 4 步已算好）
+    if ccfg is not None:
+        kv['contacts' if structured else '_contacts'] = res['contacts']
 
     # 5) 可选落盘
     if out_path:
-        with open(out_path, "w", encoding="utf-8") as f:
+        with trace_stage('write_output'), open(out_path, "w", encoding="utf-8") as f:
             json.dump(kv, f, ensure_ascii=False, indent=2)
 
     return kv
 
+def _frame_summary(frame_res: Dict) -> Dict:
+    """结构化结果中的坐标系部分：轴与原点转成列表，附质量与警告。"""
+    frame = frame_res.get('frame') or {}
+    out = {k: np.asarray(frame[k], float).tolist() for k in ('origin', 'ex', 'ey', 'ez') if k in frame}
+    out['quality'] = frame_res.get('quality')
+    out['warnings'] = list(frame_res.get('warnings') or [])
+    if 'bootstrap' in frame_res:
+        out['bootstrap'] = frame_res['bootstrap']
+    return out
+
+STREAM_THRESHOLD_BYTES = 256 << 20
+
+def _use_stream_geometry(cfg: Dict, paths: List[str]) -> bool:
+    mode = cfg.get('stream_geometry', 'auto')
+    if mode != 'auto':
+        return bool(mode)
+    total = sum(os.path.getsize(p) for p in paths if p and os.path.exists(p))
+    return total > int(cfg.get('stream_threshold_bytes', STREAM_THRESHOLD_BYTES))
+
+FRAME_CFG_KEYS = ('max_points', 'sampler', 'frame', 'dtype')   # 影响坐标系的 cfg 项（memo key 只含这些）
+
+def _case_occlusal_frame(landmarks: 'LandmarkSet', upper_stl_path: str, lower_stl_path: str,
+                         cfg: Dict, memo: Optional['ResultMemo'] = None) -> Dict:
+    paths = [upper_stl_path, lower_stl_path]
+    stream = _use_stream_geometry(cfg, paths)
+    bcfg = bootstrap_cfg(cfg.get('frame_bootstrap'))
+    key = None
+    if memo is not None:
+        meshes = [file_digest(p) if p and os.path.isfile(p) else None for p in paths]
+        parts = ('frame', landmarks, meshes, stream, {k: cfg.get(k) for k in FRAME_CFG_KEYS})
+        key = memo_key(*parts, bcfg) if bcfg is not None else memo_key(*parts)
+        with trace_stage('memo_lookup', 'memo') as info:
+            hit = memo.get(key, _MEMO_MISS)
+            info['hit'] = hit is not _MEMO_MISS
+        if hit is not _MEMO_MISS:
+            return hit
+
+    # 读取并合并 STL 点云（可为空；假设已配准）；超大扫描走流式平面估计
+    geom_points, geom_base = None, None
+    if stream:
+        with trace_stage('stl_stream_pca', 'io'):
+            geom_base = _build_frame_from_stl_stream(paths, cfg.get('frame'))
+    else:
+        geom_points = _combine_and_sample_points(
+            upper_stl_path, lower_stl_path,
+            max_points=cfg.get('max_points', 8000),
+            cache=mesh_cache_from_cfg(cfg),
+            dtype=np.dtype(cfg.get('dtype', 'float64')),
+            sampler=cfg.get('sampler')
+        )
+    frame_res = build_occlusal_frame(landmarks, geom_points=geom_points, cfg=cfg.get('frame'), geom_base=geom_base)
+    if bcfg is not None:
+        # 流式路径不保留点云，无从重采样；记为 None
+        with trace_stage('frame_bootstrap', resamples=bcfg['resamples']):
+            boot = None if stream else geometry_frame_bootstrap(geom_points, landmarks, cfg.get('frame'), **bcfg)
+        frame_res['bootstrap'] = boot
+        if boot and boot['unstable']:
+            ang = boot.get('frame', boot['plane'])['ez_angle_deg']['p95']
+            frame_res['warnings'] = list(frame_res.get('warnings') or []) + [
+                f"unstable occlusal frame under bootstrap (ez p95≈{ang:.2f}°)"]
+    if key is not None:
+        memo.put(key, frame_res)
+    return frame_res
+
+# ================================
+# Result memo：咬合坐标系与各 compute_* 结果按内容寻址缓存
+#   key = blake2b(CODE_VERSION（本模块源码哈希）, 地标内容, STL 内容哈希 / frame, 相关参数)
+#   内存：按字节计的 LRU，存 pickle 字节（取出即副本，调用方改动不会污染缓存）
+#   磁盘（可选）：<dir>/<key>.pkl，命中刷新 mtime，超出 max_bytes 时淘汰最旧条目
+#   坐标系 key 不含指标阈值：只改阈值的重跑直接命中坐标系，跳过 STL 读取与 PCA
+#   缺省只缓存坐标系（进程内）；逐项指标与接触报告的复用须显式开启（cfg['memo'] / LANDMARK_MEMO_CACHE）
+# ================================
+def _code_version() -> str:
+    """memo key 中的代码版本：本模块源码的内容哈希，源码一改旧结果自然失效（读不到源码时只在本进程内有效）。"""
+    try:
+        return _source_digest()
+    except OSError:
+        import uuid
+        return uuid.uuid4().hex
+
+CODE_VERSION = _code_version()
+MEMO_ENV = 'LANDMARK_MEMO_CACHE'
+MEMO_MEM_BYTES = 64 << 20
+MEMO_DISK_MAX_BYTES = 1 << 30
+
+_MEMO_MISS = object()
+
+def _digest_update(h, obj) -> None:
+    if isinstance(obj, LandmarkSet):
+        h.update(b'L')
+        _digest_update(h, [obj.names[i] for i in np.flatnonzero(obj.valid)])
+        h.update(np.ascontiguousarray(obj.xyz[obj.valid], dtype=float).tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"A{obj.dtype.str}{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'D%d' % len(obj))
+        for k in sorted(obj, key=str):
+            _digest_update(h, str(k))
+            _digest_update(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'T%d' % len(obj))
+        for v in obj:
+            _digest_update(h, v)
+    elif isinstance(obj, MeshCache):
+        h.update(b'M')
+    else:
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+
+def memo_key(*parts) -> str:
+    """内容寻址 key（blake2b-128）：LandmarkSet 只计有效行，ndarray 计 dtype/shape/字节，dict 按键排序。"""
+    import hashlib
+    h = hashlib.blake2b(digest_size=16)
+    _digest_update(h, (CODE_VERSION,) + parts)
+    return h.hexdigest()
+
+class ResultMemo:
+    """
+    root 为空：仅进程内 LRU；给出目录：再加一层磁盘缓存（多进程 / 多次运行共享）。
+    """
+    def __init__(self, root: Optional[str] = None, max_bytes: int = MEMO_DISK_MAX_BYTES,
+                 mem_bytes: int = MEMO_MEM_BYTES):
+        import threading
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.mem_bytes = int(mem_bytes)
+        self._mem: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._mem_used = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # 送往进程池时只带配置，不带内存条目
+        return {'root': self.root, 'max_bytes': self.max_bytes, 'mem_bytes': self.mem_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.pkl")
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_used -= len(old)
+            if len(blob) > self.mem_bytes:
+                return
+            self._mem[key] = blob
+            self._mem_used += len(blob)
+            while self._mem_used > self.mem_bytes:
+                _, ev = self._mem.popitem(last=False)
+                self._mem_used -= len(ev)
+
+    def get(self, key: str, default=None):
+        import pickle
+        with self._lock:
+            blob = self._mem.get(key)
+            if blob is not None:
+                self._mem.move_to_end(key)
+        if blob is None and self.root:
+            fn = self._file(key)
+            try:
+                with open(fn, 'rb') as f:
+                    blob = f.read()
+                os.utime(fn)   # LRU：命中即刷新 mtime
+            except OSError:
+                blob = None
+            if blob is not None:
+                self._remember(key, blob)
+        if blob is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(blob)
+
+    def put(self, key: str, value) -> None:
+        import pickle
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, blob)
+        if not self.root:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        fn = self._file(key)
+        tmp = f"{fn}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, fn)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.prune()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._mem_used = 0
+
+    def entries(self) -> List[Dict]:
+        """磁盘条目 [{key, files, bytes, mtime}]，按 mtime 升序（与 MeshCache.entries 同形）。"""
+        try:
+            it = list(os.scandir(self.root)) if self.root else []
+        except OSError:
+            return []
+        ents = []
+        for e in it:
+            if e.name.endswith('.pkl') and e.is_file():
+                st = e.stat()
+                ents.append({'key': e.name[:-4], 'files': [e.path], 'bytes': st.st_size, 'mtime': st.st_mtime})
+        return sorted(ents, key=lambda g: g['mtime'])
+
+    def prune(self, max_bytes: Optional[int] = None) -> Dict:
+        """淘汰最久未用的磁盘条目直到总量 ≤ max_bytes；返回 {'removed', 'bytes'}。"""
+        limit = self.max_bytes if max_bytes is None else int(max_bytes)
+        ents = self.entries()
+        total = sum(e['bytes'] for e in ents)
+        removed = 0
+        for e in ents:
+            if total <= limit:
+                break
+            try:
+                os.remove(e['files'][0])
+            except OSError:
+                pass
+            total -= e['bytes']
+            removed += 1
+        return {'removed': removed, 'bytes': total}
+
+_MEMO_INSTANCES: Dict[str, ResultMemo] = {}
+
+def _memo_instance(root: str, max_bytes: int) -> ResultMemo:
+    inst = _MEMO_INSTANCES.get(root)
+    if inst is None:
+        inst = _MEMO_INSTANCES[root] = ResultMemo(root or None, max_bytes)
+    return inst
+
+def memo_from_cfg(cfg: Optional[Dict]) -> Optional[ResultMemo]:
+    """
+    显式开启的结果 memo（坐标系 + 各项指标 + 接触报告）。cfg['memo']：ResultMemo / 目录 / True（仅内存）/ False；
+    缺省时读环境变量 LANDMARK_MEMO_CACHE，再缺省为 None。同一目录在进程内共用一个实例，内存层跨调用保留。
+    """
+    cfg = cfg or {}
+    m = cfg.get('memo')
+    if m is None:
+        m = os.environ.get(MEMO_ENV) or None
+    if m is False or m is None:
+        return None
+    if isinstance(m, ResultMemo):
+        return m
+    root = '' if m is True else os.path.abspath(str(m))
+    return _memo_instance(root, int(cfg.get('memo_max_bytes', MEMO_DISK_MAX_BYTES)))
+
+def frame_memo_from_cfg(cfg: Optional[Dict]) -> Optional[ResultMemo]:
+    """
+    坐标系用的 memo：显式开启时同 memo_from_cfg；未开启时为进程内 LRU，只缓存坐标系（每例一条，
+    命中省去 STL 读取 / 采样 / PCA）——逐项指标的 key 计算与序列化对首次计算的病例是纯开销，默认不做。
+    cfg['memo']=False 时为 None。
+    """
+    memo = memo_from_cfg(cfg)
+    if memo is not None or (cfg or {}).get('memo') is False:
+        return memo
+    return _memo_instance('', MEMO_DISK_MAX_BYTES)
+
+_ACTIVE_MEMO: 'contextvars.ContextVar[Optional[ResultMemo]]' = contextvars.ContextVar('landmark_memo', default=None)
+
+@contextlib.contextmanager
+def use_memo(memo: Optional[ResultMemo]):
+    """在该上下文内，被 @memoized_metric 修饰的 compute_* 读写 memo（线程 / asyncio 任务各自独立）。"""
+    token = _ACTIVE_MEMO.set(memo)
+    try:
+        yield memo
+    finally:
+        _ACTIVE_MEMO.reset(token)
+
+def memoized_metric(fn):
+    """compute_* 修饰器：key = (函数名, 地标内容, frame, 其余参数)；local 由前两者决定，不计入。"""
+    name = fn.__name__
+    @functools.wraps(fn)
+    def wrapper(landmarks, frame, *args, local=None, **kwargs):
+        memo = _ACTIVE_MEMO.get()
+        if memo is None or not frame:
+            return fn(landmarks, frame, *args, local=local, **kwargs)
+        key = memo_key('metric', name, as_landmark_set(landmarks), frame, args, kwargs)
+        hit = memo.get(key, _MEMO_MISS)
+        if hit is not _MEMO_MISS:
+            return hit
+        res = fn(landmarks, frame, *args, local=local, **kwargs)
+        memo.put(key, res)
+        return res
+    return wrapper
+
+# ================================
+# Stage tracer：按阶段记录墙钟时间、CPU 时间（当前线程）与峰值分配（tracemalloc）
+#   生效方式同 memo：use_tracer(tracer) 置入上下文，trace_stage(名) 在无 tracer 时为空操作
+#   阶段可嵌套；父阶段的峰值包含子阶段。事件在阶段结束时交给 callback（若有）
+#   峰值按进程统计：线程池并行的指标互相计入对方的峰值，只作量级参考
+# ================================
+class StageTracer:
+    """
+    events：[{name, cat, ts, dur, cpu, peak_bytes, tid, depth, args}]（秒 / 字节，ts 相对 tracer 创建时刻）
+    memory=False 时不启动 tracemalloc（其开销可达数倍），peak_bytes 为 None。
+    """
+    def __init__(self, callback=None, memory: bool = True):
+        import threading, time
+        self.callback = callback
+        self.memory = bool(memory)
+        self.events: List[Dict] = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._open: List[Dict] = []          # 尚未结束的阶段（各线程共用，用于峰值折叠）
+        self._local = threading.local()      # 每线程的阶段深度
+        self._owns_tracemalloc = False
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracemalloc = True
+
+    def close(self) -> None:
+        """停止由本 tracer 启动的 tracemalloc。"""
+        if self._owns_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+
+    def _fold_peak(self) -> None:
+        # 把上次重置以来的峰值计入所有未结束阶段，再重置，使嵌套阶段各自得到自己的峰值
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        for st in self._open:
+            st['peak'] = max(st['peak'], peak)
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, cat: str = 'stage', **args):
+        import threading, time
+        st = {'peak': 0, 'base': 0}
+        if self.memory:
+            import tracemalloc
+            with self._lock:
+                self._fold_peak()
+                st['base'] = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+                self._open.append(st)
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        t0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield args
+        finally:
+            dur, cpu = time.perf_counter() - t0, time.thread_time() - c0
+            self._local.depth = depth
+            peak = None
+            if self.memory:
+                with self._lock:
+                    self._fold_peak()
+                    self._open.remove(st)
+                    peak = max(0, st['peak'] - st['base'])
+                    for other in self._open:
+                        other['peak'] = max(other['peak'], st['peak'])
+            ev = {'name': name, 'cat': cat, 'ts': t0 - self._t0, 'dur': dur, 'cpu': cpu,
+                  'peak_bytes': peak, 'tid': threading.get_ident(), 'depth': depth, 'args': args}
+            with self._lock:
+                self.events.append(ev)
+            if self.callback is not None:
+                self.callback(ev)
+
+    def summary(self) -> List[Dict]:
+        """按开始时间排序的事件副本（JSON 可序列化）。"""
+        with self._lock:
+            evs = sorted(self.events, key=lambda e: e['ts'])
+        return [{**e, 'args': dict(e['args'])} for e in evs]
+
+    def chrome_trace(self) -> Dict:
+        """Chrome trace-event 格式（chrome://tracing / Perfetto 可直接打开）。"""
+        pid = os.getpid()
+        evs = []
+        for e in self.summary():
+            args = {'cpu_ms': round(e['cpu'] * 1e3, 3), **e['args']}
+            if e['peak_bytes'] is not None:
+                args['peak_kb'] = round(e['peak_bytes'] / 1024.0, 1)
+            evs.append({'name': e['name'], 'cat': e['cat'], 'ph': 'X', 'pid': pid, 'tid': e['tid'],
+                        'ts': round(e['ts'] * 1e6, 1), 'dur': round(e['dur'] * 1e6, 1), 'args': args})
+        return {'traceEvents': evs, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False, default=str)
+
+_ACTIVE_TRACER: 'contextvars.ContextVar[Optional[StageTracer]]' = contextvars.ContextVar('landmark_tracer', default=None)
+
+@contextlib.contextmanager
+def use_tracer(tracer: Optional[StageTracer]):
+    """在该上下文内，trace_stage 把阶段记入 tracer（线程池中的指标经 copy_context 同样可见）。"""
+    token = _ACTIVE_TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _ACTIVE_TRACER.reset(token)
+
+@contextlib.contextmanager
+def trace_stage(name: str, cat: str = 'stage', **args):
+    """无活动 tracer 时只 yield 一个空 dict（调用方可往里写附加信息，如 memo 命中）。"""
+    tracer = _ACTIVE_TRACER.get()
+    if tracer is None:
+        yield args
+        return
+    with tracer.stage(name, cat, **args) as a:
+        yield a
+
+def tracer_from_cfg(cfg: Optional[Dict]) -> Optional[StageTracer]:
+    """cfg['trace']：StageTracer / 可调用对象（逐事件回调）/ True；cfg['trace_memory']=False 关闭 tracemalloc。"""
+    t = (cfg or {}).get('trace')
+    if not t:
+        return None
+    if isinstance(t, StageTracer):
+        return t
+    return StageTracer(callback=t if callable(t) else None, memory=(cfg or {}).get('trace_memory', True))
+
 # =======================================================================
 # Module #0: Occlusal Frame
-# Input: landmarks (Dict), geom_points (Optional[List])
+# Input: landmarks (Dict / LandmarkSet), geom_points (Optional[np.ndarray (M,3)])
 # Output: Dict containing 'frame', 'quality', 'warnings', 'used'
 # Description: Constructs the occlusal coordinate system.
 #   - Uses molars (e.g., '26mb', '16mb') and incisors ('21m', '11m') to define axes.
@@ -81,16 +686,152 @@ def centroid(arr: List[np.ndarray]) -> Optional[np.ndarray]:
     arr = [a for a in arr if a is not None]
     return (np.mean(np.stack(arr, axis=0), axis=0) if arr else None)
 
-# ---------- picking helpers ----------
+# ---------- landmark storage ----------
 def _is_xyz(p) -> bool:
     return bool(isinstance(p, (list, tuple, np.ndarray)) and len(p) == 3 and np.isfinite(p).all())
 
-def pick_with_name(landmarks: Dict, candidates: List[str]) -> Optional[Dict]:
-    for k in candidates:
-        p = landmarks.get(k)
-        if _is_xyz(p):
-            return {'name': k, 'p': np.array(p, dtype=float)}
-    return None
+PROTOCOL_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'dict.json'))
+_PROTOCOL_CACHE: Dict[str, Tuple[Tuple[str, ...], Dict[str, int]]] = {}
+
+def landmark_protocol(path: Optional[str] = None) -> Tuple[Tuple[str, ...], Dict[str, int]]:
+    """
+    由 dict.json 协议展开固定的地标顺序：按牙位（teeth 的声明顺序）× 该牙型模板 code。
+    返回 (names, name→index)。协议文件缺失时返回空表（所有标签按“额外标签”追加）。
+    """
+    path = path or PROTOCOL_PATH
+    hit = _PROTOCOL_CACHE.get(path)
+    if hit is not None:
+        return hit
+    names: List[str] = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            proto = json.load(f)
+        templates = proto.get('landmark_templates', {})
+        for tooth, info in proto.get('teeth', {}).items():
+            for item in templates.get(info.get('type'), []):
+                names.append(f"{tooth}{item['code']}")
+    except (OSError, ValueError, KeyError, AttributeError):
+        names = []
+    names_t = tuple(dict.fromkeys(names))
+    hit = (names_t, {nm: i for i, nm in enumerate(names_t)})
+    _PROTOCOL_CACHE[path] = hit
+    return hit
+
+class LandmarkSet:
+    """
+    稠密地标表：names（协议顺序 + 额外标签）、xyz (N,3) float64、valid (N,) bool。
+    name→index 表来自 dict.json 协议，同协议的两个 LandmarkSet 可直接按行合并。
+    get()/pick() 返回 xyz 的行视图（调用方不得原地修改）。
+    """
+    __slots__ = ('names', 'index', 'xyz', 'valid')
+
+    def __init__(self, names: Tuple[str, ...], index: Dict[str, int], xyz: np.ndarray, valid: np.ndarray):
+        self.names = names
+        self.index = index
+        self.xyz = xyz
+        self.valid = valid
+
+    @classmethod
+    def empty(cls, extra: Optional[List[str]] = None) -> 'LandmarkSet':
+        names, index = landmark_protocol()
+        extra = [nm for nm in dict.fromkeys(extra or []) if nm not in index]
+        if extra:
+            names = names + tuple(extra)
+            index = {nm: i for i, nm in enumerate(names)}
+        n = len(names)
+        return cls(names, index, np.full((n, 3), np.nan), np.zeros(n, dtype=bool))
+
+    @classmethod
+    def from_mapping(cls, mapping: Optional[Dict]) -> 'LandmarkSet':
+        mapping = mapping or {}
+        labels = [str(k) for k in mapping]
+        out = cls.empty(labels)
+        if labels:
+            rows = np.fromiter((out.index[nm] for nm in labels), dtype=np.intp, count=len(labels))
+            pts = [mapping[k] if _is_xyz(mapping[k]) else (np.nan, np.nan, np.nan) for k in mapping]
+            out.xyz[rows] = np.asarray(pts, dtype=float)
+            out.valid[rows] = np.isfinite(out.xyz[rows]).all(axis=1)
+        return out
+
+    def get(self, name: str, default=None) -> Optional[np.ndarray]:
+        i = self.index.get(name)
+        if i is None or not self.valid[i]:
+            return default
+        return self.xyz[i]
+
+    def pick(self, candidates: List[str]) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """按候选顺序返回第一个有效点 (name, p)；都缺失则 (None, None)。"""
+        for nm in candidates:
+            i = self.index.get(nm)
+            if i is not None and self.valid[i]:
+                return nm, self.xyz[i]
+        return None, None
+
+    def merged(self, *others: 'LandmarkSet') -> 'LandmarkSet':
+        """后者覆盖前者；协议相同（无额外标签）时为整块 np.where。"""
+        sets = (self,) + others
+        if all(o.names is self.names for o in others):
+            out = LandmarkSet(self.names, self.index, self.xyz.copy(), self.valid.copy())
+            for o in others:
+                out.xyz[o.valid] = o.xyz[o.valid]
+                out.valid |= o.valid
+            return out
+        out = LandmarkSet.empty([nm for o in sets for nm in o.names])
+        for o in sets:
+            rows = np.fromiter((out.index[nm] for nm in o.names), dtype=np.intp, count=len(o.names))
+            out.xyz[rows[o.valid]] = o.xyz[o.valid]
+            out.valid[rows[o.valid]] = True
+        return out
+
+    def to_frame(self, frame: Dict) -> 'LandmarkSet':
+        """一次 (N,3)@(3,3) 把全部地标投到咬合坐标系：列为 (x=前后, y=左右, z=垂直)。"""
+        R = np.stack([np.asarray(frame[k], float) for k in ('ex', 'ey', 'ez')], axis=0)
+        local = (self.xyz - np.asarray(frame['origin'], float)) @ R.T
+        return LandmarkSet(self.names, self.index, local, self.valid)
+
+    def keys(self) -> List[str]:
+        return [self.names[i] for i in np.flatnonzero(self.valid)]
+
+    def items(self):
+        return [(self.names[i], self.xyz[i]) for i in np.flatnonzero(self.valid)]
+
+    def to_dict(self) -> Dict[str, List[float]]:
+        return {nm: p.tolist() for nm, p in self.items()}
+
+    def __contains__(self, name) -> bool:
+        i = self.index.get(name)
+        return i is not None and bool(self.valid[i])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        p = self.get(name)
+        if p is None:
+            raise KeyError(name)
+        return p
+
+    def __len__(self) -> int:
+        return int(self.valid.sum())
+
+    def __repr__(self) -> str:
+        return f"LandmarkSet({len(self)}/{len(self.names)} valid)"
+
+def as_landmark_set(landmarks) -> LandmarkSet:
+    """兼容入口：LandmarkSet 原样返回；{name: xyz} 字典转换一次。"""
+    return landmarks if isinstance(landmarks, LandmarkSet) else LandmarkSet.from_mapping(landmarks)
+
+def _local_table(landmarks, frame: Dict, local: Optional[LandmarkSet]) -> LandmarkSet:
+    """compute_* 内部：优先复用调用方传入的局部坐标表，否则现投影。"""
+    return local if local is not None else as_landmark_set(landmarks).to_frame(frame)
+
+def frame_local_coords(landmarks, frame: Optional[Dict]) -> Optional[LandmarkSet]:
+    """地标在咬合坐标系下的局部坐标表（与 landmarks 同索引）；frame 不完整时返回 None。"""
+    if not frame or any(frame.get(k) is None for k in ('origin', 'ex', 'ey', 'ez')):
+        return None
+    return as_landmark_set(landmarks).to_frame(frame)
+
+# ---------- picking helpers ----------
+def pick_with_name(landmarks, candidates: List[str]) -> Optional[Dict]:
+    nm, p = as_landmark_set(landmarks).pick(candidates)
+    return {'name': nm, 'p': p} if nm is not None else None
 
 # ---------- 正交收尾：强制正交 + 右手 ----------
 def _re_ortho_rh(ex: Optional[np.ndarray], ey: Optional[np.ndarray], ez: Optional[np.ndarray]) -> Dict[str, Optional[np.ndarray]]:
@@ -110,17 +851,29 @@ def _re_ortho_rh(ex: Optional[np.ndarray], ey: Optional[np.ndarray], ez: Optiona
     return {'ex': ex_n, 'ey': ey_n, 'ez': ez_n}
 
 # ---------- geometry-first plane estimation (two-pass PCA with trimming) ----------
-def _build_frame_from_geometry(points: Optional[List[np.ndarray]], cfg: Optional[Dict] = None) -> Optional[Dict]:
-    if not points or len(points) < 50:
+def _as_points(points) -> Optional[np.ndarray]:
+    """geom_points 兼容入口：(M,3) 数组（或视图）原样使用；点列表转换一次。"""
+    if points is None:
         return None
-    cfg = cfg or {}
-    max_points = int(cfg.get('maxPoints', 6000))
-    trim_pct  = float(np.clip(cfg.get('trimPct', 0.5), 0.2, 0.9))
+    P = points if isinstance(points, np.ndarray) else np.asarray(points, dtype=float)
+    return P.reshape(-1, 3) if P.size else None
 
-    P = np.array(points, dtype=float)
+def _geometry_subsample(P: np.ndarray, cfg: Dict) -> np.ndarray:
+    """几何 PCA 的输入：超过 cfg['maxPoints']（默认 6000）时带种子随机下采样，转 float64。"""
+    max_points = int(cfg.get('maxPoints', 6000))
     if len(P) > max_points:
-        idx = np.random.choice(len(P), size=max_points, replace=False)  # 随机下采样避免结构性偏差
-        P = P[idx]
+        # 带种子的随机下采样：避免结构性偏差，且多次运行/多进程结果一致
+        P = P[sample_point_indices(P, max_points, mode='random', seed=int(cfg.get('seed', 0)))]
+    return P.astype(float, copy=False)   # 子样本上以 float64 计算
+
+def _build_frame_from_geometry(points, cfg: Optional[Dict] = None) -> Optional[Dict]:
+    P = _as_points(points)
+    if P is None or len(P) < 50:
+        return None
+    cfg = cfg or {}
+    trim_pct  = float(np.clip(cfg.get('trimPct', 0.5), 0.2, 0.9))
+    n_all = len(P)
+    P = _geometry_subsample(P, cfg)
 
     # 粗 PCA
     c0 = np.mean(P, axis=0)
@@ -131,13 +884,17 @@ def _build_frame_from_geometry(points: Optional[List[np.ndarray]], cfg: Optional
     e1, e2 = V[:,0], V[:,1]
     ez0 = v_nrm(v_cross(e1, e2))  # 初估法向
 
-    # 按法向距截尾，二次 PCA
+    # 按法向距截尾（argpartition 选最近的 keep_n 个，无需全排序），二次 PCA
     d = np.abs(X @ ez0) if ez0 is not None else np.zeros(len(X))
-    keep_n = max(100, int(len(d) * trim_pct))
-    P_trim = P[np.argsort(d)[:keep_n]]
+    keep_n = min(len(d), max(100, int(len(d) * trim_pct)))
+    P_trim = P[np.argpartition(d, keep_n - 1)[:keep_n]] if keep_n < len(d) else P
     c1 = np.mean(P_trim, axis=0)
     X1 = P_trim - c1
     cov1 = np.cov(X1, rowvar=False)
+    return _plane_frame_from_moments(c1, cov1, keep_n, n_all)
+
+def _plane_frame_from_moments(c1: np.ndarray, cov1: np.ndarray, n_in: int, n_all: int) -> Dict:
+    """截尾后的均值/协方差 → 几何基座 frame（内存路径与流式路径共用）。"""
     w1, V1 = np.linalg.eigh(cov1)
     V1 = V1[:, np.argsort(w1)[::-1]]
     e1_1, e2_1 = V1[:,0], V1[:,1]
@@ -158,46 +915,186 @@ def _build_frame_from_geometry(points: Optional[List[np.ndarray]], cfg: Optional
         'frame': {'origin': c1, 'ex': ex_g, 'ey': ey_g, 'ez': ez_g},
         'quality': 'ok',
         'warnings': warnings,
-        'used': {'n_in': int(keep_n), 'n_all': int(len(points))}
+        'used': {'n_in': int(n_in), 'n_all': int(n_all)}
     }
 
+# ---------- streaming plane estimation（超大扫描：分块读三角形，固定内存，不预先随机下采样） ----------
+STREAM_CHUNK_TRIS = 1 << 18     # 每块三角形数（float64 顶点约 19 MB）
+STREAM_TRIM_BINS = 2048         # 截尾用的法向距分箱数
+
+def _iter_stl_vertex_chunks(paths: List[str], chunk_tris: int = STREAM_CHUNK_TRIS):
+    """
+    逐块产出 (k,3) float64 顶点（三角形角点，未焊接）。二进制 STL 为 memmap 切片，内存与文件大小无关；
+    内置读取器不认识的格式退回整体加载焊接后的顶点再分块。
+    """
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        T = _read_stl_triangles(path)
+        if T is None:
+            mesh = _load_stl_mesh(path)
+            if mesh is None:
+                continue
+            V = mesh[0]
+            for i in range(0, len(V), chunk_tris * 3):
+                yield np.asarray(V[i:i + chunk_tris * 3], dtype=float)
+            continue
+        for i in range(0, len(T), chunk_tris):
+            X = np.asarray(T[i:i + chunk_tris], dtype=float).reshape(-1, 3)
+            yield X[np.isfinite(X).all(axis=1)]
+
+class _MomentAccumulator:
+    """一遍扫描的均值/协方差：块内直接求，块间用 Chan 等的成对合并公式（数值稳定，O(1) 内存）。"""
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(3)
+        self.M2 = np.zeros((3, 3))
+        self.lo = np.full(3, np.inf)
+        self.hi = np.full(3, -np.inf)
+
+    def add(self, X: np.ndarray) -> None:
+        nb = len(X)
+        if nb == 0:
+            return
+        mb = X.mean(axis=0)
+        Xc = X - mb
+        delta = mb - self.mean
+        n = self.n + nb
+        self.M2 += Xc.T @ Xc + np.outer(delta, delta) * (self.n * nb / n)
+        self.mean = self.mean + delta * (nb / n)
+        self.n = n
+        self.lo = np.minimum(self.lo, X.min(axis=0))
+        self.hi = np.maximum(self.hi, X.max(axis=0))
+
+    def cov(self) -> np.ndarray:
+        return self.M2 / max(self.n - 1, 1)
+
+def _build_frame_from_stl_stream(paths: List[str], cfg: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    与 _build_frame_from_geometry 同口径的两次 PCA，但两遍流式扫描 STL：
+      第 1 遍：累积全量均值/协方差 → 初估法向 ez0，同时记录包围盒；
+      第 2 遍：按 |d|=|(p-c0)·ez0| 分箱（上界由包围盒角点给出），每箱累积计数、一阶和、二阶和；
+      截尾：按累计计数取到 trimPct 分位（分位所在箱按比例计入），由箱内矩合成截尾均值/协方差。
+    顶点按三角形角点计入（共享顶点按其所属三角形数加权），不做随机下采样。
+    """
+    cfg = cfg or {}
+    trim_pct = float(np.clip(cfg.get('trimPct', 0.5), 0.2, 0.9))
+    chunk = int(cfg.get('streamChunkTris', STREAM_CHUNK_TRIS))
+    nb = int(cfg.get('streamTrimBins', STREAM_TRIM_BINS))
+
+    acc = _MomentAccumulator()
+    for X in _iter_stl_vertex_chunks(paths, chunk):
+        acc.add(X)
+    if acc.n < 50:
+        return None
+    c0 = acc.mean
+    w, V = np.linalg.eigh(acc.cov())
+    V = V[:, np.argsort(w)[::-1]]
+    ez0 = v_nrm(v_cross(V[:, 0], V[:, 1]))
+    if ez0 is None:
+        return None
+
+    corners = np.array(np.meshgrid(*zip(acc.lo, acc.hi), indexing='ij')).reshape(3, -1).T
+    dmax = float(np.abs((corners - c0) @ ez0).max()) + EPS
+    cnt = np.zeros(nb)
+    s1 = np.zeros((nb, 3))
+    s2 = np.zeros((nb, 3, 3))
+    iu = [(i, j) for i in range(3) for j in range(i, 3)]
+    for X in _iter_stl_vertex_chunks(paths, chunk):
+        Y = X - c0                                    # 以 c0 为中心累积，避免大数相消
+        b = np.minimum((np.abs(Y @ ez0) / dmax * nb).astype(np.intp), nb - 1)
+        cnt += np.bincount(b, minlength=nb)
+        for k in range(3):
+            s1[:, k] += np.bincount(b, weights=Y[:, k], minlength=nb)
+        for i, j in iu:
+            s2[:, i, j] += np.bincount(b, weights=Y[:, i] * Y[:, j], minlength=nb)
+    for i, j in iu:
+        s2[:, j, i] = s2[:, i, j]
+
+    keep_n = min(acc.n, max(100, int(acc.n * trim_pct)))
+    cum = np.cumsum(cnt)
+    k = int(np.searchsorted(cum, keep_n))
+    below = cum[k - 1] if k > 0 else 0.0
+    frac = (keep_n - below) / cnt[k] if cnt[k] > 0 else 0.0
+    n1 = below + frac * cnt[k]
+    S1 = s1[:k].sum(axis=0) + frac * s1[k]
+    S2 = s2[:k].sum(axis=0) + frac * s2[k]
+    m1 = S1 / n1
+    cov1 = (S2 - n1 * np.outer(m1, m1)) / max(n1 - 1.0, 1.0)
+    res = _plane_frame_from_moments(c0 + m1, cov1, int(round(n1)), acc.n)
+    res['used']['stream'] = True
+    return res
+
 # ---------- 主函数 ----------
 def build_occlusal_frame(
     landmarks: Dict,
-    geom_points: Optional[List[np.ndarray]] = None,
+    geom_points: Optional[np.ndarray] = None,
     cfg: Optional[Dict] = None,
     selectors: Optional[Dict[str, List[str]]] = None,
+    geom_base: Optional[Dict] = None,
+    trace=None,
 ) -> Dict:
     """
-    landmarks: { landmark_name -> [x,y,z] }
-    geom_points: 点云（可选）。>=50 则用于估计咬合平面与原点（几何基座）
+    landmarks: { landmark_name -> [x,y,z] } 或 LandmarkSet
+    geom_points: 点云 (M,3) 数组（可选；点列表亦可）。>=50 则用于估计咬合平面与原点（几何基座）
+    geom_base: 已算好的几何基座（如 _build_frame_from_stl_stream 的结果）；给出时忽略 geom_points
     selectors: 可覆盖默认候选（严格对齐字典命名）
+    返回中的 'local' 为全部地标的局部坐标表（LandmarkSet，frame 缺失时为 None），
+    供 make_brief_report / compute_* 复用，各模块不再逐点投影。
+    trace：StageTracer / 回调 / True（事件列表放在返回的 '_trace' 下）；缺省沿用上下文中的 tracer。
     """
+    tracer = tracer_from_cfg({'trace': trace}) or _ACTIVE_TRACER.get()
+    with use_tracer(tracer):
+        landmarks = as_landmark_set(landmarks)
+        if geom_base is None:
+            P = _as_points(geom_points)
+            if P is not None and len(P) >= 50:
+                with trace_stage('geometry_pca', points=len(P)):
+                    geom_base = _build_frame_from_geometry(P, cfg)
+        with trace_stage('frame_axes'):
+            res = _build_frame_axes(landmarks, geom_base, cfg, selectors)
+        with trace_stage('local_coords'):
+            res['local'] = frame_local_coords(landmarks, res.get('frame'))
+    if trace and not isinstance(trace, StageTracer):
+        tracer.close()
+        if trace is True:
+            res['_trace'] = tracer.summary()
+    res['geom_base'] = geom_base   # 供增量重算（update_landmarks）复用，地标变动不必重读 STL
+    return res
+
+# —— 默认候选（严格对齐你的字典命名）——
+FRAME_SELECTORS: Dict[str, List[str]] = {
+    # 左/右第一磨牙（上或下均可）：只用 mb / db / bg
+    'L6': ['26mb','26db','26bg','36mb','36db','36bg'],
+    'R6': ['16mb','16db','16bg','46mb','46db','46bg'],
+    # 上/下切牙：m / ma
+    'U11': ['11m','11ma'],
+    'U21': ['21m','21ma'],
+    'L31': ['31m','31ma'],
+    'L41': ['41m','41ma'],
+    # 下颌犬牙：m / mc（用于 Y 极性）
+    'L33': ['33m','33mc'],
+    'R43': ['43m','43mc'],
+}
+FRAME_LANDMARKS = frozenset(nm for cands in FRAME_SELECTORS.values() for nm in cands)
+
+def _build_frame_axes(
+    landmarks: LandmarkSet,
+    base: Optional[Dict],
+    cfg: Optional[Dict],
+    selectors: Optional[Dict[str, List[str]]],
+) -> Dict:
     cfg = cfg or {}
     warnings: List[str] = []
     used_names: List[str] = []
     used_meta: Dict[str, Optional[str]] = {'plane': None, 'z_from': None, 'y_from': None, 'x_from': None}
     quality = 'ok'
 
-    # —— 默认候选（严格对齐你的字典命名）——
-    sel = {
-        # 左/右第一磨牙（上或下均可）：只用 mb / db / bg
-        'L6': ['26mb','26db','26bg','36mb','36db','36bg'],
-        'R6': ['16mb','16db','16bg','46mb','46db','46bg'],
-        # 上/下切牙：m / ma
-        'U11': ['11m','11ma'],
-        'U21': ['21m','21ma'],
-        'L31': ['31m','31ma'],
-        'L41': ['41m','41ma'],
-        # 下颌犬牙：m / mc（用于 Y 极性）
-        'L33': ['33m','33mc'],
-        'R43': ['43m','43mc'],
-    }
+    sel = dict(FRAME_SELECTORS)
     if selectors:
         sel.update({k: v for k, v in selectors.items() if isinstance(v, list)})
 
     # 0) 几何基座：优先用点云决定“面与原点”
-    base = _build_frame_from_geometry(geom_points, cfg) if (geom_points and len(geom_points) >= 50) else None
     if base and base.get('frame'):
         origin = np.array(base['frame']['origin'], dtype=float)
         ez = np.array(base['frame']['ez'], dtype=float)
@@ -315,6 +1212,7 @@ def build_occlusal_frame(
 # =======================================================================
 # Module #1: Arch Form
 # =======================================================================
+@memoized_metric
 def compute_arch_form(
     landmarks: Dict[str, List[float]],
     frame: Dict,
@@ -325,6 +1223,7 @@ def compute_arch_form(
     th_icim_square:  float = 0.80,
     th_adic_tapered: float = 0.80,
     th_adic_square:  float = 0.60,
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #1 Arch Form
@@ -332,17 +1231,14 @@ def compute_arch_form(
     Output: Dict {'form', 'indices', 'used', 'summary_text', 'quality'}
     Method: Calculates ICW (inter-canine width), IMW (inter-molar width), AD (arch depth) to classify form. Uses points: 13m, 23m, 16mb, 26mb, 11m, 21m, 12m, 22m.
     """
-    def _is_xyz(p): return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm);  return np.asarray(p,float) if _is_xyz(p) else None
-    def _xy(p):
-        v = np.asarray(p,float) - np.asarray(frame['origin'],float)
-        ex = np.asarray(frame['ex'],float); ey = np.asarray(frame['ey'],float)
-        return float(v.dot(ex)), float(v.dot(ey))   # x=前后, y=左右(左+右-)
-
     if arch != 'upper' or not frame or any(k not in frame for k in ('origin','ex','ey','ez')):
         return {'form':'缺失','indices':{},'used':{},'summary_text':'Arch_Form_牙弓形态*: 缺失','quality':'missing'}
 
+    # 全部在局部坐标下取点（质心在投影前后等价）
+    _get = _local_table(landmarks, frame, local).get
+    def _xy(p):
+        return float(p[0]), float(p[1])   # x=前后, y=左右(左+右-)
+
     used = {}
     # 取关键点（严格用字典键，含回退）
     def _pick_first(names: List[str]):
@@ -413,12 +1309,14 @@ def compute_arch_form(
 # =======================================================================
 # Module #2: Arch Width
 # =======================================================================
+@memoized_metric
 def compute_arch_width(
     landmarks: Dict[str, List[float]],
     frame: Dict,
     dec: int = 1,
     ap_tol_mm: float = 4.0,         # 若 |Δx| 超过此阈值，提示可能失真
-    narrow_delta_mm: float = 2.0    # 判定“上牙弓较窄”的每段最小差值
+    narrow_delta_mm: float = 2.0,   # 判定“上牙弓较窄”的每段最小差值
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #2 Arch Width
@@ -426,20 +1324,14 @@ def compute_arch_width(
     Output: Dict {'upper', 'lower', 'diff_UL_mm', 'upper_is_narrow', 'summary_text', 'quality'}
     Method: Measures transverse width at canine, premolar, and molar sections for both arches. Uses points: 13m/23m, 14b/24b, 16mb/26mb and their lower counterparts.
     """
-    def _is_xyz(p):
-        return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm)
-        return np.asarray(p,float) if _is_xyz(p) else None
-    def _to_local(p):
-        v = np.asarray(p,float) - np.asarray(frame['origin'],float)
-        ex = np.asarray(frame['ex'],float); ey = np.asarray(frame['ey'],float)
-        return float(v.dot(ex)), float(v.dot(ey))  # x(AP), y(Transverse)
-
     if not frame or any(k not in frame for k in ('origin','ex','ey','ez')):
         return {'upper':None,'lower':None,'diff_UL_mm':None,'upper_is_narrow':None,
                 'summary_text':'Arch_Width_牙弓宽度*: 缺失','quality':'missing'}
 
+    _get = _local_table(landmarks, frame, local).get
+    def _to_local(p):
+        return float(p[0]), float(p[1])  # x(AP), y(Transverse)
+
     # 选择器（严格用字典键）
     U = {
         'ant': (['13m'], ['23m']),
@@ -536,10 +1428,12 @@ def compute_arch_width(
 # Output: Dict {'kind', 'anterior', 'overall', 'quality', 'used', 'summary_text'}
 # Method: Calculates anterior and overall Bolton ratios by summing mesiodistal widths (mc-dc) of teeth.
 # -----------------------------------------------------------------------
+@memoized_metric
 def compute_bolton(
     landmarks: Dict[str, List[float]],
     frame: Optional[Dict] = None,
-    cfg: Optional[Dict] = None
+    cfg: Optional[Dict] = None,
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     cfg = cfg or {}
     mode = cfg.get('mode', 'plane')        # 'plane' or '3d'
@@ -551,26 +1445,19 @@ def compute_bolton(
     min_A    = int(cfg.get('min_anterior', 5))  # 至少6颗中的5颗
     min_O    = int(cfg.get('min_overall', 10))  # 至少12颗中的10颗
 
-    def _is_xyz(p):
-        return isinstance(p, (list, tuple, np.ndarray)) and len(p) == 3 and np.isfinite(p).all()
-
-    def _pick(nm):
-        p = landmarks.get(nm)
-        return np.asarray(p, float) if _is_xyz(p) else None
+    lm = as_landmark_set(landmarks)
+    plane = (mode == 'plane' and bool(frame))
+    # plane 口径直接在局部坐标表上取点（取 XY 两列）；3D 口径用原始坐标
+    _pick = _local_table(lm, frame, local).get if plane else lm.get
 
     def _width_md(tooth: str) -> Tuple[Optional[float], Optional[str]]:
         """返回 (宽度mm, 使用的键名串)；按 cfg['mode'] 在 XY 或 3D 量 mc↔dc"""
         pm = _pick(f'{tooth}mc'); pd = _pick(f'{tooth}dc')
         if pm is None or pd is None:
             return None, None
-        if mode == 'plane' and frame:
+        if plane:
             # 投影到XY平面再算距离（与 JS 默认口径一致）
-            o = np.asarray(frame['origin'], float)
-            ex = np.asarray(frame['ex'], float); ey = np.asarray(frame['ey'], float)
-            vm = pm - o; vd = pd - o
-            m_xy = np.array([vm.dot(ex), vm.dot(ey)], float)
-            d_xy = np.array([vd.dot(ex), vd.dot(ey)], float)
-            w = float(np.linalg.norm(m_xy - d_xy))
+            w = float(np.linalg.norm(pm[:2] - pd[:2]))
         else:
             # 3D 欧氏距离
             w = float(np.linalg.norm(pm - pd))
@@ -662,6 +1549,7 @@ def compute_bolton(
 # =======================================================================
 # Module #4: Canine Relationship
 # =======================================================================
+@memoized_metric
 def compute_canine_relationship(
     landmarks: Dict[str, List[float]],
     frame: Dict,
@@ -669,7 +1557,8 @@ def compute_canine_relationship(
     alpha: float = 0.35,      # 弓段比例（m → 同侧第一前磨牙mc）
     beta_mm: float = 1.5,     # 固定后退（仅X）
     tol_edge_mm: float = 0.5, # 尖对尖容差
-    complete_mm: float = 2.0  # 完全近/远中阈值
+    complete_mm: float = 2.0, # 完全近/远中阈值
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #4 Canine Relationship
@@ -677,19 +1566,13 @@ def compute_canine_relationship(
     Output: Dict {'right', 'left', 'summary_text', 'quality', 'params'}
     Method: Compares the anteroposterior position (X-axis) of upper canine (13m/23m) with a proxy for the lower canine embrasure.
     """
-    def _is_xyz(p): 
-        return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm)
-        return (np.asarray(p,float) if _is_xyz(p) else None)
-    def _x(p):
-        v = p - np.asarray(frame['origin'],float)
-        ex = np.asarray(frame['ex'],float)
-        return float(v.dot(ex))
-
     if not frame or any(k not in frame for k in ('origin','ex','ey','ez')):
         return {'right':None,'left':None,'summary_text':'Canine_Relationship_尖牙关系*: 缺失','quality':'missing','params':{'alpha':alpha,'beta_mm':beta_mm,'tol_edge_mm':tol_edge_mm,'complete_mm':complete_mm}}
 
+    _get = _local_table(landmarks, frame, local).get
+    def _x(p):
+        return float(p[0])
+
     def lower_dmr_proxy(side: str):
         """
         side: 'right' or 'left'
@@ -773,11 +1656,13 @@ def compute_canine_relationship(
 # Output: Dict {'right', 'left', 'summary_text', 'threshold_mm', 'quality', 'used'}
 # Method: Compares the transverse position (Y-axis) of buccal and lingual cusps of posterior teeth (premolars and molars) on each side.
 # =======================================================================
+@memoized_metric
 def compute_crossbite(
     landmarks: Dict,
     frame: Dict,
     threshold_mm: float = 1.5,
     min_pairs: int = 2,
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Crossbite_锁牙合（按侧判定）
@@ -787,19 +1672,13 @@ def compute_crossbite(
     颊侧候选：mb, db, b, bg；舌侧候选：ml, dl, l, lgb
     返回 status: '无' | '正锁' | '反锁' | 'missing'
     """
-    def _is_xyz(p):
-        return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm)
-        return np.asarray(p,float) if _is_xyz(p) else None
-    def _y_local(p):
-        v = p - np.asarray(frame['origin'],float)
-        ey = np.asarray(frame['ey'],float)
-        return float(v.dot(ey))
-
     if not frame or any(k not in frame for k in ('origin','ex','ey','ez')):
         return {'right':None,'left':None,'summary_text':'Crossbite_锁牙合: 缺失','threshold_mm':threshold_mm,'quality':'missing','used':{'points':[]}}
 
+    _get = _local_table(landmarks, frame, local).get
+    def _y_local(p):
+        return float(p[1])
+
     # 牙位（FDI）
     U_right, L_right = ['14','15','16','17'], ['44','45','46','47']
     U_left , L_left  = ['24','25','26','27'], ['34','35','36','37']
@@ -906,6 +1785,7 @@ def compute_crossbite(
 # =======================================================================
 # Module #6: Crowding
 # =======================================================================
+@memoized_metric
 def compute_crowding(
     landmarks: Dict[str, List[float]],
     frame: Optional[Dict] = None,
@@ -914,6 +1794,7 @@ def compute_crowding(
     dec: int = 1,                # 小数位
     min_pairs: int = 3,          # 至少3个相邻对参与
     min_teeth: int = 4,          # 至少4颗牙参与宽度
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #6 Crowding
@@ -921,18 +1802,15 @@ def compute_crowding(
     Output: Dict {'upper', 'lower', 'summary_text', 'quality'}
     Method: Calculates Arch Length Discrepancy (ALD) for anterior segments by comparing available space (sum of contact point distances) with required space (sum of tooth widths). Uses points: 23-13 (upper) and 33-43 (lower) series, including mc, mr, m, dc, dr.
     """
-    def _is_xyz(p): return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm)
-        return np.asarray(p,float) if _is_xyz(p) else None
+    lm = as_landmark_set(landmarks)
+    # 平面口径：直接在局部坐标表上取点（_to_xy 只取 XY 两列）；3D 口径用原始坐标
+    plane = use_plane and frame is not None
+    _get = _local_table(lm, frame, local).get if plane else lm.get
 
     def _to_xy(p):
-        if not use_plane or frame is None:  # 3D 直接返回
-            return np.asarray(p,float)
-        o = np.asarray(frame['origin'],float)
-        ex = np.asarray(frame['ex'],float); ey = np.asarray(frame['ey'],float)
-        v = np.asarray(p,float) - o
-        return np.array([v.dot(ex), v.dot(ey)], float)  # 仅用 XY
+        if not plane:  # 3D 直接返回
+            return p
+        return p[:2]  # 仅用 XY
 
     # 前牙序列（FDI）
     U_ANT = ['23','22','21','11','12','13']   # 上
@@ -1063,28 +1941,21 @@ def compute_crowding(
 # Output: Dict {'depth_mm', 'used', 'quality'}
 # Method: Measures the maximum perpendicular distance from the lower cusp tips to a chord from the incisors (31/41) to the most posterior molar (37/47).
 # =======================================================================
-def compute_spee(landmarks: Dict, frame: Dict, dec: int = 1) -> Optional[float]:
+@memoized_metric
+def compute_spee(landmarks: Dict, frame: Dict, dec: int = 1,
+                 local: Optional[LandmarkSet] = None) -> Optional[float]:
     if not frame or any(k not in frame for k in ('origin','ex','ez')):
         return None
 
-    origin = np.asarray(frame['origin'], float)
-    ex = np.asarray(frame['ex'], float)   # AP 轴
-    ez = np.asarray(frame['ez'], float)   # Vertical 轴
     EPS = 1e-9
 
-    def _get(nm):
-        p = landmarks.get(nm)
-        if isinstance(p, (list, tuple, np.ndarray)) and len(p)==3 and np.isfinite(p).all():
-            return np.asarray(p, float)
-        return None
+    # 局部坐标表：列 0 = AP 轴，列 2 = Vertical 轴
+    loc = _local_table(landmarks, frame, local)
+    _get = loc.get
     def _pick(names: List[str]):
-        for nm in names:
-            p = _get(nm)
-            if p is not None: return p
-        return None
+        return loc.pick(names)[1]
     def _xz(p):
-        v = p - origin
-        return float(v.dot(ex)), float(v.dot(ez))
+        return float(p[0]), float(p[2])
 
     # A：下切牙前端
     p31ma, p41ma = _get('31ma'), _get('41ma')
@@ -1144,11 +2015,13 @@ def compute_spee(landmarks: Dict, frame: Dict, dec: int = 1) -> Optional[float]:
 # =======================================================================
 # Module #8: Midline Alignment
 # =======================================================================
+@memoized_metric
 def compute_midline_alignment(
     landmarks: Dict[str, List[float]],
     frame: Dict,
     threshold_mm: float = 1.0,
-    dec: int = 1
+    dec: int = 1,
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #8 Midline Alignment
@@ -1156,18 +2029,11 @@ def compute_midline_alignment(
     Output: Dict {'is_pass', 'upper', 'lower', 'quality', 'summary_text'}
     Method: Measures the transverse deviation (Y-axis) of the upper (11-21) and lower (31-41) midline points from the frame's sagittal plane. Uses points: 11ma, 21ma, 11m, 21m, 31ma, 41ma, 31m, 41m.
     """
-    def _is_xyz(p):
-        return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _pick(nm):
-        p = landmarks.get(nm)
-        return np.asarray(p,float) if _is_xyz(p) else None
     def _mid2(a, b):
         if a is not None and b is not None: return 0.5*(a+b)
         return a if a is not None else b  
     def _y_local(p):
-        v = p - np.asarray(frame['origin'],float)
-        ey = np.asarray(frame['ey'],float)
-        return float(v.dot(ey))
+        return float(p[1])
 
     if not frame or any(k not in frame for k in ('origin','ex','ey','ez')):
         return {
@@ -1179,6 +2045,7 @@ def compute_midline_alignment(
             'quality': 'missing',
         }
 
+    _pick = _local_table(landmarks, frame, local).get
     U = _mid2(_pick('11ma'), _pick('21ma'))
     if U is None:
         U = _mid2(_pick('11m'), _pick('21m'))
@@ -1234,10 +2101,12 @@ def compute_midline_alignment(
 # =======================================================================
 # Module #9: Molar Relationship
 # =======================================================================
+@memoized_metric
 def compute_molar_relationship(
     landmarks: Dict[str, List[float]],
     frame: Dict,
-    dec: int = 1
+    dec: int = 1,
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #9 Molar Relationship
@@ -1252,20 +2121,8 @@ def compute_molar_relationship(
     COMPLETE_DISTAL_RANGE = {'min': 2.5, 'max': 7.5}
 
     # --- 辅助函数 ---
-    def _is_xyz(p):
-        return isinstance(p, (list, tuple, np.ndarray)) and len(p) == 3 and np.isfinite(p).all()
-
-    def _pick(names: List[str]):
-        for nm in names:
-            p = landmarks.get(nm)
-            if _is_xyz(p):
-                return nm, np.asarray(p, float)
-        return None, None
-
     def _x_local(p):
-        v = p - np.asarray(frame['origin'], float)
-        ex = np.asarray(frame['ex'], float)
-        return float(v.dot(ex))
+        return float(p[0])
 
     # --- 主逻辑 ---
     if not frame or any(k not in frame for k in ('origin', 'ex', 'ey', 'ez')):
@@ -1275,7 +2132,8 @@ def compute_molar_relationship(
             'summary_text': 'Molar_Relationship_磨牙关系*: 缺失'
         }
 
-    # --- 地标点拾取 ---
+    # --- 地标点拾取（局部坐标） ---
+    _pick = _local_table(landmarks, frame, local).pick
     # 右侧: 上16mb(颊尖) vs 下46mb(颊尖)
     uR_name, uR = _pick(['16mb', '16db', '16bg'])
     lR_name, lR = _pick(['46mb', '46bg']) # 下颌改为颊尖，更符合安氏分类比较
@@ -1331,6 +2189,7 @@ def compute_molar_relationship(
 # =======================================================================
 # Module #10: Overbite
 # =======================================================================
+@memoized_metric
 def compute_overbite(
     landmarks: Dict[str, List[float]],
     frame: Dict,
@@ -1338,7 +2197,8 @@ def compute_overbite(
     # 口径阈值（可按人群调参）
     normal_low_mm: float = 1.0,   # 正常下限
     normal_high_mm: float = 4.0,  # 正常上限
-    deep_mm: float = 5.0          # ≥ 深覆
+    deep_mm: float = 5.0,         # ≥ 深覆
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #10 Overbite
@@ -1346,15 +2206,10 @@ def compute_overbite(
     Output: Dict {'value_mm', 'category', 'summary_text', 'quality', ...}
     Method: Measures the vertical overlap (Z-axis) between upper (11/21) and lower (41/31) incisal edges. Uses points: 11m, 11ma, 21m, 21ma, 41m, 31m.
     """
-    def _is_xyz(p): 
-        return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm); 
-        return np.asarray(p,float) if _is_xyz(p) else None
+    lm = as_landmark_set(landmarks)
+    _get = lm.get
     def _z_local(p):
-        v = p - np.asarray(frame['origin'],float)
-        ez = np.asarray(frame['ez'],float)
-        return float(v.dot(ez))
+        return float(p[2])
     def _euclid(a,b):
         return float(np.linalg.norm(np.asarray(a,float)-np.asarray(b,float)))
 
@@ -1365,15 +2220,12 @@ def compute_overbite(
                 'category': '缺失', 'summary_text': 'Overbite_前牙覆𬌗*: 缺失', 'quality': 'missing',
                 'used': {}}
 
-    # 取点（优先 m，切角 ma 作为回退仅在上中切牙；下切牙用 m）
-    U11 = _get('11m')
-    if U11 is None:
-        U11 = _get('11ma')
-    U21 = _get('21m')
-    if U21 is None:
-        U21 = _get('21ma')
-    L41 = _get('41m')
-    L31 = _get('31m')
+    # 取点（优先 m，切角 ma 作为回退仅在上中切牙；下切牙用 m）；覆𬌗量用局部坐标
+    loc = _local_table(lm, frame, local)
+    U11 = loc.pick(['11m', '11ma'])[1]
+    U21 = loc.pick(['21m', '21ma'])[1]
+    L41 = loc.get('41m')
+    L31 = loc.get('31m')
 
     quality = 'ok'
     if (U11 is None or L41 is None) or (U21 is None or L31 is None):
@@ -1386,9 +2238,9 @@ def compute_overbite(
     right = _side(U11, L41)
     left  = _side(U21, L31)
 
-    # 下中切牙冠高（欧氏距离，m ↔ bgb）
-    CH_right = (_euclid(L41, _get('41bgb')) if (L41 is not None and _get('41bgb') is not None) else None)
-    CH_left  = (_euclid(L31, _get('31bgb')) if (L31 is not None and _get('31bgb') is not None) else None)
+    # 下中切牙冠高（原始坐标欧氏距离，m ↔ bgb）
+    CH_right = (_euclid(_get('41m'), _get('41bgb')) if (L41 is not None and _get('41bgb') is not None) else None)
+    CH_left  = (_euclid(_get('31m'), _get('31bgb')) if (L31 is not None and _get('31bgb') is not None) else None)
 
     ratio_right = (right / CH_right) if (right is not None and CH_right and CH_right>1e-6) else None
     ratio_left  = (left  / CH_left ) if (left  is not None and CH_left  and CH_left >1e-6) else None
@@ -1447,6 +2299,7 @@ def compute_overbite(
 # =======================================================================
 # Module #11: Overjet
 # =======================================================================
+@memoized_metric
 def compute_overjet(
     landmarks: Dict[str, List[float]],
     frame: Dict,
@@ -1454,7 +2307,8 @@ def compute_overjet(
     zero_tol_mm: float = 0.3,   # |OJ| ≤ 0.3 视为“对刃”
     normal_low_mm: float = 1.0, # 正常 1–4 mm（可调）
     normal_high_mm: float = 4.0,
-    deep_mm: float = 5.0        # ≥5 mm 视为“深覆盖”
+    deep_mm: float = 5.0,       # ≥5 mm 视为“深覆盖”
+    local: Optional[LandmarkSet] = None,
 ) -> Dict:
     """
     Module: #11 Overjet
@@ -1462,21 +2316,15 @@ def compute_overjet(
     Output: Dict {'value_mm', 'category', 'summary_text', 'quality', ...}
     Method: Measures the horizontal overlap (X-axis) between the upper incisal edge and the lower incisor labial face. Uses points: 11m, 11ma, 21m, 21ma, 41m, 31m, 41bgb, 31bgb.
     """
-    def _is_xyz(p): 
-        return isinstance(p,(list,tuple,np.ndarray)) and len(p)==3 and np.isfinite(p).all()
-    def _get(nm):
-        p = landmarks.get(nm); 
-        return np.asarray(p,float) if _is_xyz(p) else None
-    def _xz(p):
-        v = np.asarray(p,float) - np.asarray(frame['origin'],float)
-        ex = np.asarray(frame['ex'],float); ez = np.asarray(frame['ez'],float)
-        return float(v.dot(ex)), float(v.dot(ez))
-
     if not frame or any(k not in frame for k in ('origin','ex','ey','ez')):
         return {'value_mm': None, 'category': '缺失', 'side_of_max': None,
                 'right_mm': None, 'left_mm': None, 'per_side': {},
                 'summary_text': 'Overjet_前牙覆盖*: 缺失', 'quality': 'missing'}
 
+    _get = _local_table(landmarks, frame, local).get
+    def _xz(p):
+        return float(p[0]), float(p[2])
+
     # ---- 单侧计算 ----
     def side_oj(U_nm: List[str], Lm_nm: str, Lbgb_nm: str):
         # 上切缘：优先 m，回退 ma
@@ -1571,36 +2419,45 @@ def _fmt_mm(val, dec=1, tight=True):
     if abs(v - int(v)) < 1e-9: v = int(v)
     return f"{v}mm" if tight else f"{v} mm"
 
-def report_arch_form(landmarks, frame):
-    r = compute_arch_form(landmarks, frame)
+def format_arch_form(r) -> str:
     ok = (r.get('form') not in (None, '缺失'))
     return f"Arch_Form_牙弓形态*: {r.get('form','缺失')}{'✅' if ok else '⚠️'}"
 
-def report_arch_width(landmarks, frame):
-    r = compute_arch_width(landmarks, frame, dec=1)
+def report_arch_form(landmarks, frame, local=None):
+    return format_arch_form(compute_arch_form(landmarks, frame, local=local))
+
+def format_arch_width(r) -> str:
     ok = (r.get('quality') != 'missing')
     return f"Arch_Width_牙弓宽度*: {'上牙弓较窄' if r.get('upper_is_narrow') else ('未见上牙弓较窄' if r.get('upper_is_narrow') is not None else '缺失')} {'✅' if ok else '⚠️'}"
 
-def report_bolton(landmarks, frame):
-    r = compute_bolton(landmarks, frame, cfg={'mode':'plane'})
+def report_arch_width(landmarks, frame, local=None):
+    return format_arch_width(compute_arch_width(landmarks, frame, dec=1, local=local))
+
+def format_bolton(r) -> str:
     # 外显只要“正常 / 非正常”总结：两项都“正常”才算正常
     both_ok = (r['anterior'].get('status') == '正常' and r['overall'].get('status') == '正常')
     ok = (r.get('quality') != 'missing')
     return f"Bolton_Ratio_Bolton比*: {'正常' if both_ok else r.get('summary_text','异常')} {'✅' if ok else '⚠️'}"
 
-def report_canine(landmarks, frame):
-    r = compute_canine_relationship(landmarks, frame)
+def report_bolton(landmarks, frame, local=None):
+    return format_bolton(compute_bolton(landmarks, frame, cfg={'mode':'plane'}, local=local))
+
+def format_canine(r) -> str:
     ok = (r.get('quality') != 'missing')
     # 示例文案：右侧远中尖对尖，左侧完全远中
     return f"Canine_Relationship_尖牙关系*: {r['summary_text'].split('*:')[-1].strip()} {'✅' if ok else '⚠️'}"
 
-def report_crossbite(landmarks, frame):
-    r = compute_crossbite(landmarks, frame, threshold_mm=1.5, min_pairs=2)
+def report_canine(landmarks, frame, local=None):
+    return format_canine(compute_canine_relationship(landmarks, frame, local=local))
+
+def format_crossbite(r) -> str:
     ok = (r.get('quality') != 'missing')
     return f"{r['summary_text']} {'✅' if ok else '⚠️'}"
 
-def report_crowding(landmarks, frame):
-    r = compute_crowding(landmarks, frame, arch='both', use_plane=True, dec=1)
+def report_crossbite(landmarks, frame, local=None):
+    return format_crossbite(compute_crossbite(landmarks, frame, threshold_mm=1.5, min_pairs=2, local=local))
+
+def format_crowding(r) -> str:
     ok = (r.get('quality') != 'missing')
     # 统一去掉 + 号与多余空格，贴近示例
     up = r['upper']; lw = r['lower']
@@ -1613,13 +2470,17 @@ def report_crowding(landmarks, frame):
     text = ''.join(parts) if parts else '缺失'
     return f"Crowding_拥挤度*:{text} {'✅' if ok else '⚠️'}"
 
-def report_spee(landmarks, frame):
-    val = compute_spee(landmarks, frame, dec=1)
+def report_crowding(landmarks, frame, local=None):
+    return format_crowding(compute_crowding(landmarks, frame, arch='both', use_plane=True, dec=1, local=local))
+
+def format_spee(val) -> str:
     ok = (val is not None)
     return f"Curve_of_Spee_Spee曲线*: {_fmt_mm(val, dec=1, tight=True) if ok else '缺失'}{'✅' if ok else '⚠️'}"
 
-def report_midline_alignment(landmarks, frame):
-    r = compute_midline_alignment(landmarks, frame, threshold_mm=1.0, dec=1)
+def report_spee(landmarks, frame, local=None):
+    return format_spee(compute_spee(landmarks, frame, dec=1, local=local))
+
+def format_midline_alignment(r) -> str:
     ok = (r.get('quality') != 'missing')
     def _one(side):
         s = r[side]['signed_y_mm']
@@ -1630,8 +2491,10 @@ def report_midline_alignment(landmarks, frame):
     text = f"{_one('upper')} {_one('lower')}" if ok else '缺失'
     return f"Midline_Alignment_牙列中线*:{text} {'✅' if ok else '⚠️'}"
 
-def report_molar_relationship(landmarks, frame):
-    r = compute_molar_relationship(landmarks, frame, dec=1)
+def report_midline_alignment(landmarks, frame, local=None):
+    return format_midline_alignment(compute_midline_alignment(landmarks, frame, threshold_mm=1.0, dec=1, local=local))
+
+def format_molar_relationship(r) -> str:
     ok = (r.get('quality') != 'missing')
     def _word(s):
         if not s or s['is_complete_distal'] is None: return '缺失'
@@ -1639,36 +2502,1051 @@ def report_molar_relationship(landmarks, frame):
     text = f"右侧{_word(r.get('right'))} 左侧{_word(r.get('left'))}"
     return f"Molar_Relationship_磨牙关系*: {text} {'✅' if ok else '⚠️'}"
 
-def report_overbite(landmarks, frame):
-    r = compute_overbite(landmarks, frame, dec=1)
+def report_molar_relationship(landmarks, frame, local=None):
+    return format_molar_relationship(compute_molar_relationship(landmarks, frame, dec=1, local=local))
+
+def format_overbite(r) -> str:
     ok = (r.get('quality') != 'missing')
     # 外显只保留类型
     return f"Overbite_前牙覆𬌗*: {r.get('category','缺失')} {'✅' if ok else '⚠️'}"
 
-def report_overjet(landmarks, frame):
-    r = compute_overjet(landmarks, frame, dec=1)
+def report_overbite(landmarks, frame, local=None):
+    return format_overbite(compute_overbite(landmarks, frame, dec=1, local=local))
+
+_RE_TRAILING_ZERO_MM = re.compile(r'(\d+)\.0(mm)')
+
+def format_overjet(r) -> str:
     ok = (r.get('quality') != 'missing')
     # r['summary_text'] 形如 "Overjet_前牙覆盖*: 12.0mm_深覆盖"
     tail = r['summary_text'].split('*:')[-1].strip() if ok else '缺失'
     # 去掉 12.0 → 12
-    import re
-    tail = re.sub(r'(\d+)\.0(mm)', r'\1\2', tail)
+    tail = _RE_TRAILING_ZERO_MM.sub(r'\1\2', tail)
     return f"Overjet_前牙覆盖*: {tail} {'✅' if ok else '⚠️'}"
 
-def make_brief_report(landmarks, frame):
-    return [
-        report_arch_form(landmarks, frame),
-        report_arch_width(landmarks, frame),
-        report_bolton(landmarks, frame),
-        report_canine(landmarks, frame),
-        report_crossbite(landmarks, frame),
-        report_crowding(landmarks, frame),
-        report_spee(landmarks, frame),
-        report_midline_alignment(landmarks, frame),
-        report_molar_relationship(landmarks, frame),
-        report_overbite(landmarks, frame),
-        report_overjet(landmarks, frame),
-    ]
+def report_overjet(landmarks, frame, local=None):
+    return format_overjet(compute_overjet(landmarks, frame, dec=1, local=local))
+
+def make_brief_report(landmarks, frame, local=None, metrics: Optional[List[str]] = None, mesh=None):
+    """
+    local：build_occlusal_frame 返回的局部坐标表；缺省时在此处统一投影一次。
+    metrics：只要其中几项（如 ['overjet', 'overbite']）；缺省为注册表中的全部指标。
+    按注册表顺序返回 brief 行（由 run_metrics 调度）。
+    """
+    res = run_metrics(metrics, landmarks, frame, local=local, mesh=mesh, kind='report')
+    wanted = set(brief_metrics() if metrics is None else metrics)   # 依赖拉进来的指标不出现在 brief 中
+    return [line for name, line in res.items() if name in wanted]
+
+# =======================================================================
+# Metric registry：每个指标声明输入（frame / landmarks / mesh / 其他指标）、代价与输出字段
+#   METRIC_LANDMARKS：每个指标读取的全部地标（含回退候选），与 compute_* 内的取点一一对应
+#   brief=True 的 11 项构成 brief 报告（缺省的指标集）；基于网格的分析（surface / contacts，见 Occlusal contacts 段末）
+#   brief=False，须点名才执行
+#   run_metrics 只执行所选子集（含其依赖），按拓扑序；workers>1 时代价 ≥ PARALLEL_COST 的指标进线程池
+#   （纯地标指标为微秒级，只有网格分析值得分线程：numpy 的大数组运算释放 GIL）
+# =======================================================================
+def _tooth_names(teeth: List[str], suffixes: List[str]) -> Tuple[str, ...]:
+    return tuple(f'{t}{sfx}' for t in teeth for sfx in suffixes)
+
+PARALLEL_COST = 10.0   # 相对代价（纯地标指标记 1）；达到该值的指标在 workers>1 时进线程池
+
+METRIC_LANDMARKS: Dict[str, Tuple[str, ...]] = {
+    'arch_form': ('13m', '23m', '16mb', '16db', '16bg', '26mb', '26db', '26bg', '11m', '21m', '12m', '22m'),
+    'arch_width': _tooth_names(['13', '23', '33', '43'], ['m']) + _tooth_names(['14', '24', '34', '44'], ['b'])
+                  + _tooth_names(['16', '26', '36', '46'], ['mb', 'db', 'bg']),
+    'bolton': _tooth_names(['16', '15', '14', '13', '12', '11', '21', '22', '23', '24', '25', '26',
+                            '36', '35', '34', '33', '32', '31', '41', '42', '43', '44', '45', '46'], ['mc', 'dc']),
+    'canine': ('13m', '23m', '33m', '43m', '33dc', '43dc', '34mc', '44mc'),
+    'crossbite': _tooth_names(['14', '15', '16', '17', '24', '25', '26', '27',
+                               '34', '35', '36', '37', '44', '45', '46', '47'],
+                              ['mb', 'db', 'b', 'bg', 'ml', 'dl', 'l', 'lgb']),
+    'crowding': _tooth_names(['23', '22', '21', '11', '12', '13', '33', '32', '31', '41', '42', '43'],
+                             ['mc', 'mr', 'm', 'dc', 'dr']),
+    'spee': ('31m', '31ma', '41m', '41ma', '33m', '43m', '34b', '44b', '35b', '45b',
+             '36mb', '36db', '46mb', '46db', '37mb', '37db', '47mb', '47db'),
+    'midline': ('11m', '11ma', '21m', '21ma', '31m', '31ma', '41m', '41ma'),
+    'molar': ('16mb', '16db', '16bg', '26mb', '26db', '26bg', '36mb', '36bg', '46mb', '46bg'),
+    'overbite': ('11m', '11ma', '21m', '21ma', '31m', '41m', '31bgb', '41bgb'),
+    'overjet': ('11m', '11ma', '21m', '21ma', '31m', '41m', '31bgb', '41bgb'),
+}
+
+class MetricSpec:
+    """
+    name：注册名；compute / report：compute_* 与 report_*（签名 (landmarks, frame, local=..., **kw)）
+    format：format_*，把 compute 结果（按 params 计算）排成 brief 行；给出时 report 口径只算一次 compute
+    params：report 口径下传给 compute 的参数；needs ⊆ {'frame', 'landmarks', 'mesh'}
+    requires：依赖的其他指标（compute 结果以 deps={名: 结果} 传入）；cost：相对代价（见 PARALLEL_COST）
+    brief：是否属于 brief 报告（缺省指标集）；为 False 时须点名，report 可为 None（report 口径给 compute 结果）
+    schema：compute 结果的顶层字段（标量结果为其类型）
+    """
+    __slots__ = ('name', 'compute', 'report', 'params', 'needs', 'requires', 'landmarks', 'cost', 'brief',
+                 'schema', 'format')
+
+    def __init__(self, name: str, compute, report, params: Optional[Dict] = None,
+                 needs: Tuple[str, ...] = ('frame', 'landmarks'), requires: Tuple[str, ...] = (),
+                 landmarks: Tuple[str, ...] = (), cost: float = 1.0, brief: bool = True, schema=(), format=None):
+        self.name = name
+        self.compute = compute
+        self.report = report
+        self.format = format
+        self.params = dict(params or {})
+        self.needs = tuple(needs)
+        self.requires = tuple(requires)
+        self.landmarks = tuple(landmarks)
+        self.cost = float(cost)
+        self.brief = bool(brief)
+        self.schema = schema
+
+    def __repr__(self) -> str:
+        return f"MetricSpec({self.name!r}, requires={self.requires}, cost={self.cost})"
+
+METRIC_REGISTRY: Dict[str, MetricSpec] = {}
+
+def register_metric(spec: MetricSpec) -> MetricSpec:
+    """注册（或替换）一个指标；requires 中的指标须已注册。"""
+    missing = [r for r in spec.requires if r not in METRIC_REGISTRY and r != spec.name]
+    if missing:
+        raise ValueError(f"metric {spec.name!r} requires unregistered metrics: {missing}")
+    METRIC_REGISTRY[spec.name] = spec
+    return spec
+
+def brief_metrics(registry: Optional[Dict[str, MetricSpec]] = None) -> List[str]:
+    """brief 报告的指标（注册顺序）：未点名时的缺省指标集。"""
+    reg = METRIC_REGISTRY if registry is None else registry
+    return [n for n, spec in reg.items() if spec.brief]
+
+for _spec in (
+    MetricSpec('arch_form', compute_arch_form, report_arch_form, format=format_arch_form,
+               schema=('form', 'indices', 'used', 'summary_text', 'quality')),
+    MetricSpec('arch_width', compute_arch_width, report_arch_width, {'dec': 1}, format=format_arch_width,
+               schema=('upper', 'lower', 'diff_UL_mm', 'upper_is_narrow', 'thresholds', 'summary_text', 'quality')),
+    MetricSpec('bolton', compute_bolton, report_bolton, {'cfg': {'mode': 'plane'}}, format=format_bolton,
+               schema=('kind', 'anterior', 'overall', 'used', 'summary_text', 'quality')),
+    MetricSpec('canine', compute_canine_relationship, report_canine, format=format_canine,
+               schema=('right', 'left', 'params', 'summary_text', 'quality')),
+    MetricSpec('crossbite', compute_crossbite, report_crossbite, {'threshold_mm': 1.5, 'min_pairs': 2},
+               format=format_crossbite,
+               schema=('right', 'left', 'threshold_mm', 'min_pairs', 'used', 'summary_text', 'quality')),
+    MetricSpec('crowding', compute_crowding, report_crowding, {'arch': 'both', 'use_plane': True, 'dec': 1},
+               format=format_crowding,
+               schema=('arch', 'use_plane', 'upper', 'lower', 'summary_text', 'quality')),
+    MetricSpec('spee', compute_spee, report_spee, {'dec': 1}, schema=float, format=format_spee),
+    MetricSpec('midline', compute_midline_alignment, report_midline_alignment, {'threshold_mm': 1.0, 'dec': 1},
+               format=format_midline_alignment,
+               schema=('kind', 'upper', 'lower', 'threshold_mm', 'is_pass', 'summary_text', 'quality')),
+    MetricSpec('molar', compute_molar_relationship, report_molar_relationship, {'dec': 1},
+               format=format_molar_relationship,
+               schema=('right', 'left', 'range_mm', 'summary_text', 'quality')),
+    MetricSpec('overbite', compute_overbite, report_overbite, {'dec': 1}, format=format_overbite,
+               schema=('value_mm', 'category', 'right_mm', 'left_mm', 'side_of_max', 'ratios',
+                       'crown_heights_mm', 'used', 'summary_text', 'quality')),
+    MetricSpec('overjet', compute_overjet, report_overjet, {'dec': 1}, format=format_overjet,
+               schema=('value_mm', 'category', 'right_mm', 'left_mm', 'side_of_max', 'per_side',
+                       'summary_text', 'quality')),
+):
+    _spec.landmarks = METRIC_LANDMARKS[_spec.name]
+    register_metric(_spec)
+
+def metric_order(names: Optional[List[str]] = None, registry: Optional[Dict[str, MetricSpec]] = None) -> List[str]:
+    """所选指标（缺省为 brief_metrics）及其依赖的拓扑序（同层按注册顺序）；未知指标或循环依赖抛 ValueError。"""
+    reg = METRIC_REGISTRY if registry is None else registry
+    names = brief_metrics(reg) if names is None else list(names)
+    unknown = [n for n in names if n not in reg]
+    if unknown:
+        raise ValueError(f"unknown metrics: {unknown} (registered: {list(reg)})")
+    order: List[str] = []
+    state: Dict[str, int] = {}   # 1 = 访问中，2 = 完成
+    def _visit(n: str, path: Tuple[str, ...]):
+        if state.get(n) == 2:
+            return
+        if state.get(n) == 1:
+            raise ValueError(f"metric dependency cycle: {' -> '.join(path + (n,))}")
+        state[n] = 1
+        for r in reg[n].requires:
+            if r not in reg:
+                raise ValueError(f"metric {n!r} requires unregistered metric {r!r}")
+            _visit(r, path + (n,))
+        state[n] = 2
+        order.append(n)
+    rank = {n: i for i, n in enumerate(reg)}
+    for n in sorted(dict.fromkeys(names), key=rank.get):
+        _visit(n, ())
+    return order
+
+def run_metrics(names: Optional[List[str]] = None, landmarks=None, frame: Optional[Dict] = None,
+                local: Optional[LandmarkSet] = None, mesh=None, kind: str = 'compute',
+                workers: Optional[int] = None, registry: Optional[Dict[str, MetricSpec]] = None,
+                cancel=None, params: Optional[Dict[str, Dict]] = None) -> Dict:
+    """
+    执行所选指标（含依赖），返回 {名: 结果}（拓扑序）。kind='compute' 给 compute_* 结果，'report' 给 brief 行
+    （无 report 的指标给 compute 结果）。依赖项总以 compute 结果传入。
+    局部坐标表只投影一次；workers>1 时代价 ≥ PARALLEL_COST 的指标提交到线程池，其余在当前线程执行。
+    mesh：needs 含 'mesh' 的指标的网格输入（CaseMeshes）；params：{名: 参数}，覆盖该指标 spec.params 中的同名项。
+    cancel()：每个指标开始前检查，为真则不再启动新指标，只返回已完成的部分。
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    if kind not in ('compute', 'report'):
+        raise ValueError(f"kind must be 'compute' or 'report', got {kind!r}")
+    reg = METRIC_REGISTRY if registry is None else registry
+    order = metric_order(names, reg)
+    landmarks = as_landmark_set(landmarks if landmarks is not None else {})
+    if local is None:
+        local = frame_local_coords(landmarks, frame)
+    results: Dict[str, object] = {}
+    raw: Dict[str, object] = {}   # compute 结果（供依赖方使用）
+    required = {r for n in order for r in reg[n].requires}
+
+    def _call(spec: MetricSpec):
+        use_compute = kind == 'compute' or spec.format is not None or spec.report is None
+        kw = {**spec.params, **(params or {}).get(spec.name, {})} if use_compute else {}
+        if 'mesh' in spec.needs:
+            kw['mesh'] = mesh
+        if spec.requires:
+            kw['deps'] = {r: raw[r] for r in spec.requires}
+        fn = spec.compute if use_compute else spec.report
+        with trace_stage(fn.__name__, 'metric', metric=spec.name):
+            r = fn(landmarks, frame, local=local, **kw)
+            if not use_compute:
+                if spec.name in required:
+                    raw[spec.name] = spec.compute(landmarks, frame, local=local, **spec.params)
+                return r
+            raw[spec.name] = r
+            return spec.format(r) if kind == 'report' and spec.format is not None else r
+
+    heavy = [n for n in order if reg[n].cost >= PARALLEL_COST]
+    if not workers or workers <= 1 or not heavy:
+        for n in order:
+            if cancel is not None and cancel():
+                break
+            results[n] = _call(reg[n])
+        return results
+
+    pending = list(order)
+    inflight: Dict = {}
+    with ThreadPoolExecutor(max_workers=min(int(workers), len(heavy))) as pool:
+        while pending or inflight:
+            if cancel is not None and cancel():
+                pending.clear()
+            ready = [n for n in pending if all(r in raw for r in reg[n].requires)]
+            for n in ready:
+                pending.remove(n)
+                if reg[n].cost >= PARALLEL_COST:
+                    # 复制上下文：线程内的 compute_* 仍能看到 use_memo / use_tracer 的设置
+                    inflight[pool.submit(contextvars.copy_context().run, _call, reg[n])] = n
+                else:
+                    results[n] = _call(reg[n])
+            if not ready and inflight:
+                done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    results[inflight.pop(fut)] = fut.result()
+    return {n: results[n] for n in order if n in results}
+
+# =======================================================================
+# Interactive session: 增量重算
+#   坐标系地标（FRAME_LANDMARKS）变动 → 重建坐标系（复用几何基座）并重算全部指标；
+#   否则只重投影变动的行，只重算依赖这些地标（METRIC_LANDMARKS）的指标
+# =======================================================================
+def metrics_depending_on(names) -> List[str]:
+    """受这些地标影响的指标（按注册顺序，含依赖它们的下游指标）；含坐标系地标时为全部指标。"""
+    names = set(names)
+    if names & FRAME_LANDMARKS:
+        return brief_metrics()
+    hit = {m for m, spec in METRIC_REGISTRY.items() if spec.brief and names.intersection(spec.landmarks)}
+    for m in metric_order():   # 拓扑序：上游受影响则下游也受影响
+        if hit.intersection(METRIC_REGISTRY[m].requires):
+            hit.add(m)
+    return [m for m in brief_metrics() if m in hit]
+
+class CaseState:
+    """
+    交互会话中的单个病例：地标表、几何基座、坐标系、局部坐标表与各指标的 brief 行。
+    由 open_case() 创建，经 update_landmarks() 增量更新；kv 与 generate_metrics 的返回同形。
+    """
+    def __init__(self, landmarks: LandmarkSet, frame_res: Dict, cfg: Optional[Dict] = None):
+        self.cfg = cfg or {}
+        self.landmarks = landmarks
+        self.geom_base = frame_res.get('geom_base')
+        self.frame_res = frame_res
+        self.lines: Dict[str, str] = {}
+        self.kv: Dict[str, str] = {}
+        self.stale = set(brief_metrics())   # brief 行已过期、待重算的指标
+        self.refresh()
+
+    @property
+    def frame(self) -> Optional[Dict]:
+        return self.frame_res.get('frame')
+
+    @property
+    def local(self) -> Optional[LandmarkSet]:
+        return self.frame_res.get('local')
+
+    def apply_edits(self, edits: Dict[str, Optional[List[float]]]) -> Tuple[List[str], bool]:
+        """
+        只改状态不算指标：写入地标、必要时重建坐标系 / 重投影变动行，并把受影响的指标并入 stale。
+        返回 (受影响的指标, 坐标系是否变化)。
+        """
+        lm = self.landmarks
+        moved: Dict[str, Optional[np.ndarray]] = {}
+        for label, p in (edits or {}).items():
+            label = str(label)
+            q = np.asarray(p, dtype=float) if _is_xyz(p) else None
+            old = lm.get(label)
+            if (q is None and old is None) or (q is not None and old is not None and np.array_equal(q, old)):
+                continue
+            moved[label] = q
+        if not moved:
+            return [], False
+
+        # 写时复制：旧 LandmarkSet 可能仍被调用方/缓存持有
+        extra = [nm for nm in moved if nm not in lm.index]
+        lm = lm.merged(LandmarkSet.empty(extra)) if extra else LandmarkSet(lm.names, lm.index, lm.xyz.copy(), lm.valid.copy())
+        rows = np.fromiter((lm.index[nm] for nm in moved), dtype=np.intp, count=len(moved))
+        for r, q in zip(rows, moved.values()):
+            lm.xyz[r] = q if q is not None else np.nan
+            lm.valid[r] = q is not None
+        self.landmarks = lm
+
+        frame_changed = bool(FRAME_LANDMARKS.intersection(moved)) or self.frame is None
+        if frame_changed:
+            res = build_occlusal_frame(lm, cfg=self.cfg.get('frame'), geom_base=self.geom_base)
+            frame_changed = not _same_frame(res.get('frame'), self.frame)
+            self.frame_res = res
+        else:
+            # 坐标系不变：只重投影变动的行
+            local = self.local
+            frame = self.frame
+            R = np.stack([np.asarray(frame[k], float) for k in ('ex', 'ey', 'ez')], axis=0)
+            xyz = local.xyz.copy() if local.names is lm.names else lm.to_frame(frame).xyz
+            xyz[rows] = (lm.xyz[rows] - np.asarray(frame['origin'], float)) @ R.T
+            self.frame_res = {**self.frame_res, 'local': LandmarkSet(lm.names, lm.index, xyz, lm.valid)}
+
+        metrics = brief_metrics() if frame_changed else metrics_depending_on(moved)
+        self.stale.update(metrics)
+        return metrics, frame_changed
+
+    def refresh(self, cancel=None) -> Optional[Dict[str, str]]:
+        """
+        重算 stale 中的指标，返回值发生变化的 {键: 值}。
+        cancel()：在指标之间检查，为真即停下（如又有新编辑到达）；未算完的留在 stale 中，返回 None。
+        """
+        frame = self.frame
+        if frame is None:
+            self.lines = {}
+            self.stale.clear()
+            kv = {"错误": "坐标系缺失，无法生成报告"}
+            changed = kv if kv != self.kv else {}
+            self.kv = kv
+            return changed
+        if "错误" in self.kv:
+            self.kv = {}
+            self.stale.update(brief_metrics())
+        if self.stale:
+            done = run_metrics(list(self.stale), self.landmarks, frame, local=self.local, kind='report', cancel=cancel)
+            self.lines.update(done)
+            self.stale.difference_update(done)
+            if self.stale:
+                return None
+        kv = _brief_lines_to_kv([self.lines[m] for m in brief_metrics()])
+        changed = {k: v for k, v in kv.items() if self.kv.get(k) != v}
+        self.kv = kv
+        return changed
+
+def open_case(upper_stl_path: str, lower_stl_path: str, upper_json_path: str, lower_json_path: str,
+              cfg: Optional[Dict] = None) -> CaseState:
+    """与 generate_metrics 同样读盘与建系（坐标系同样走 memo），但保留中间状态供 update_landmarks 使用。"""
+    cfg = cfg or {}
+    landmarks = _merge_landmarks(_load_landmarks_json(upper_json_path), _load_landmarks_json(lower_json_path))
+    frame_res = _case_occlusal_frame(landmarks, upper_stl_path, lower_stl_path, cfg, frame_memo_from_cfg(cfg))
+    return CaseState(landmarks, frame_res, cfg)
+
+def update_landmarks(case: CaseState, edits: Dict[str, Optional[List[float]]]) -> Dict:
+    """
+    edits：{label: [x,y,z]}；值为 None（或非有限坐标）表示删除该地标。
+    只重算受影响的指标；坐标系地标变动时用缓存的几何基座重建坐标系（不重读 STL）。
+    返回 {'metrics': 值有变化的 {键: 值}, 'recomputed': [指标], 'frame_changed': bool}
+    """
+    metrics, frame_changed = case.apply_edits(edits)
+    return {'metrics': case.refresh(), 'recomputed': metrics, 'frame_changed': frame_changed}
+
+def _same_frame(a: Optional[Dict], b: Optional[Dict]) -> bool:
+    if a is None or b is None:
+        return a is b
+    return all(np.array_equal(np.asarray(a[k], float), np.asarray(b[k], float)) for k in ('origin', 'ex', 'ey', 'ez'))
+
+# =======================================================================
+# Cohort kernels: 批量向量化指标
+# Input: LandmarkBatch（C 个病例，(C,N,3) + (C,N) 有效掩码）、frames (C,4,3)
+#        frames[:,0]=origin, frames[:,1:4]=ex/ey/ez；坐标系缺失的病例整行为 NaN
+# Output: 每个指标一个 {字段: (C,) ndarray}；数值缺失为 NaN，类别缺失为 '缺失'
+# Description: 与逐例的 compute_* 同口径（含回退链，如 16mb→16db→16bg），
+#   回退用掩码逐候选 np.where 解析，不在 Python 层按病例循环。
+#   数值字段不做显示用的 round；仅在单例口径本身以舍入值做判定处保持同样舍入。
+# =======================================================================
+class LandmarkBatch:
+    """C 个病例的稠密地标张量：names/index 同 LandmarkSet，xyz (C,N,3)（无效处为 NaN），valid (C,N)。"""
+    __slots__ = ('names', 'index', 'xyz', 'valid')
+
+    def __init__(self, names: Tuple[str, ...], index: Dict[str, int], xyz: np.ndarray, valid: np.ndarray):
+        self.names = names
+        self.index = index
+        self.xyz = xyz
+        self.valid = valid
+
+    @classmethod
+    def from_sets(cls, sets: List) -> 'LandmarkBatch':
+        sets = [as_landmark_set(s) for s in sets]
+        if not sets:
+            names, index = landmark_protocol()
+            return cls(names, index, np.zeros((0, len(names), 3)), np.zeros((0, len(names)), dtype=bool))
+        if any(s.names is not sets[0].names for s in sets):
+            proto = LandmarkSet.empty([nm for s in sets for nm in s.names])
+            sets = [proto.merged(s) for s in sets]
+        xyz = np.stack([s.xyz for s in sets], axis=0)
+        valid = np.stack([s.valid for s in sets], axis=0)
+        xyz[~valid] = np.nan
+        return cls(sets[0].names, sets[0].index, xyz, valid)
+
+    def __len__(self) -> int:
+        return int(self.xyz.shape[0])
+
+    def to_frames(self, frames: np.ndarray) -> 'LandmarkBatch':
+        """逐病例投到各自咬合坐标系：一次 einsum，(C,N,3) × (C,3,3)。"""
+        frames = np.asarray(frames, float)
+        local = np.einsum('cnk,cjk->cnj', self.xyz - frames[:, None, 0, :], frames[:, 1:4, :])
+        return LandmarkBatch(self.names, self.index, local, self.valid)
+
+    def col(self, name: str) -> np.ndarray:
+        """(C,3)；未登记或无效处为 NaN。"""
+        i = self.index.get(name)
+        if i is None:
+            return np.full((self.xyz.shape[0], 3), np.nan)
+        return self.xyz[:, i, :]
+
+    def pick(self, candidates: List[str]) -> np.ndarray:
+        """按候选顺序逐病例取第一个有效点，(C,3)。"""
+        acc = np.full((self.xyz.shape[0], 3), np.nan)
+        for nm in reversed(candidates):
+            p = self.col(nm)
+            acc = np.where(np.isfinite(p[:, :1]), p, acc)
+        return acc
+
+    def nanmean(self, names: List[str]) -> np.ndarray:
+        """可用点的质心，(C,3)；全部缺失为 NaN。"""
+        P = np.stack([self.col(nm) for nm in names], axis=1)
+        ok = np.isfinite(P[..., 0])
+        n = ok.sum(axis=1)
+        s = np.where(ok[..., None], P, 0.0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where((n > 0)[:, None], s / np.maximum(n, 1)[:, None], np.nan)
+
+def stack_frames(frames: List[Optional[Dict]]) -> np.ndarray:
+    """[{origin,ex,ey,ez} | None] → (C,4,3)；缺失/不完整的坐标系为 NaN。"""
+    out = np.full((len(frames), 4, 3), np.nan)
+    for c, f in enumerate(frames):
+        if f and all(f.get(k) is not None for k in ('origin', 'ex', 'ey', 'ez')):
+            out[c] = [f['origin'], f['ex'], f['ey'], f['ez']]
+    return out
+
+def _b_mid2(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """两点都在取中点，否则取存在的那个（同 _mid2）。"""
+    fa, fb = np.isfinite(a[:, :1]), np.isfinite(b[:, :1])
+    return np.where(fa & fb, 0.5 * (a + b), np.where(fa, a, b))
+
+def _b_label(missing: np.ndarray, conds: List[np.ndarray], labels: List[str], default: str) -> np.ndarray:
+    out = np.select(conds, labels, default=default) if conds else np.full(missing.shape, default)
+    return np.where(missing, '缺失', out)
+
+def _b_bool(flag: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    return np.where(missing, np.nan, flag.astype(float))
+
+def _b_round(x: np.ndarray, dec: int) -> np.ndarray:
+    return np.round(x, dec)
+
+def batch_arch_form(local: LandmarkBatch,
+                    th_icim_tapered: float = 0.72, th_icim_square: float = 0.80,
+                    th_adic_tapered: float = 0.80, th_adic_square: float = 0.60) -> Dict[str, np.ndarray]:
+    p13, p23 = local.col('13m'), local.col('23m')
+    p16 = local.pick(['16mb', '16db', '16bg']); p26 = local.pick(['26mb', '26db', '26bg'])
+    pInc = local.nanmean(['11m', '21m', '12m', '22m'])
+    pCan = 0.5 * (p13 + p23)
+    missing = ~np.isfinite(np.stack([p13[:, 0], p23[:, 0], p16[:, 0], p26[:, 0], pInc[:, 0]])).all(axis=0)
+
+    ICW = np.abs(p13[:, 1] - p23[:, 1])
+    IMW = np.abs(p16[:, 1] - p26[:, 1])
+    AD = np.maximum(0.0, pInc[:, 0] - pCan[:, 0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ICW_IMW = np.where(IMW > 1e-6, ICW / IMW, np.nan)
+        AD_ICW = np.where(ICW > 1e-6, AD / ICW, np.nan)
+    with np.errstate(invalid='ignore'):
+        square = (ICW_IMW >= th_icim_square) | (AD_ICW <= th_adic_square)
+        tapered = (ICW_IMW <= th_icim_tapered) | (AD_ICW >= th_adic_tapered)
+    form = _b_label(missing, [square, tapered], ['方圆形', '尖圆形'], '卵圆形')
+    nan = np.where(missing, np.nan, 1.0)
+    return {'form': form, 'ICW_mm': ICW * nan, 'IMW_mm': IMW * nan, 'AD_mm': AD * nan,
+            'ICW_IMW': ICW_IMW * nan, 'AD_ICW': AD_ICW * nan}
+
+def batch_arch_width(local: LandmarkBatch, dec: int = 1, ap_tol_mm: float = 4.0,
+                     narrow_delta_mm: float = 2.0) -> Dict[str, np.ndarray]:
+    U = {'anterior': (['13m'], ['23m']), 'middle': (['14b'], ['24b']),
+         'posterior': (['16mb', '16db', '16bg'], ['26mb', '26db', '26bg'])}
+    L = {'anterior': (['33m'], ['43m']), 'middle': (['34b'], ['44b']),
+         'posterior': (['36mb', '36db', '36bg'], ['46mb', '46db', '46bg'])}
+    out: Dict[str, np.ndarray] = {}
+    C = len(local)
+    segs_ok = np.zeros(C, dtype=int); votes = np.zeros(C, dtype=int)
+    warn = np.zeros(C, dtype=bool)
+    for seg in ('anterior', 'middle', 'posterior'):
+        w = {}
+        for arch, sel in (('upper', U), ('lower', L)):
+            pL, pR = local.pick(sel[seg][0]), local.pick(sel[seg][1])
+            dy = np.abs(pR[:, 1] - pL[:, 1]); dx = np.abs(pR[:, 0] - pL[:, 0])
+            with np.errstate(invalid='ignore'):
+                warn |= dx > ap_tol_mm
+            w[arch] = _b_round(dy, dec)
+            out[f'{arch}_{seg}_mm'] = w[arch]
+            out[f'{arch}_{seg}_dx_mm'] = _b_round(dx, dec)
+        d = w['upper'] - w['lower']
+        ok = np.isfinite(d)
+        out[f'diff_{seg}_mm'] = _b_round(d, dec)
+        segs_ok += ok
+        with np.errstate(invalid='ignore'):
+            votes += ok & (d < -narrow_delta_mm)
+    missing = segs_ok < 2
+    out['upper_is_narrow'] = _b_bool(votes >= 2, missing)
+    out['segments'] = segs_ok
+    out['quality'] = np.where(segs_ok == 0, 'missing', np.where(warn, 'fallback', 'ok'))
+    return out
+
+BOLTON_TEETH = {
+    'upper_overall': ['16', '15', '14', '13', '12', '11', '21', '22', '23', '24', '25', '26'],
+    'lower_overall': ['36', '35', '34', '33', '32', '31', '41', '42', '43', '44', '45', '46'],
+    'upper_anterior': ['13', '12', '11', '21', '22', '23'],
+    'lower_anterior': ['33', '32', '31', '41', '42', '43'],
+}
+
+def batch_bolton(local: LandmarkBatch, raw: Optional[LandmarkBatch] = None, mode: str = 'plane',
+                 target_anterior: float = 77.2, target_overall: float = 91.3,
+                 tol_anterior: float = 2.0, tol_overall: float = 2.0) -> Dict[str, np.ndarray]:
+    src = local if (mode == 'plane' or raw is None) else raw
+    k = 2 if src is local else 3
+
+    def _sum(teeth):
+        W = np.stack([np.linalg.norm(src.col(f'{t}mc')[:, :k] - src.col(f'{t}dc')[:, :k], axis=1)
+                      for t in teeth], axis=1)
+        ok = np.isfinite(W)
+        return np.where(ok, W, 0.0).sum(axis=1), ok.sum(axis=1)
+
+    out: Dict[str, np.ndarray] = {}
+    for part, target, tol in (('anterior', target_anterior, tol_anterior), ('overall', target_overall, tol_overall)):
+        sU, nU = _sum(BOLTON_TEETH[f'upper_{part}']); sL, nL = _sum(BOLTON_TEETH[f'lower_{part}'])
+        missing = (sU <= 1e-6) | (nU == 0) | (nL == 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(missing, np.nan, sL / sU * 100.0)
+        discrep = np.where(missing, np.nan, sL - sU * target / 100.0)
+        with np.errstate(invalid='ignore'):
+            status = _b_label(missing, [np.abs(ratio - target) <= tol, ratio > target + tol],
+                              ['正常', '下颌牙量过大'], '上颌牙量过大')
+        out.update({f'{part}_ratio': ratio, f'{part}_discrep_mm': discrep, f'{part}_status': status,
+                    f'{part}_sum_upper_mm': sU, f'{part}_sum_lower_mm': sL,
+                    f'{part}_n_upper': nU, f'{part}_n_lower': nL})
+    return out
+
+def batch_canine(local: LandmarkBatch, alpha: float = 0.35, beta_mm: float = 1.5,
+                 tol_edge_mm: float = 0.5, complete_mm: float = 2.0) -> Dict[str, np.ndarray]:
+    out: Dict[str, np.ndarray] = {}
+    for side, up, can, prem_mc, dc in (('right', '13m', '43m', '44mc', '43dc'), ('left', '23m', '33m', '34mc', '33dc')):
+        xU = local.col(up)[:, 0]
+        x_can, x_mc, x_dc = local.col(can)[:, 0], local.col(prem_mc)[:, 0], local.col(dc)[:, 0]
+        proxy = np.where(np.isfinite(x_mc), x_can + alpha * (x_mc - x_can),
+                         np.where(np.isfinite(x_dc), x_can + 0.5 * (x_dc - x_can), x_can - beta_mm))
+        dx = xU - proxy
+        missing = ~np.isfinite(dx)
+        with np.errstate(invalid='ignore'):
+            edge = np.abs(dx) <= tol_edge_mm
+            label = _b_label(missing,
+                             [edge & (dx < 0), edge & (dx > 0), edge, dx <= -complete_mm, dx >= complete_mm, dx < 0],
+                             ['远中尖对尖', '近中尖对尖', '尖对尖', '完全远中', '完全近中', '远中'], '近中')
+        out[f'{side}_dx_mm'] = dx
+        out[f'{side}_label'] = label
+        out[f'{side}_source'] = np.where(~np.isfinite(x_can), 'missing',
+                                         np.where(np.isfinite(x_mc), 'arch_alpha',
+                                                  np.where(np.isfinite(x_dc), 'line_interp', 'shift_beta')))
+    return out
+
+def batch_crossbite(local: LandmarkBatch, threshold_mm: float = 1.5, min_pairs: int = 2) -> Dict[str, np.ndarray]:
+    BUCCAL = ['mb', 'db', 'b', 'bg']; LINGUAL = ['ml', 'dl', 'l', 'lgb']
+
+    def _ys(teeth, sfx):
+        Y = np.stack([local.pick([f'{t}{s}' for s in sfx])[:, 1] for t in teeth], axis=1)
+        ok = np.isfinite(Y)
+        n = ok.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m = np.where(n > 0, np.where(ok, Y, 0.0).sum(axis=1) / np.maximum(n, 1), np.nan)
+        return m, n
+
+    out: Dict[str, np.ndarray] = {}
+    for side, U_list, L_list, sgn in (('right', ['14', '15', '16', '17'], ['44', '45', '46', '47'], -1.0),
+                                      ('left', ['24', '25', '26', '27'], ['34', '35', '36', '37'], +1.0)):
+        mUL, nUL = _ys(U_list, LINGUAL); mUB, nUB = _ys(U_list, BUCCAL)
+        mLL, nLL = _ys(L_list, LINGUAL); mLB, nLB = _ys(L_list, BUCCAL)
+        ps, pc = np.minimum(nUL, nLB), np.minimum(nUB, nLL)
+        v_s, v_c = sgn * (mUL - mLB), sgn * (mLL - mUB)
+        with np.errstate(invalid='ignore'):
+            scissor = (ps >= min_pairs) & (v_s > threshold_mm)
+            cross = ~scissor & (pc >= min_pairs) & (v_c > threshold_mm)
+        status = np.select([(ps < min_pairs) & (pc < min_pairs), scissor, cross], ['missing', '正锁', '反锁'], '无')
+        out[f'{side}_status'] = status
+        out[f'{side}_margin_mm'] = np.where(scissor, v_s, np.where(cross, v_c, 0.0))
+        out[f'{side}_pairs_scissor'] = ps
+        out[f'{side}_pairs_cross'] = pc
+    return out
+
+CROWDING_SEQ = {'upper': ['23', '22', '21', '11', '12', '13'], 'lower': ['33', '32', '31', '41', '42', '43']}
+
+def batch_crowding(local: LandmarkBatch, raw: Optional[LandmarkBatch] = None, use_plane: bool = True,
+                   dec: int = 1, min_pairs: int = 3, min_teeth: int = 4) -> Dict[str, np.ndarray]:
+    src = local if (use_plane or raw is None) else raw
+    k = 2 if src is local else 3
+
+    def _mc(t): return src.pick([f'{t}mc', f'{t}mr', f'{t}m'])[:, :k]
+    def _dc(t): return src.pick([f'{t}dc', f'{t}dr'])[:, :k]
+
+    out: Dict[str, np.ndarray] = {}
+    for arch, seq in CROWDING_SEQ.items():
+        G = np.stack([np.linalg.norm(_dc(a) - _mc(b), axis=1) for a, b in zip(seq[:-1], seq[1:])], axis=1)
+        W = np.stack([np.linalg.norm(_mc(t) - _dc(t), axis=1) for t in seq], axis=1)
+        okG, okW = np.isfinite(G), np.isfinite(W)
+        nG, nW = okG.sum(axis=1), okW.sum(axis=1)
+        gap = np.where(nG > 0, _b_round(np.where(okG, G, 0.0).sum(axis=1), dec), np.nan)
+        req = np.where(nW > 0, _b_round(np.where(okW, W, 0.0).sum(axis=1), dec), np.nan)
+        out[f'{arch}_gap_sum_mm'] = gap
+        out[f'{arch}_required_sum_mm'] = req
+        out[f'{arch}_ald_mm'] = _b_round(gap - req, dec)
+        out[f'{arch}_n_pairs'] = nG
+        out[f'{arch}_n_teeth'] = nW
+        out[f'{arch}_quality'] = np.where((nG == 0) | (nW == 0), 'missing',
+                                          np.where((nG < min_pairs) | (nW < min_teeth), 'fallback', 'ok'))
+    return out
+
+SPEE_B_CANDS = ['37db', '47db', '37mb', '47mb', '36db', '46db', '36mb', '46mb']
+SPEE_SAMPLES = ['33m', '34b', '35b', '36mb', '36db', '37mb', '37db',
+                '43m', '44b', '45b', '46mb', '46db', '47mb', '47db']
+
+def batch_spee(local: LandmarkBatch) -> Dict[str, np.ndarray]:
+    EPS = 1e-9
+    C = len(local)
+    a31, a41 = local.col('31ma'), local.col('41ma')
+    A = np.where(np.isfinite(a31[:, :1] + a41[:, :1]), 0.5 * (a31 + a41),
+                 local.pick(['31ma', '41ma', '31m', '41m']))
+    Ax, Az = A[:, 0], A[:, 2]
+    Bc = np.stack([local.col(nm) for nm in SPEE_B_CANDS], axis=1)        # (C,8,3)
+    bx = np.where(np.isfinite(Bc[..., 0]), Bc[..., 0], np.inf)
+    j = np.argmin(bx, axis=1)                                            # 首个最小值，同逐例的严格 < 比较
+    B = Bc[np.arange(C), j]
+    Bx, Bz = B[:, 0], B[:, 2]
+
+    ux, uz = Bx - Ax, Bz - Az
+    Lc = np.sqrt(ux * ux + uz * uz)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ux, uz = ux / Lc, uz / Lc
+    nx, nz = -uz, ux
+    flip = nz > 0
+    nx, nz = np.where(flip, -nx, nx), np.where(flip, -nz, nz)
+    use_vertical = np.abs(nz) < 1e-3
+    xmin, xmax = np.minimum(Ax, Bx), np.maximum(Ax, Bx)
+
+    S = np.stack([local.col(nm) for nm in SPEE_SAMPLES], axis=1)        # (C,S,3)
+    x, z = S[..., 0], S[..., 2]
+    wx, wz = x - Ax[:, None], z - Az[:, None]
+    t = wx * ux[:, None] + wz * uz[:, None]
+    with np.errstate(invalid='ignore'):
+        inside = ((x >= xmin[:, None] - 1e-6) & (x <= xmax[:, None] + 1e-6)
+                  & (t >= -1e-6) & (t <= Lc[:, None] + 1e-6))
+    d = np.where(use_vertical[:, None], (Az[:, None] + t * uz[:, None]) - z, wx * nx[:, None] + wz * nz[:, None])
+    depth = np.maximum(0.0, np.where(inside, d, -np.inf).max(axis=1))
+    with np.errstate(invalid='ignore'):
+        missing = ~np.isfinite(Ax) | ~np.isfinite(Bx) | ~(Lc >= EPS)
+    return {'depth_mm': np.where(missing, np.nan, depth)}
+
+def batch_midline(local: LandmarkBatch, threshold_mm: float = 1.0) -> Dict[str, np.ndarray]:
+    U = _b_mid2(local.col('11ma'), local.col('21ma'))
+    U = np.where(np.isfinite(U[:, :1]), U, _b_mid2(local.col('11m'), local.col('21m')))
+    L = _b_mid2(local.col('31ma'), local.col('41ma'))
+    L = np.where(np.isfinite(L[:, :1]), L, _b_mid2(local.col('31m'), local.col('41m')))
+    Uy, Ly = U[:, 1], L[:, 1]
+    missing = ~np.isfinite(Uy) | ~np.isfinite(Ly)
+    Uy, Ly = np.where(missing, np.nan, Uy), np.where(missing, np.nan, Ly)
+    out = {'upper_signed_y_mm': Uy, 'lower_signed_y_mm': Ly}
+    with np.errstate(invalid='ignore'):
+        out['is_pass'] = _b_bool((np.abs(Uy) <= threshold_mm) & (np.abs(Ly) <= threshold_mm), missing)
+        for k, y in (('upper', Uy), ('lower', Ly)):
+            out[f'{k}_dir'] = _b_label(missing, [np.abs(y) < 1e-6, y < 0], ['居中', '右偏'], '左偏')
+    return out
+
+MOLAR_COMPLETE_DISTAL_RANGE = {'min': 2.5, 'max': 7.5}
+
+def batch_molar(local: LandmarkBatch) -> Dict[str, np.ndarray]:
+    rng = MOLAR_COMPLETE_DISTAL_RANGE
+    out: Dict[str, np.ndarray] = {}
+    for side, up, lo in (('right', ['16mb', '16db', '16bg'], ['46mb', '46bg']),
+                         ('left', ['26mb', '26db', '26bg'], ['36mb', '36bg'])):
+        dx = local.pick(up)[:, 0] - local.pick(lo)[:, 0]
+        missing = ~np.isfinite(dx)
+        with np.errstate(invalid='ignore'):
+            out[f'{side}_is_complete_distal'] = _b_bool((dx >= rng['min']) & (dx <= rng['max']), missing)
+        out[f'{side}_dx_mm'] = dx
+    return out
+
+def _b_side_of_max(right: np.ndarray, left: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """|值| 最大侧；并列取右侧（同 max(candidates) 的先到先得）。"""
+    use_left = ~np.isfinite(right) | (np.abs(np.nan_to_num(left, nan=-np.inf)) > np.abs(right))
+    use_left &= np.isfinite(left)
+    value = np.where(use_left, left, right)
+    side = np.where(~np.isfinite(value), '', np.where(use_left, 'left', 'right'))
+    return value, side
+
+def batch_overbite(local: LandmarkBatch, raw: Optional[LandmarkBatch] = None,
+                   normal_low_mm: float = 1.0, normal_high_mm: float = 4.0, deep_mm: float = 5.0) -> Dict[str, np.ndarray]:
+    raw = raw if raw is not None else local      # 冠高为欧氏距离，坐标系无关
+    out: Dict[str, np.ndarray] = {}
+    vals = {}
+    for side, up, lo in (('right', ['11m', '11ma'], '41'), ('left', ['21m', '21ma'], '31')):
+        v = local.pick(up)[:, 2] - local.col(f'{lo}m')[:, 2]
+        ch = np.linalg.norm(raw.col(f'{lo}m') - raw.col(f'{lo}bgb'), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(np.isfinite(v) & (ch > 1e-6), v / ch, np.nan)
+        out[f'{side}_mm'] = v; out[f'{side}_ratio'] = ratio; out[f'{side}_crown_height_mm'] = ch
+        vals[side] = v
+    value, side = _b_side_of_max(vals['right'], vals['left'])
+    missing = ~np.isfinite(value)
+    for s in ('right', 'left'):   # 两侧均缺失时 compute_overbite 不给冠高
+        out[f'{s}_crown_height_mm'] = np.where(missing, np.nan, out[f'{s}_crown_height_mm'])
+    with np.errstate(invalid='ignore'):
+        category = _b_label(missing,
+                            [value < 0, value >= deep_mm, (value >= normal_low_mm) & (value <= normal_high_mm),
+                             (value >= 0.8) & (value <= 4.5)],
+                            ['开𬌗', '深覆', '正常', '正常'], '偏离')
+    out.update({'value_mm': value, 'side_of_max': side, 'category': category})
+    return out
+
+def batch_overjet(local: LandmarkBatch, zero_tol_mm: float = 0.3, normal_low_mm: float = 1.0,
+                  normal_high_mm: float = 4.0, deep_mm: float = 5.0) -> Dict[str, np.ndarray]:
+    out: Dict[str, np.ndarray] = {}
+    vals = {}
+    for side, up, lo in (('right', ['11m', '11ma'], '41'), ('left', ['21m', '21ma'], '31')):
+        U, Lm, Lb = local.pick(up), local.col(f'{lo}m'), local.col(f'{lo}bgb')
+        dz = Lb[:, 2] - Lm[:, 2]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            interp = np.isfinite(dz) & (np.abs(dz) >= 1e-6)
+            t_raw = np.where(interp, (U[:, 2] - Lm[:, 2]) / np.where(interp, dz, 1.0), 0.0)
+            clamped = interp & ((t_raw < 0.0) | (t_raw > 1.0))
+        t = np.clip(t_raw, 0.0, 1.0)
+        xLlab = np.where(interp, Lm[:, 0] + t * (Lb[:, 0] - Lm[:, 0]), Lm[:, 0])
+        v = U[:, 0] - xLlab
+        out[f'{side}_mm'] = v
+        out[f'{side}_source'] = np.where(~np.isfinite(v), 'missing',
+                                         np.where(interp, np.where(clamped, 'line_interp_clamped', 'line_interp'),
+                                                  'incisal_only'))
+        vals[side] = v
+    value, side = _b_side_of_max(vals['right'], vals['left'])
+    missing = ~np.isfinite(value)
+    with np.errstate(invalid='ignore'):
+        category = _b_label(missing,
+                            [np.abs(value) <= zero_tol_mm, value < -zero_tol_mm, value >= deep_mm,
+                             (value >= normal_low_mm) & (value <= normal_high_mm)],
+                            ['对刃', '反𬌗', '深覆盖', '正常'], '偏离')
+    out.update({'value_mm': value, 'side_of_max': side, 'category': category})
+    return out
+
+def batch_metrics(landmarks, frames) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    landmarks：LandmarkBatch 或 LandmarkSet/字典 的列表；frames：(C,4,3) 或 frame 字典列表。
+    一次性给出 make_brief_report 所用的 11 项指标的批量数值（口径与 report_* 的默认参数一致）。
+    """
+    raw = landmarks if isinstance(landmarks, LandmarkBatch) else LandmarkBatch.from_sets(landmarks)
+    F = np.asarray(frames, float) if isinstance(frames, np.ndarray) else stack_frames(frames)
+    local = raw.to_frames(F)
+    return {
+        'arch_form': batch_arch_form(local),
+        'arch_width': batch_arch_width(local),
+        'bolton': batch_bolton(local, raw),
+        'canine': batch_canine(local),
+        'crossbite': batch_crossbite(local),
+        'crowding': batch_crowding(local, raw),
+        'spee': batch_spee(local),
+        'midline': batch_midline(local),
+        'molar': batch_molar(local),
+        'overbite': batch_overbite(local, raw),
+        'overjet': batch_overjet(local),
+    }
+
+# —— 批量坐标系：_build_frame_axes 的逐行向量化版本（供蒙特卡洛 / bootstrap 一次求出 C 个坐标系）——
+def _b_dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.einsum('ck,ck->c', a, b)
+
+def _b_nrm(v: np.ndarray) -> np.ndarray:
+    """逐行单位化；模长 ≤ EPS 或含 NaN 的行为 NaN（同 v_nrm 返回 None）。"""
+    n = np.linalg.norm(v, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > EPS, v / np.where(n > EPS, n, 1.0), np.nan)
+
+def _b_ok(v: np.ndarray) -> np.ndarray:
+    return np.isfinite(v).all(axis=1)
+
+def _b_centroid(points: List[np.ndarray]) -> np.ndarray:
+    P = np.stack(points, axis=1)
+    ok = np.isfinite(P).all(axis=2)
+    n = ok.sum(axis=1)
+    s = np.where(ok[..., None], P, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where((n > 0)[:, None], s / np.maximum(n, 1)[:, None], np.nan)
+
+def _b_re_ortho_rh(ex: np.ndarray, ey: np.ndarray, ez: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ez_n = _b_nrm(ez)
+    ex_n = _b_nrm(ex - ez_n * _b_dot(ex, ez_n)[:, None])
+    ex_n = np.where(_b_ok(ex_n)[:, None], ex_n, _b_nrm(np.cross(ey, ez_n)))
+    ey_n = _b_nrm(np.cross(ez_n, ex_n))
+    return ex_n, ey_n, ez_n
+
+def batch_frame_axes(raw: LandmarkBatch, base=None,
+                     selectors: Optional[Dict[str, List[str]]] = None) -> np.ndarray:
+    """
+    与 _build_frame_axes 同口径的批量版本，返回 (C,4,3)（origin/ex/ey/ez；无法成系的行为 NaN）。
+    base：几何基座——build_occlusal_frame 的 geom_base 字典（全部行共用），或 (C,4,3) 逐行基座（NaN 行视为无基座）。
+    磨牙缺失 / 面内轴共线的行与单例一样退回几何基座（无基座则为 NaN）。
+    """
+    C = len(raw)
+    sel = dict(FRAME_SELECTORS)
+    if selectors:
+        sel.update({k: v for k, v in selectors.items() if isinstance(v, list)})
+    if isinstance(base, np.ndarray):
+        G = np.asarray(base, float)
+    else:
+        G = stack_frames([base.get('frame') if base else None] * C)
+    has_base = np.isfinite(G).all(axis=(1, 2))
+    origin_g, ez_g = G[:, 0], G[:, 3]
+
+    L6, R6 = raw.pick(sel['L6']), raw.pick(sel['R6'])
+    U11, U21 = raw.pick(sel['U11']), raw.pick(sel['U21'])
+    L31, L41 = raw.pick(sel['L31']), raw.pick(sel['L41'])
+    L33, R43 = raw.pick(sel['L33']), raw.pick(sel['R43'])
+
+    ey_raw = _b_nrm(L6 - R6)
+    mid_molar = 0.5 * (L6 + R6)
+    mid_incisal = _b_centroid([U11, U21, L31, L41])
+    mid_incisal = np.where(_b_ok(mid_incisal)[:, None], mid_incisal, _b_centroid([L33, R43]))
+    ex_raw = _b_nrm(mid_incisal - mid_molar)
+    with np.errstate(invalid='ignore'):
+        fallback = ~_b_ok(ey_raw) | ~_b_ok(ex_raw) | (np.abs(_b_dot(ex_raw, ey_raw)) > 0.98)
+
+    # 面：有基座投到几何面，否则 ex×ey 定 ez
+    ex_p, ey_p, ez_p = _b_re_ortho_rh(_b_nrm(ex_raw - ez_g * _b_dot(ex_raw, ez_g)[:, None]),
+                                      _b_nrm(ey_raw - ez_g * _b_dot(ey_raw, ez_g)[:, None]), ez_g)
+    ex_l, ey_l, ez_l = _b_re_ortho_rh(ex_raw, ey_raw, _b_nrm(np.cross(ex_raw, ey_raw)))
+    hb = has_base[:, None]
+    ex, ey, ez = np.where(hb, ex_p, ex_l), np.where(hb, ey_p, ey_l), np.where(hb, ez_p, ez_l)
+    origin = np.where(hb, origin_g, 0.5 * (mid_molar + mid_incisal))
+
+    def _apply(flag, new):
+        return tuple(np.where(flag[:, None], n, o) for n, o in zip(new, (ex, ey, ez)))
+
+    # 极性：Z 由上下切牙，Y 由下颌尖牙
+    Uc, Lc = _b_centroid([U11, U21]), _b_centroid([L31, L41])
+    with np.errstate(invalid='ignore'):
+        flip = _b_ok(Uc) & _b_ok(Lc) & (_b_dot(Uc - Lc, ez) < 0)
+    ex, ey, ez = _apply(flip, _b_re_ortho_rh(-ex, ey, -ez))
+    with np.errstate(invalid='ignore'):
+        flip = _b_ok(L33) & _b_ok(R43) & (_b_dot(L33 - R43, ey) < 0)
+    ex, ey, ez = _apply(flip, _b_re_ortho_rh(_b_nrm(np.cross(-ey, ez)), -ey, ez))
+
+    # X 微调：A-P 投影到面，前为 +X
+    dxp = _b_nrm((mid_incisal - mid_molar) - ez * _b_dot(mid_incisal - mid_molar, ez)[:, None])
+    with np.errstate(invalid='ignore'):
+        ex_new = np.where((_b_dot(dxp, ex) >= 0)[:, None], dxp, -dxp)
+    ex, ey, ez = _apply(_b_ok(dxp) & _b_ok(ex), _b_re_ortho_rh(ex_new, ey, ez))
+
+    F = np.stack([origin, ex, ey, ez], axis=1)
+    F[~np.isfinite(F).all(axis=(1, 2))] = np.nan
+    F[fallback] = G[fallback]
+    return F
+
+# =======================================================================
+# Uncertainty: 标注噪声的蒙特卡洛传播
+# Input: 一例地标 + 几何基座（咬合平面取自 STL，不随地标扰动）
+# Description: 全部有效地标各轴加独立高斯噪声 N(0, sigma_mm²)，K 组扰动叠成 LandmarkBatch，
+#   batch_frame_axes 一次重建 K 个坐标系、batch_metrics 一次重算全部指标；
+#   第 0 行不加噪声，作为名义值。
+# Output: 每个指标字段一项——
+#   数值：{'nominal', 'mean', 'std', 'ci': [lo, hi], 'valid_frac'}
+#   类别（文案 / is_* 判定）：{'nominal', 'probs': {类别: 频率}, 'flip_prob': 与名义值不同的比例}
+# =======================================================================
+UNCERTAINTY_DEFAULTS = {'samples': 1000, 'sigma_mm': 0.4, 'seed': 0, 'ci': 0.95}
+
+_RE_FLAG_FIELD = re.compile(r'(^|_)is_')
+
+def _py_scalar(v):
+    v = v.item() if isinstance(v, np.generic) else v
+    return None if isinstance(v, float) and v != v else v
+
+def _summarize_samples(field: str, nominal, samples: np.ndarray, ci: float) -> Dict:
+    if samples.dtype.kind in 'US' or _RE_FLAG_FIELD.search(field):
+        if samples.dtype.kind not in 'US':   # is_* 判定：1/0/NaN → True/False/None
+            to_label = lambda a: np.where(np.isnan(a), 'None', np.where(a > 0.5, 'True', 'False'))
+            labels, nom = to_label(samples), str(to_label(np.asarray([nominal]))[0])
+            cast = {'True': True, 'False': False, 'None': None}.get
+        else:
+            labels, nom, cast = samples, str(nominal), str
+        uniq, counts = np.unique(labels, return_counts=True)
+        n = max(len(labels), 1)
+        return {'nominal': cast(nom),
+                'probs': {str(cast(str(u))): round(float(c) / n, 6) for u, c in zip(uniq, counts)},
+                'flip_prob': round(float(np.mean(labels != nom)), 6) if len(labels) else 0.0}
+    vals = samples.astype(float)
+    ok = np.isfinite(vals)
+    out = {'nominal': _py_scalar(nominal), 'valid_frac': round(float(ok.mean()), 6) if len(vals) else 0.0}
+    if ok.any():
+        v = vals[ok]
+        lo, hi = np.quantile(v, [0.5 - ci / 2, 0.5 + ci / 2])
+        out.update({'mean': float(v.mean()), 'std': float(v.std()), 'ci': [float(lo), float(hi)]})
+    return out
+
+def _frame_spread(F: np.ndarray, nominal: np.ndarray) -> Dict:
+    """扰动坐标系相对名义坐标系：原点位移与各轴夹角（度）的中位数 / 95 分位。"""
+    ok = np.isfinite(F).all(axis=(1, 2))
+    out = {'missing_frac': round(float(1.0 - ok.mean()), 6) if len(F) else 0.0}
+    if not ok.any() or not np.isfinite(nominal).all():
+        return out
+    G = F[ok]
+    d = np.linalg.norm(G[:, 0] - nominal[0], axis=1)
+    out['origin_shift_mm'] = {'median': float(np.median(d)), 'p95': float(np.quantile(d, 0.95))}
+    for i, ax in ((1, 'ex'), (2, 'ey'), (3, 'ez')):
+        ang = np.degrees(np.arccos(np.clip(G[:, i] @ nominal[i], -1.0, 1.0)))
+        out[f'{ax}_angle_deg'] = {'median': float(np.median(ang)), 'p95': float(np.quantile(ang, 0.95))}
+    return out
+
+def landmark_uncertainty(landmarks, geom_base: Optional[Dict] = None, samples: int = 1000,
+                         sigma_mm: float = 0.4, seed: int = 0, ci: float = 0.95,
+                         selectors: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """
+    landmarks：LandmarkSet / 字典；geom_base：build_occlusal_frame 返回的 'geom_base'（None 则坐标系全由地标决定）。
+    返回 {'samples', 'sigma_mm', 'ci', 'frame': 坐标系离散度, 'metrics': {指标: {字段: 统计}}}
+    （指标/字段名同 batch_metrics）。
+    """
+    lm = as_landmark_set(landmarks)
+    one = LandmarkBatch.from_sets([lm])
+    K = int(samples)
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0.0, float(sigma_mm), size=(K + 1,) + one.xyz.shape[1:])
+    noise[0] = 0.0
+    raw = LandmarkBatch(one.names, one.index, one.xyz + noise, np.broadcast_to(one.valid, (K + 1,) + one.valid.shape[1:]))
+    with trace_stage('uncertainty_frames', samples=K):
+        F = batch_frame_axes(raw, geom_base, selectors)
+    with trace_stage('uncertainty_metrics', samples=K):
+        res = batch_metrics(raw, F)
+    metrics = {m: {k: _summarize_samples(k, v[0], v[1:], ci) for k, v in fields.items()}
+               for m, fields in res.items()}
+    return {'samples': K, 'sigma_mm': float(sigma_mm), 'ci': float(ci),
+            'frame': _frame_spread(F[1:], F[0]), 'metrics': metrics}
+
+def _sampling_cfg(key: str, value, defaults: Dict, count_key: str) -> Optional[Dict]:
+    """cfg[key]：True / 样本数 / 参数字典 → 补全默认值的参数；假值为 None。"""
+    if not value:
+        return None
+    if value is True:
+        return dict(defaults)
+    if isinstance(value, (int, float)):
+        return {**defaults, count_key: int(value)}
+    if isinstance(value, dict):
+        unknown = set(value) - set(defaults)
+        if unknown:
+            raise ValueError(f"unknown {key} options: {sorted(unknown)}")
+        return {**defaults, **value}
+    raise ValueError(f"cfg['{key}'] must be True, a sample count or a dict, got {value!r}")
+
+def uncertainty_cfg(value) -> Optional[Dict]:
+    """cfg['uncertainty']：True / 样本数 / {'samples', 'sigma_mm', 'seed', 'ci'}。"""
+    return _sampling_cfg('uncertainty', value, UNCERTAINTY_DEFAULTS, 'samples')
+
+# =======================================================================
+# Frame bootstrap: 几何咬合平面的稳定性
+# Input: 采样点云（同 _build_frame_from_geometry 的输入）、该例地标（可选）
+# Description: B 次有放回重采样；每块 (B,n,3) 一次批量矩阵乘求协方差、一次批量 eigh，
+#   按法向距截尾后再做一遍（与单例同样的两遍 PCA），得到 B 个几何基座；
+#   给出地标时经 batch_frame_axes / batch_metrics 得到最终坐标系与指标的离散度。
+#   第 0 行为未重采样的名义基座（即 _build_frame_from_geometry 的结果）。
+# Output: {'resamples', 'plane': 几何法向/原点离散度与 λ2/λ3, 'frame': 最终坐标系离散度,
+#          'metrics': 同 landmark_uncertainty, 'unstable': ez/ex 夹角 95 分位超过 max_angle_deg}
+# =======================================================================
+BOOTSTRAP_DEFAULTS = {'resamples': 200, 'seed': 0, 'ci': 0.95, 'max_angle_deg': 2.0}
+BOOTSTRAP_CHUNK_BYTES = 64 << 20   # 每块重采样点 (b,n,3) float64 的内存上限
+
+def bootstrap_cfg(value) -> Optional[Dict]:
+    """cfg['frame_bootstrap']：True / 重采样次数 / {'resamples', 'seed', 'ci', 'max_angle_deg'}。"""
+    return _sampling_cfg('frame_bootstrap', value, BOOTSTRAP_DEFAULTS, 'resamples')
+
+def _batched_plane_frames(P: np.ndarray, idx: np.ndarray, trim_pct: float) -> Tuple[np.ndarray, np.ndarray]:
+    """idx (b,n) 个重采样 → 几何基座 (b,4,3) 与截尾后特征值（降序）(b,3)。"""
+    Pb = P[idx]
+    n = Pb.shape[1]
+    X = Pb - Pb.mean(axis=1, keepdims=True)
+    _, V = np.linalg.eigh(np.matmul(X.transpose(0, 2, 1), X) / (n - 1))   # 批量 X^T X（BLAS，快于 einsum）
+    ez0 = _b_nrm(np.cross(V[:, :, 2], V[:, :, 1]))
+    keep_n = min(n, max(100, int(n * trim_pct)))
+    if keep_n < n:
+        d = np.nan_to_num(np.abs(np.matmul(X, ez0[:, :, None])[..., 0]), nan=0.0)
+        Pb = np.take_along_axis(Pb, np.argpartition(d, keep_n - 1, axis=1)[:, :keep_n, None], axis=1)
+    c1 = Pb.mean(axis=1)
+    X1 = Pb - c1[:, None]
+    w1, V1 = np.linalg.eigh(np.matmul(X1.transpose(0, 2, 1), X1) / (keep_n - 1))
+    e1, e2 = V1[:, :, 2], V1[:, :, 1]
+    ex, ey, ez = _b_re_ortho_rh(e1, e2, _b_nrm(np.cross(e1, e2)))
+    return np.stack([c1, ex, ey, ez], axis=1), w1[:, ::-1]
+
+def _angle_stats(ang: np.ndarray) -> Dict:
+    return {'median': float(np.median(ang)), 'p95': float(np.quantile(ang, 0.95))}
+
+def geometry_frame_bootstrap(points, landmarks=None, cfg: Optional[Dict] = None, resamples: int = 200,
+                             seed: int = 0, ci: float = 0.95, max_angle_deg: float = 2.0) -> Optional[Dict]:
+    """
+    points：采样点云 (M,3)；cfg：同 build_occlusal_frame 的 cfg（maxPoints / trimPct / seed）。
+    点数不足 50（几何平面不可用）时返回 None。
+    """
+    P = _as_points(points)
+    if P is None or len(P) < 50:
+        return None
+    cfg = cfg or {}
+    nominal = _build_frame_from_geometry(P, cfg)
+    P = _geometry_subsample(P, cfg)
+    n, B = len(P), int(resamples)
+    trim_pct = float(np.clip(cfg.get('trimPct', 0.5), 0.2, 0.9))
+    rng = np.random.default_rng(seed)
+    chunk = max(1, int(BOOTSTRAP_CHUNK_BYTES // (n * 3 * 8)))
+    G = np.empty((B + 1, 4, 3))
+    lam = np.empty((B, 3))
+    G[0] = stack_frames([nominal['frame']])[0]
+    for s in range(0, B, chunk):
+        b = min(chunk, B - s)
+        G[1 + s:1 + s + b], lam[s:s + b] = _batched_plane_frames(P, rng.integers(0, n, size=(b, n)), trim_pct)
+
+    ez_ang = np.degrees(np.arccos(np.clip(np.abs(G[1:, 3] @ G[0, 3]), 0.0, 1.0)))   # 法向不计符号
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.where(lam[:, 2] > EPS, lam[:, 1] / np.where(lam[:, 2] > EPS, lam[:, 2], 1.0), np.nan)
+    out = {'resamples': B,
+           'plane': {'ez_angle_deg': _angle_stats(ez_ang),
+                     'origin_shift_mm': _angle_stats(np.linalg.norm(G[1:, 0] - G[0, 0], axis=1)),
+                     'lambda_ratio': {'median': float(np.nanmedian(ratio)), 'p05': float(np.nanquantile(ratio, 0.05))}}}
+    spread = {'ez_angle_deg': out['plane']['ez_angle_deg']}
+    if landmarks is not None:
+        one = LandmarkBatch.from_sets([as_landmark_set(landmarks)])
+        raw = LandmarkBatch(one.names, one.index, np.broadcast_to(one.xyz, (B + 1,) + one.xyz.shape[1:]),
+                            np.broadcast_to(one.valid, (B + 1,) + one.valid.shape[1:]))
+        F = batch_frame_axes(raw, G)
+        res = batch_metrics(raw, F)
+        out['frame'] = spread = _frame_spread(F[1:], F[0])
+        out['metrics'] = {m: {k: _summarize_samples(k, v[0], v[1:], ci) for k, v in fields.items()}
+                          for m, fields in res.items()}
+    out['unstable'] = bool(spread.get('missing_frac', 0.0) > 0.0 or any(
+        spread.get(f'{ax}_angle_deg', {}).get('p95', 0.0) > max_angle_deg for ax in ('ex', 'ez')))
+    return out
 
 # ================================
 # I/O helpers (STL + Landmarks)
@@ -1676,15 +3554,50 @@ def make_brief_report(landmarks, frame):
 import json, os, numpy as np
 from typing import Dict, List, Optional
 
-def _load_landmarks_json(path: str) -> Dict[str, List[float]]:
-    """读取 Slicer Markups JSON，提取 {label: position} 字典。"""
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    out = {}
+# Slicer Markups 每个控制点带 orientation 矩阵与一串状态字段（约占文件九成），这里只需 label / position：
+#   orjson 可用时整篇解析（C 实现，足够快）；否则按 token 扫描，只抽 label 与 position，
+#   结构不符合预期（缺 label、position 非三元数组、键顺序不同等）时回退标准库 json 完整解析。
+#   三条路径结果一致：同名后者覆盖前者，坐标非法的点跳过。
+#   第三个分支兜住形状不对的 label / position（如 "position": null），命中即回退
+_RE_MARKUP_TOKEN = re.compile(r'"(?:label"\s*:\s*"((?:[^"\\]|\\.)*)"|position"\s*:\s*\[([^\]\[]*)\]|(?:label|position)")')
+
+def _scan_markups(text: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    """label / position 严格交替出现时返回 (labels, (N,3))；否则 None（交给完整解析）。"""
+    body = text.strip()
+    if not (body.startswith('{') and body.endswith('}')):
+        return None
+    labels: List[str] = []
+    coords: List[str] = []
+    pending = None
+    for m in _RE_MARKUP_TOKEN.finditer(text):
+        k = m.lastindex
+        if k == 1 and pending is None:
+            pending = m.group(1)
+        elif k == 2 and pending is not None and m.group(2).count(',') == 2:
+            labels.append(pending)
+            coords.append(m.group(2))
+            pending = None
+        else:
+            return None
+    if pending is not None:
+        return None
+    try:
+        xyz = np.array(','.join(coords).split(','), dtype=float).reshape(-1, 3) if coords else np.empty((0, 3))
+    except ValueError:
+        return None
+    labels = [json.loads(f'"{lb}"') if '\\' in lb else lb for lb in labels]
+    keep = [i for i, lb in enumerate(labels) if lb]
+    if len(keep) != len(labels):
+        labels, xyz = [labels[i] for i in keep], xyz[keep]
+    return labels, xyz
+
+def _markups_points(data) -> Tuple[List[str], np.ndarray]:
+    """已解析的 Markups 文档 → (labels, (N,3))；跳过无 label 或坐标不是三个数的点。"""
+    labels: List[str] = []
+    pts: List[List[float]] = []
     # 健壮性检查：确保路径存在且结构符合预期
-    if not data or 'markups' not in data or not data['markups']:
-        return out
-    
+    if not data or not isinstance(data, dict) or not data.get('markups'):
+        return labels, np.empty((0, 3))
     # 通常只有一个 markup list，但可以遍历以防万一
     for markup in data['markups']:
         if 'controlPoints' not in markup:
@@ -1694,50 +3607,1364 @@ def _load_landmarks_json(path: str) -> Dict[str, List[float]]:
             pos = cp.get('position')
             if label and isinstance(pos, list) and len(pos) == 3:
                 try:
-                    out[str(label)] = [float(pos[0]), float(pos[1]), float(pos[2])]
+                    pts.append([float(pos[0]), float(pos[1]), float(pos[2])])
                 except (ValueError, TypeError):
-                    pass  # 忽略无法转换的坐标
+                    continue  # 忽略无法转换的坐标
+                labels.append(str(label))
+    return labels, np.asarray(pts, dtype=float).reshape(-1, 3)
+
+def _landmark_set_from_points(labels: List[str], xyz: np.ndarray) -> LandmarkSet:
+    last = dict(zip(labels, range(len(labels))))   # 同名后者覆盖前者
+    out = LandmarkSet.empty(list(last))
+    if last:
+        rows = np.fromiter((out.index[nm] for nm in last), dtype=np.intp, count=len(last))
+        out.xyz[rows] = xyz[np.fromiter(last.values(), dtype=np.intp, count=len(last))]
+        out.valid[rows] = np.isfinite(out.xyz[rows]).all(axis=1)
     return out
 
-def _merge_landmarks(*dicts: Dict[str, List[float]]) -> Dict[str, List[float]]:
-    """简单合并（后者覆盖前者）。上下颌 FDI 编码本身不冲突，一般不会覆盖。"""
-    out = {}
-    for d in dicts:
-        out.update(d or {})
-    return out
+def parse_markups(raw) -> Tuple[LandmarkSet, Dict]:
+    """
+    解析 Slicer Markups JSON（bytes / str），同时按 dict.json 协议校验标签。
+    返回 (LandmarkSet, info)：info = {'backend': 'orjson'|'scan'|'json', 'points',
+    'unknown_labels'（协议外标签，按出现顺序）, 'duplicate_labels'}。JSON 非法时抛 ValueError。
+    """
+    orjson = _optional_module('orjson')
+    parsed = None
+    if orjson is not None:
+        backend = 'orjson'
+        try:
+            parsed = _markups_points(orjson.loads(raw))
+        except ValueError:
+            parsed = None   # orjson 更严格（如不接受 NaN），交给下面的路径
+    if parsed is None:
+        text = raw.decode('utf-8') if isinstance(raw, (bytes, bytearray)) else raw
+        backend = 'scan'
+        parsed = _scan_markups(text)
+        if parsed is None:
+            backend = 'json'
+            parsed = _markups_points(json.loads(text))
+    labels, xyz = parsed
+    lm = _landmark_set_from_points(labels, xyz)
+    dups: List[str] = []
+    if len(set(labels)) != len(labels):
+        from collections import Counter
+        dups = [nm for nm, c in Counter(labels).items() if c > 1]
+    info = {'backend': backend, 'points': len(labels),
+            'unknown_labels': list(lm.names[len(landmark_protocol()[0]):]), 'duplicate_labels': dups}
+    return lm, info
+
+def load_markups(path: str, strict: bool = False) -> Tuple[LandmarkSet, Dict]:
+    """
+    读取并解析 Markups 文件（见 parse_markups）；strict=True 时协议外或重复的标签抛 ValueError。
+    path 也可以是 .lmk 容器：'x.lmk'（单条记录）或 'cohort.lmk#<记录名>'（见 LmkFile）。
+    """
+    if _split_lmk_path(path) is not None:
+        lm, info = _load_lmk_record(path)
+    else:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        lm, info = parse_markups(raw)
+    if strict and (info['unknown_labels'] or info['duplicate_labels']):
+        problems = [f"{what}: {info[key]}" for key, what in (('unknown_labels', 'labels not in dict.json protocol'),
+                                                              ('duplicate_labels', 'duplicate labels')) if info[key]]
+        raise ValueError(f"{path}: {'; '.join(problems)}")
+    return lm, info
+
+def _load_landmarks_json(path: str, strict: bool = False) -> LandmarkSet:
+    """读取 Slicer Markups JSON，提取 {label: position} 并装入 LandmarkSet（strict 见 load_markups）。"""
+    return load_markups(path, strict)[0]
 
-def _load_stl_points(path: str) -> Optional[np.ndarray]:
-    """尽量读取 STL 顶点点云。优先 trimesh；回退 numpy-stl；都不可用则返回 None。"""
-    if not path or not os.path.exists(path):
+# ================================
+# Binary landmark container (.lmk)：整个病例库的地标放进一个文件，读取即 mmap
+#   b'LMK1' + uint32 头长 + 头（UTF-8 JSON，空格补齐到 64 字节对齐）
+#   + xyz float32 (R,N,3)（无效处为 NaN）+ 有效位图 uint8 (R,ceil(N/8))（packbits，低位在前）
+#   N 列 = dict.json 协议顺序（头中记协议摘要，协议变化时拒绝读取）+ 头中的额外标签
+#   头：coordinate_system / units（同 Slicer 文件，默认 LPS / mm）、records（记录名）、issues（协议外 / 重复标签）
+# ================================
+LMK_MAGIC = b'LMK1'
+LMK_SUFFIX = '.lmk'
+LMK_ALIGN = 64
+
+def _protocol_digest() -> str:
+    import hashlib
+    return hashlib.blake2b('\n'.join(landmark_protocol()[0]).encode('utf-8'), digest_size=8).hexdigest()
+
+def _split_lmk_path(path: str) -> Optional[Tuple[str, Optional[str]]]:
+    """'a.lmk' → ('a.lmk', None)；'a.lmk#1_U' → ('a.lmk', '1_U')；非 .lmk 路径返回 None。"""
+    path = str(path)
+    base, sep, rec = path.rpartition('#')
+    if sep and base.endswith(LMK_SUFFIX):
+        return base, rec
+    return (path, None) if path.endswith(LMK_SUFFIX) else None
+
+class LmkFile:
+    """
+    只读的 .lmk 容器：xyz / bitmap 为 np.memmap，取记录时才拷出该行（float64 LandmarkSet）。
+    同一文件在进程内经 open_lmk 复用，万例队列的批量计算只打开一次。
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            head = f.read(8)
+            if len(head) < 8 or head[:4] != LMK_MAGIC:
+                raise ValueError(f"{path}: not a .lmk landmark container")
+            header = json.loads(f.read(int(np.frombuffer(head[4:], '<u4')[0])).decode('utf-8'))
+        if header.get('protocol_digest') != _protocol_digest():
+            raise ValueError(f"{path}: written with a different dict.json protocol; re-run convert")
+        self.path = path
+        self.header = header
+        self.records: List[str] = list(header.get('records', []))
+        self.record_index = {nm: i for i, nm in enumerate(self.records)}
+        proto, _ = landmark_protocol()
+        extra = list(header.get('extra_labels', []))
+        if extra:
+            self.names = proto + tuple(extra)
+            self.index = {nm: i for i, nm in enumerate(self.names)}
+        else:
+            self.names, self.index = landmark_protocol()   # 与 JSON 读入的 LandmarkSet 共用同一张表
+        R, N = len(self.records), len(self.names)
+        off = int(header['data_offset'])
+        if R == 0:
+            self.xyz, self.bitmap = np.zeros((0, N, 3), '<f4'), np.zeros((0, (N + 7) // 8), np.uint8)
+        else:
+            self.xyz = np.memmap(path, dtype='<f4', mode='r', offset=off, shape=(R, N, 3))
+            self.bitmap = np.memmap(path, dtype=np.uint8, mode='r', offset=off + R * N * 12, shape=(R, (N + 7) // 8))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def _row(self, record) -> int:
+        if isinstance(record, (int, np.integer)):
+            return int(record)
+        i = self.record_index.get(record)
+        if i is None:
+            raise KeyError(f"{self.path}: no record {record!r}")
+        return i
+
+    def valid(self, rows=None) -> np.ndarray:
+        bm = self.bitmap if rows is None else self.bitmap[rows]
+        return np.unpackbits(bm, axis=-1, count=len(self.names), bitorder='little').astype(bool)
+
+    def landmark_set(self, record) -> LandmarkSet:
+        i = self._row(record)
+        valid = self.valid(i)
+        xyz = np.asarray(self.xyz[i], dtype=float)
+        return LandmarkSet(self.names, self.index, xyz, valid)
+
+    def batch(self, records: Optional[List] = None) -> 'LandmarkBatch':
+        """所选记录（缺省为全部）→ LandmarkBatch，直接喂给 batch_metrics。"""
+        rows = np.arange(len(self.records)) if records is None else np.array([self._row(r) for r in records], dtype=np.intp)
+        valid = self.valid(rows)
+        xyz = np.asarray(self.xyz[rows], dtype=float)
+        xyz[~valid] = np.nan
+        return LandmarkBatch(self.names, self.index, xyz, valid)
+
+_LMK_FILES: Dict[str, Tuple[Tuple, LmkFile]] = {}
+
+def open_lmk(path: str) -> LmkFile:
+    """按 (路径, mtime, 大小) 复用已打开的容器；文件被重写后自动重新打开。"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size, getattr(st, 'st_ino', 0))
+    hit = _LMK_FILES.get(path)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    lmk = LmkFile(path)
+    _LMK_FILES[path] = (stamp, lmk)
+    return lmk
+
+def _load_lmk_record(path: str) -> Tuple[LandmarkSet, Dict]:
+    fn, rec = _split_lmk_path(path)
+    lmk = open_lmk(fn)
+    if rec is None:
+        if len(lmk) != 1:
+            raise ValueError(f"{fn}: container holds {len(lmk)} records; address one as '{fn}#<record>'")
+        rec = lmk.records[0]
+    lm = lmk.landmark_set(rec)
+    issues = lmk.header.get('issues', {}).get(rec, {})
+    n_proto = len(landmark_protocol()[0])
+    info = {'backend': 'lmk', 'points': len(lm),
+            'unknown_labels': [nm for nm in lm.names[n_proto:] if nm in lm],
+            'duplicate_labels': list(issues.get('duplicate_labels', []))}
+    return lm, info
+
+def write_lmk(path: str, records, coordinate_system: str = 'LPS', units: str = 'mm',
+              issues: Optional[Dict[str, Dict]] = None) -> int:
+    """
+    records：[(记录名, LandmarkSet / {名: xyz})] 或 {记录名: ...}；按协议列 + 额外标签写成一个 .lmk。
+    原子写入（先写临时文件再替换）；返回记录数。
+    """
+    items = list(records.items()) if isinstance(records, dict) else list(records)
+    names_rec = [str(nm) for nm, _ in items]
+    if len(set(names_rec)) != len(names_rec):
+        raise ValueError("duplicate record names")
+    sets = [as_landmark_set(lm) for _, lm in items]
+    proto, _ = landmark_protocol()
+    layout = LandmarkSet.empty([nm for s in sets for nm in s.names[len(proto):] if nm in s])
+    R, N = len(sets), len(layout.names)
+    xyz = np.full((R, N, 3), np.nan, dtype='<f4')
+    valid = np.zeros((R, N), dtype=bool)
+    for r, s in enumerate(sets):
+        rows = np.flatnonzero(s.valid)
+        cols = rows if s.names == layout.names else \
+            np.fromiter((layout.index[s.names[i]] for i in rows), dtype=np.intp, count=len(rows))
+        xyz[r, cols] = s.xyz[rows]
+        valid[r, cols] = True
+    header = {'format': 'lmk', 'version': 1, 'coordinate_system': coordinate_system, 'units': units,
+              'protocol_digest': _protocol_digest(), 'extra_labels': list(layout.names[len(proto):]),
+              'records': names_rec, 'issues': {k: v for k, v in (issues or {}).items() if v},
+              'data_offset': 1 << 40}   # 占位，按最长位数估头长
+    off = -(-(8 + len(json.dumps(header, ensure_ascii=False).encode('utf-8'))) // LMK_ALIGN) * LMK_ALIGN
+    header['data_offset'] = off
+    blob = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    blob = blob + b' ' * (off - 8 - len(blob))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(LMK_MAGIC + np.uint32(len(blob)).tobytes() + blob)
+            f.write(xyz.tobytes())
+            f.write(np.packbits(valid, axis=-1, bitorder='little').tobytes())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return R
+
+_RE_MARKUP_COORDS = re.compile(r'"coordinateSystem"\s*:\s*"(\w+)"')
+_RE_MARKUP_UNITS = re.compile(r'"coordinateUnits"\s*:\s*"(\w+)"')
+
+def convert_markups(sources: List[str], out_path: str, strict: bool = False, progress=None) -> Dict:
+    """
+    Slicer Markups JSON → .lmk。out_path 以 .lmk 结尾：全部写进一个容器（记录名 = 文件名去掉 .json）；
+    否则视为目录，每个 JSON 写一个同名 .lmk。坐标系 / 单位不一致的文件不能进同一容器（ValueError）。
+    返回 {'records', 'skipped': [(路径, 原因)], 'issues': {记录名: {...}}}。
+    """
+    single = out_path.endswith(LMK_SUFFIX)
+    records, issues, skipped, frames = [], {}, [], set()
+    for i, src in enumerate(sources, 1):
+        name = os.path.splitext(os.path.basename(src))[0]
+        try:
+            with open(src, 'rb') as f:
+                raw = f.read()
+            lm, info = parse_markups(raw)
+        except (OSError, ValueError) as e:
+            skipped.append((src, f"{type(e).__name__}: {e}"))
+            continue
+        if info['points'] == 0:
+            skipped.append((src, 'no control points'))
+            continue
+        if strict and (info['unknown_labels'] or info['duplicate_labels']):
+            skipped.append((src, f"labels outside protocol {info['unknown_labels']}, duplicates {info['duplicate_labels']}"))
+            continue
+        text = raw[:4096].decode('utf-8', 'ignore')
+        cs, un = _RE_MARKUP_COORDS.search(text), _RE_MARKUP_UNITS.search(text)
+        frame = (cs.group(1) if cs else 'LPS', un.group(1) if un else 'mm')
+        rec_issues = {k: info[k] for k in ('unknown_labels', 'duplicate_labels') if info[k]}
+        if single:
+            frames.add(frame)
+            records.append((name, lm))
+            issues[name] = rec_issues
+        else:
+            os.makedirs(out_path, exist_ok=True)
+            write_lmk(os.path.join(out_path, name + LMK_SUFFIX), [(name, lm)], *frame, issues={name: rec_issues})
+            records.append((name, None))
+        if progress is not None:
+            progress(i, len(sources), src)
+    if single:
+        if len(frames) > 1:
+            raise ValueError(f"mixed coordinate systems / units: {sorted(frames)}")
+        write_lmk(out_path, records, *(frames.pop() if frames else ('LPS', 'mm')), issues=issues)
+    return {'records': len(records), 'skipped': skipped, 'issues': {k: v for k, v in issues.items() if v}}
+
+def _merge_landmarks(*sets) -> LandmarkSet:
+    """简单合并（后者覆盖前者）。上下颌 FDI 编码本身不冲突，一般不会覆盖。接受 LandmarkSet 或字典。"""
+    sets = [as_landmark_set(d) for d in sets if d is not None]
+    if not sets:
+        return LandmarkSet.empty()
+    return sets[0].merged(*sets[1:])
+
+# 二进制 STL：80 字节头 + uint32 三角形数 + 每三角形 50 字节（法向 3f、顶点 3×3f、属性 u2）
+STL_RECORD_DTYPE = np.dtype([('normal', '<f4', (3,)), ('v', '<f4', (3, 3)), ('attr', '<u2')])
+
+def _read_stl_triangles(path: str) -> Optional[np.ndarray]:
+    """
+    内置 STL 读取，返回 (T,3,3) float32 三角形顶点。
+    二进制：np.memmap 按 STL_RECORD_DTYPE 直接映射记录区，返回字段视图（不拷贝、不解析）；
+    以文件大小 == 84 + 50*T 判定二进制（部分二进制文件头也以 "solid" 开头）。
+    ASCII：整体切词后按 'vertex' 标记向量化取坐标。无法识别时返回 None。
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(84)
+    if len(head) == 84:
+        n_tri = int.from_bytes(head[80:84], 'little')
+        if 84 + STL_RECORD_DTYPE.itemsize * n_tri == size:
+            if n_tri == 0:
+                return np.zeros((0, 3, 3), dtype=np.float32)
+            rec = np.memmap(path, dtype=STL_RECORD_DTYPE, mode='r', offset=84, shape=(n_tri,))
+            return rec['v']
+    return _read_stl_ascii(path)
+
+def _read_stl_ascii(path: str) -> Optional[np.ndarray]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.lstrip()[:5].lower() != b'solid':
+        return None
+    tok = np.array(data.split())
+    at = np.flatnonzero(tok == b'vertex')
+    if len(at) == 0 or len(at) % 3 or at[-1] + 3 >= len(tok):
         return None
     try:
-        import trimesh  # type: ignore
-        m = trimesh.load(path, force='mesh')
-        if hasattr(m, 'vertices'):
-            P = np.asarray(m.vertices, dtype=float)
-            return P[np.isfinite(P).all(axis=1)]
-    except Exception:
-        pass
+        V = tok[at[:, None] + np.arange(1, 4)].astype(np.float32)
+    except ValueError:
+        return None
+    return V.reshape(-1, 3, 3)
+
+WELD_TOL_MM = 1e-4   # 焊接量化栅格（mm）；默认只合并数值上重合的顶点
+
+def _weld_vertices(P: np.ndarray, tol_mm: float = WELD_TOL_MM) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    顶点焊接：把 (M,3) 点量化到 tol_mm 栅格，同一格内的点视为同一顶点。
+    三轴格坐标能放进 21 bit 时打包成单个 int64 键做一维 np.unique，否则退回按行 unique。
+    返回 (V (K,3) 唯一顶点（取每格首个原始坐标）, inverse (M,) 原点 → V 的索引)。
+    """
+    P = np.asarray(P)
+    if len(P) == 0:
+        return P.reshape(0, 3), np.zeros(0, dtype=np.int64)
+    q = np.floor(P / float(tol_mm) + 0.5).astype(np.int64)
+    q -= q.min(axis=0)
+    if int(q.max()) < (1 << 21):
+        key = (q[:, 0] << 42) | (q[:, 1] << 21) | q[:, 2]
+        _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(q, axis=0, return_index=True, return_inverse=True)
+    return P[first], inverse.reshape(-1)
+
+def _weld_triangles(T: np.ndarray, tol_mm: float = WELD_TOL_MM) -> Tuple[np.ndarray, np.ndarray]:
+    """(T,3,3) 三角形 → (V (K,3) float64, F (T',3) int64)；丢弃含非有限坐标或焊接后退化的三角形。"""
+    T = np.asarray(T, dtype=float)
+    T = T[np.isfinite(T).all(axis=(1, 2))]
+    V, inv = _weld_vertices(T.reshape(-1, 3), tol_mm)
+    F = inv.reshape(-1, 3)
+    F = F[(F[:, 0] != F[:, 1]) & (F[:, 1] != F[:, 2]) & (F[:, 0] != F[:, 2])]
+    return V, F
+
+def _load_stl_mesh(path: str, weld_tol_mm: float = WELD_TOL_MM,
+                   cache: Optional['MeshCache'] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    读取 STL 并焊接为 (V, F)。优先内置读取（_read_stl_triangles）；
+    无法识别时回退 trimesh / numpy-stl（均为可选依赖，仅此时才导入）；都不可用则返回 None。
+    无论哪个读取器，输出都经同一焊接步骤，得到同一份紧凑、无重复的顶点集。
+    cache：命中时直接返回 .npy 的 mmap 视图；未命中则解析后写入缓存。
+    """
+    if not path or not os.path.exists(path):
+        return None
+    if cache is not None:
+        hit = cache.load_mesh(path, weld_tol_mm)
+        if hit is not None:
+            return hit
+    mesh = _parse_stl_mesh(path, weld_tol_mm)
+    if mesh is not None and cache is not None:
+        cache.store_mesh(path, weld_tol_mm, mesh)
+    return mesh
+
+def _parse_stl_mesh(path: str, weld_tol_mm: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
     try:
-        from stl import mesh  # type: ignore
-        m = mesh.Mesh.from_file(path)
-        P = m.vectors.reshape(-1, 3)
-        return P[np.isfinite(P).all(axis=1)]
-    except Exception:
+        T = _read_stl_triangles(path)
+    except (OSError, ValueError):
+        T = None
+    trimesh = _optional_module('trimesh') if T is None else None
+    if trimesh is not None:
+        try:
+            m = trimesh.load(path, force='mesh')
+            if hasattr(m, 'vertices') and hasattr(m, 'faces'):
+                T = np.asarray(m.vertices, dtype=float)[np.asarray(m.faces, dtype=np.int64)]
+        except Exception:
+            T = None
+    stl_mesh = _optional_module('stl.mesh') if T is None else None
+    if T is None:
+        if stl_mesh is None:
+            return None
+        try:
+            T = stl_mesh.Mesh.from_file(path).vectors
+        except Exception:
+            return None
+    return _weld_triangles(T, weld_tol_mm)
+
+_OPTIONAL_MODULES: Dict[str, object] = {}
+
+def _optional_module(name: str):
+    """
+    可选依赖（trimesh / numpy-stl）：首次用到才导入，结果（含“未安装”）记入进程级缓存。
+    Python 不缓存失败的 import，否则每个读不懂的文件都要重新扫描一遍 sys.path。
+    """
+    if name not in _OPTIONAL_MODULES:
+        import importlib
+        try:
+            _OPTIONAL_MODULES[name] = importlib.import_module(name)
+        except Exception:
+            _OPTIONAL_MODULES[name] = None
+    return _OPTIONAL_MODULES[name]
+
+def _load_stl_points(path: str, weld_tol_mm: float = WELD_TOL_MM,
+                     cache: Optional['MeshCache'] = None) -> Optional[np.ndarray]:
+    """读取 STL 顶点点云（焊接后的唯一顶点，见 _load_stl_mesh）；不可读时返回 None。"""
+    mesh = _load_stl_mesh(path, weld_tol_mm, cache)
+    return None if mesh is None else mesh[0]
+
+# ================================
+# Mesh cache：焊接后的顶点/面片按内容哈希落盘（.npy，命中即 mmap）
+#   文件名：<blake2b>-l<MESH_LOADER_VERSION>-w<焊接容差nm>.<tag>.npy
+#   tag：v（顶点）、f（面片）；其他 tag 供派生数组（如采样子集）使用
+#   同一 key 的文件为一个条目，按条目 mtime 做 LRU，超出 max_bytes 时淘汰最旧条目
+# ================================
+MESH_LOADER_VERSION = 1   # 读取/焊接口径变化时递增，旧缓存自然失效
+MESH_CACHE_ENV = 'LANDMARK_MESH_CACHE'
+MESH_CACHE_MAX_BYTES = 4 << 30
+
+_DIGEST_MEMO: Dict[Tuple[str, int, int], str] = {}
+
+def file_digest(path: str, chunk: int = 1 << 20) -> str:
+    """文件内容哈希（blake2b-128）；同一进程内按 (路径, 大小, mtime) 记忆，避免重复读盘。"""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    hit = _DIGEST_MEMO.get(memo_key)
+    if hit is not None:
+        return hit
+    import hashlib
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    _DIGEST_MEMO[memo_key] = h.hexdigest()
+    return _DIGEST_MEMO[memo_key]
+
+class MeshCache:
+    """
+    root 为绝对路径：集中缓存目录；为相对路径（如 '.meshcache'）：放在每个源文件旁的该子目录。
+    """
+    def __init__(self, root: str, max_bytes: int = MESH_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+
+    def dir_for(self, path: str) -> str:
+        if os.path.isabs(self.root):
+            return self.root
+        return os.path.join(os.path.dirname(os.path.abspath(path)), self.root)
+
+    def key(self, path: str, weld_tol_mm: float = WELD_TOL_MM) -> str:
+        return f"{file_digest(path)}-l{MESH_LOADER_VERSION}-w{int(round(weld_tol_mm * 1e6))}nm"
+
+    def _file(self, path: str, key: str, tag: str) -> str:
+        return os.path.join(self.dir_for(path), f"{key}.{tag}.npy")
+
+    def get_array(self, path: str, key: str, tag: str) -> Optional[np.ndarray]:
+        fn = self._file(path, key, tag)
+        try:
+            arr = np.load(fn, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(fn)   # LRU：命中即刷新 mtime
+        except OSError:
+            pass
+        return arr
+
+    def put_array(self, path: str, key: str, tag: str, arr: np.ndarray) -> None:
+        d = self.dir_for(path)
+        os.makedirs(d, exist_ok=True)
+        fn = self._file(path, key, tag)
+        tmp = f"{fn}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, fn)   # 原子替换，并发 worker 不会读到半个文件
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.prune(d)
+
+    def load_mesh(self, path: str, weld_tol_mm: float = WELD_TOL_MM) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        key = self.key(path, weld_tol_mm)
+        V = self.get_array(path, key, 'v')
+        F = self.get_array(path, key, 'f') if V is not None else None
+        return (V, F) if F is not None else None
+
+    def store_mesh(self, path: str, weld_tol_mm: float, mesh: Tuple[np.ndarray, np.ndarray]) -> None:
+        key = self.key(path, weld_tol_mm)
+        self.put_array(path, key, 'f', mesh[1])
+        self.put_array(path, key, 'v', mesh[0])   # v 最后写：v 存在即条目完整
+
+    def entries(self, d: Optional[str] = None) -> List[Dict]:
+        """[{key, files, bytes, mtime}]，按 mtime 升序（最久未用在前）。"""
+        d = d or self.root
+        groups: Dict[str, Dict] = {}
+        try:
+            it = list(os.scandir(d))
+        except OSError:
+            return []
+        for e in it:
+            if not e.name.endswith('.npy') or not e.is_file():
+                continue
+            st = e.stat()
+            g = groups.setdefault(e.name.split('.', 1)[0], {'files': [], 'bytes': 0, 'mtime': 0.0})
+            g['files'].append(e.path)
+            g['bytes'] += st.st_size
+            g['mtime'] = max(g['mtime'], st.st_mtime)
+        return sorted(({'key': k, **g} for k, g in groups.items()), key=lambda g: g['mtime'])
+
+    def prune(self, d: Optional[str] = None, max_bytes: Optional[int] = None) -> Dict:
+        """淘汰最久未用的条目直到总量 ≤ max_bytes；返回 {'removed', 'bytes'}。"""
+        limit = self.max_bytes if max_bytes is None else int(max_bytes)
+        ents = self.entries(d)
+        total = sum(e['bytes'] for e in ents)
+        removed = 0
+        for e in ents:
+            if total <= limit:
+                break
+            for fn in e['files']:
+                try:
+                    os.remove(fn)
+                except OSError:
+                    pass
+            total -= e['bytes']
+            removed += 1
+        return {'removed': removed, 'bytes': total}
+
+    def prewarm(self, paths: List[str], weld_tol_mm: float = WELD_TOL_MM, progress=None) -> int:
+        n = 0
+        for i, p in enumerate(paths):
+            if self.load_mesh(p, weld_tol_mm) is None:
+                mesh = _parse_stl_mesh(p, weld_tol_mm)
+                if mesh is not None:
+                    self.store_mesh(p, weld_tol_mm, mesh)
+                    n += 1
+            if progress:
+                progress(i + 1, len(paths), p)
+        return n
+
+def mesh_cache_from_cfg(cfg: Optional[Dict]) -> Optional[MeshCache]:
+    """cfg['mesh_cache']：MeshCache / 目录 / False；缺省时读环境变量 LANDMARK_MESH_CACHE。"""
+    cfg = cfg or {}
+    c = cfg.get('mesh_cache', os.environ.get(MESH_CACHE_ENV) or None)
+    if not c:
         return None
+    if isinstance(c, MeshCache):
+        return c
+    return MeshCache(str(c), int(cfg.get('mesh_cache_max_bytes', MESH_CACHE_MAX_BYTES)))
+
+# ---------- 采样器：确定性（带种子）、可插拔的下采样 ----------
+#   random：均匀随机（np.random.Generator.choice，无放回；大 n 小样本时为 O(budget)）
+#   voxel ：体素栅格，每个占用体素取一个代表点，抑制高密度网格区的过采样
+#   area  ：按顶点所辖面积（邻接三角形面积/3）加权的无放回抽样（Efraimidis–Spirakis 键 + argpartition）
+SAMPLER_MODES = ('random', 'voxel', 'area')
+SAMPLER_DEFAULTS = {'mode': 'random', 'seed': 0}
+
+def _voxel_keys(P: np.ndarray, lo: np.ndarray, h: float) -> np.ndarray:
+    q = ((P - lo) * (1.0 / h)).astype(np.int64)      # P ≥ lo，截断即 floor
+    return (q[:, 0] << 42) | (q[:, 1] << 21) | q[:, 2]
+
+def sample_point_indices(P: np.ndarray, budget: int, mode: str = 'random', seed: int = 0,
+                         faces: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    从 (n,3) 点中选出至多 budget 个，返回升序下标。同一 (P, budget, mode, seed) 结果恒定。
+    area 模式需要 faces；缺失时退回 voxel。
+    """
+    n = len(P)
+    budget = int(budget)
+    if n <= budget:
+        return np.arange(n)
+    if mode not in SAMPLER_MODES:
+        raise ValueError(f"unknown sampler mode: {mode!r} (expected one of {SAMPLER_MODES})")
+    rng = np.random.default_rng(seed)
+    if mode == 'area' and faces is not None and len(faces):
+        V = np.asarray(P, dtype=float)
+        tri = V[faces]
+        area = 0.5 * np.linalg.norm(np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0]), axis=1)
+        w = np.bincount(faces.ravel(), weights=np.repeat(area / 3.0, 3), minlength=n)
+        with np.errstate(divide='ignore'):
+            key = np.log(rng.random(n)) / w            # 权重 0 → -inf，永不入选
+        return np.sort(np.argpartition(-key, budget - 1)[:budget])
+    if mode in ('voxel', 'area'):
+        lo = P.min(axis=0)
+        ext = np.maximum(P.max(axis=0) - lo, EPS)
+        h = float(np.cbrt(np.prod(ext) / budget))
+        h = max(h, float(ext.max()) / ((1 << 21) - 1))  # 保证格坐标可打包进 21 bit
+        # 表面点占用体素数 ~ 面积/h²：按 sqrt(占用数/预算) 调整体素边长，最多 3 轮；
+        # 在 ~20×预算 的子样本上估计占用数（几乎每个占用体素都会被命中），避免对全量反复排序
+        probe = P if n <= 20 * budget else P[rng.choice(n, size=20 * budget, replace=False)]
+        for _ in range(3):
+            count = len(np.unique(_voxel_keys(probe, lo, h)))
+            if 0.8 * budget <= count <= budget:
+                break
+            h *= float(np.sqrt(count / budget))
+        order = rng.permutation(n)                      # 体素内代表点：随机顺序下排序后的首个
+        key = _voxel_keys(P, lo, h)[order]
+        srt = np.argsort(key)
+        ks = key[srt]
+        idx = order[srt[np.r_[True, ks[1:] != ks[:-1]]]]
+        if len(idx) > budget:
+            idx = rng.choice(idx, size=budget, replace=False)
+        return np.sort(idx)
+    return np.sort(rng.choice(n, size=budget, replace=False))
 
 def _combine_and_sample_points(upper_stl: Optional[str], lower_stl: Optional[str],
-                               max_points: int = 8000) -> Optional[List[np.ndarray]]:
-    """合并上下 STL 点并下采样为列表（给 build_occlusal_frame 的 geom_points）。"""
-    Pu = _load_stl_points(upper_stl) if upper_stl else None
-    Pl = _load_stl_points(lower_stl) if lower_stl else None
-    if Pu is None and Pl is None:
+                               max_points: int = 8000,
+                               cache: Optional[MeshCache] = None,
+                               dtype=np.float64,
+                               sampler: Optional[Dict] = None) -> Optional[np.ndarray]:
+    """
+    合并上下 STL 点并下采样为 (M,3) 连续数组（给 build_occlusal_frame 的 geom_points）。
+    不先 vstack 全量点：预算按点数比例分给上/下颌，各自采样后再拼接（分层抽样）。
+    sampler：{'mode': 'random'|'voxel'|'area', 'seed': int, 'budget': int}；budget 缺省为 max_points。
+    dtype=np.float32 可将输出减半（PCA 内部仍以 float64 累加）。
+    """
+    spec = {**SAMPLER_DEFAULTS, 'budget': max_points, **(sampler or {})}
+    meshes = []
+    for p in (upper_stl, lower_stl):
+        with trace_stage('stl_read', 'io', file=os.path.basename(p) if p else None) as info:
+            m = _load_stl_mesh(p, cache=cache) if p else None
+            info['vertices'] = 0 if m is None else len(m[0])
+        meshes.append(m)
+    parts = [m for m in meshes if m is not None and len(m[0])]
+    if not parts:
         return None
-    P = Pu if Pl is None else (Pl if Pu is None else np.vstack([Pu, Pl]))
-    if len(P) > max_points:
-        idx = np.random.choice(len(P), size=max_points, replace=False)
-        P = P[idx]
-    return [P[i] for i in range(len(P))]
+    n = sum(len(V) for V, _ in parts)
+    budget = int(spec['budget'])
+    picked = []
+    with trace_stage('sample_points', mode=spec['mode'], budget=budget):
+        for k, (V, F) in enumerate(parts):
+            b = budget if n <= budget else int(round(budget * len(V) / n))
+            idx = sample_point_indices(V, b, mode=spec['mode'], seed=[int(spec['seed']), k], faces=F)
+            picked.append(V[idx])
+    out = np.empty((sum(len(P) for P in picked), 3), dtype=dtype)
+    np.concatenate(picked, axis=0, out=out, casting='same_kind')
+    return out
+
+# ================================
+# Surface index：STL 网格上的均匀栅格哈希（每个网格建一次，供地标贴面检查 / 吸附等批量近邻查询）
+#   顶点按栅格分桶（格键排序的 CSR）；粗一级的格为细格整数坐标右移一位，构成隐式八叉树。
+#   最近顶点：自顶向下逐级展开 (查询, 格) 对——非空格的最远角距离给出最近距离的上界，
+#     下界（到格盒的距离）超过上界的格整枝剪掉；到最细级只剩贴近查询的少数格，再逐点比较。
+#   点到三角形：表面距离 d ≤ 最近顶点距离 Dv，且三角形上任一点距其最近顶点不超过 e/√3（e 为最长边），
+#     故最近三角形必有顶点落在半径 Dv + e/√3 的球内——同样逐级剪枝取出球内顶点，经“顶点→三角形”邻接表给出候选。
+#     最长边超过 SURFACE_BIG_EDGE_FACTOR × 中位边长的少数大三角形（如底座封口）单独建三角形栅格环搜，不拖大 e。
+#   查询按 SURFACE_QUERY_CHUNK 分块，(查询, 格) 对与候选对均随块释放，内存有界。
+# ================================
+SURFACE_CELL_EDGES = 2.0          # 默认格边长 = 中位边长 × 该倍数
+SURFACE_QUERY_CHUNK = 4096        # 每块查询数
+SURFACE_PAIR_BUDGET = 1 << 22     # 大三角形环搜：每块 (查询, 候选) 对数上限
+SURFACE_BIG_EDGE_FACTOR = 8.0     # 最长边超过中位边长该倍数的三角形走大三角形栅格
+_CELL_BIAS = 1 << 20              # 格坐标偏置：±2^20 格打包进 21 bit
+_CELL_MASK = (1 << 21) - 1
+_OCT_CHILDREN = np.array([[a, b, c] for a in (0, 1) for b in (0, 1) for c in (0, 1)], dtype=np.int64)
+
+def _cell_keys(ijk: np.ndarray) -> np.ndarray:
+    q = ijk.astype(np.int64) + _CELL_BIAS
+    return (q[..., 0] << 42) | (q[..., 1] << 21) | q[..., 2]
+
+def _cell_ijk(keys: np.ndarray) -> np.ndarray:
+    return np.stack([(keys >> 42) & _CELL_MASK, (keys >> 21) & _CELL_MASK, keys & _CELL_MASK], axis=-1) - _CELL_BIAS
+
+_SHELL_OFFSETS: Dict[int, np.ndarray] = {}
+
+def _shell_offsets(r: int) -> np.ndarray:
+    """切比雪夫距离恰为 r 的格偏移 (k,3)。"""
+    off = _SHELL_OFFSETS.get(r)
+    if off is None:
+        a = np.arange(-r, r + 1)
+        g = np.stack(np.meshgrid(a, a, a, indexing='ij'), axis=-1).reshape(-1, 3)
+        off = _SHELL_OFFSETS[r] = g[np.abs(g).max(axis=1) == r]
+    return off
+
+def _triangle_params(P: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray):
+    """
+    逐行求点 P 到三角形 ABC 最近点的参数 (s, t)：最近点 = A + s·AB + t·AC
+    （Ericson, Real-Time Collision Detection §5.1.5 的分区判定；BP/CP 的点积由 AB、AC、AP 的点积导出）。
+    """
+    ab, ac, ap = B - A, C - A, P - A
+    d1, d2 = np.einsum('ij,ij->i', ab, ap), np.einsum('ij,ij->i', ac, ap)
+    aa, cc, bc = np.einsum('ij,ij->i', ab, ab), np.einsum('ij,ij->i', ac, ac), np.einsum('ij,ij->i', ab, ac)
+    d3, d4, d5, d6 = d1 - aa, d2 - bc, d1 - bc, d2 - cc
+    vc, vb, va = d1 * d4 - d3 * d2, d5 * d2 - d1 * d6, d3 * d6 - d5 * d4
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_ab = d1 / np.where(d1 - d3 != 0, d1 - d3, 1.0)
+        t_ac = d2 / np.where(d2 - d6 != 0, d2 - d6, 1.0)
+        e_bc = (d4 - d3) + (d5 - d6)
+        t_bc = (d4 - d3) / np.where(e_bc != 0, e_bc, 1.0)
+        den = va + vb + vc
+        den = np.where(den != 0, den, 1.0)
+    conds = [(d1 <= 0) & (d2 <= 0),                      # 顶点 A
+             (d3 >= 0) & (d4 <= d3),                     # 顶点 B
+             (vc <= 0) & (d1 >= 0) & (d3 <= 0),          # 边 AB
+             (d6 >= 0) & (d5 <= d6),                     # 顶点 C
+             (vb <= 0) & (d2 >= 0) & (d6 <= 0),          # 边 AC
+             (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)]   # 边 BC
+    s = np.select(conds, [0.0, 1.0, t_ab, 0.0, 0.0, 1.0 - t_bc], default=vb / den)
+    t = np.select(conds, [0.0, 0.0, 0.0, 1.0, t_ac, t_bc], default=vc / den)
+    return s, t, ab, ac, ap
+
+def closest_point_on_triangles(P: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray) -> np.ndarray:
+    """逐行求点 P 到三角形 ABC 的最近点，均为 (n,3)。"""
+    s, t, ab, ac, _ = _triangle_params(P, A, B, C)
+    return A + ab * s[:, None] + ac * t[:, None]
+
+class _GridBuckets:
+    """格键 → 条目下标的 CSR 表（keys 升序唯一，items[start[i]:start[i+1]] 属于 keys[i]）。"""
+    __slots__ = ('keys', 'start', 'items')
+
+    def __init__(self, cell_keys: np.ndarray, items: np.ndarray):
+        order = np.argsort(cell_keys, kind='stable')
+        ks = cell_keys[order]
+        self.items = items[order]
+        first = np.r_[True, ks[1:] != ks[:-1]] if len(ks) else np.zeros(0, dtype=bool)
+        self.keys = ks[first]
+        self.start = np.r_[np.flatnonzero(first), len(ks)]
+
+    def mean_bucket(self) -> float:
+        return len(self.items) / max(len(self.keys), 1)
+
+    def gather(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """keys（任意形状，按行展平）→ (键序号, 条目)，保持键的顺序；空格不产生条目。"""
+        keys = keys.ravel()
+        if not len(self.keys):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=self.items.dtype)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit = np.flatnonzero(self.keys[pos] == keys)
+        which, item = _csr_expand(self.start, self.items, pos[hit])
+        return hit[which], item
+
+def _csr_expand(start: np.ndarray, items: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR 表按行号 rows 展开：(rows 中的序号, 条目)，保持 rows 的顺序。"""
+    st = start[rows]
+    cnt = start[rows + 1] - st
+    which = np.repeat(np.arange(len(rows)), cnt)
+    return which, items[st[which] + np.arange(len(which)) - np.repeat(np.cumsum(cnt) - cnt, cnt)]
+
+def _segment_min(q: np.ndarray, d2: np.ndarray, item: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """q 按查询分组连续（同一查询的候选相邻）：每组的 (查询, 最小 d2, 对应条目)。"""
+    if not len(q):
+        return q, d2, item
+    starts = np.flatnonzero(np.r_[True, q[1:] != q[:-1]])
+    mins = np.minimum.reduceat(d2, starts)
+    seg = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(q)]))
+    hit = np.flatnonzero(d2 == mins[seg])
+    first = hit[np.r_[True, seg[hit][1:] != seg[hit][:-1]]]
+    return q[starts], mins, item[first]
+
+class SurfaceIndex:
+    """
+    V (n,3) 顶点、F (m,3) 三角形（可为 None，此时只能查最近顶点）；cell_mm 缺省为中位边长 × SURFACE_CELL_EDGES。
+    nearest_vertex(Q) → (距离, 顶点下标)；closest_points(Q) → (距离, 三角形下标, 最近点)。
+    给出 max_dist 时只求该半径内的结果，之外的查询返回 inf / -1（最近点为 NaN）。
+    """
+    def __init__(self, V: np.ndarray, F: Optional[np.ndarray] = None, cell_mm: Optional[float] = None):
+        self.V = np.ascontiguousarray(V, dtype=float).reshape(-1, 3)
+        self.F = None if F is None or not len(F) else np.ascontiguousarray(F, dtype=np.int64)
+        if not len(self.V):
+            raise ValueError("SurfaceIndex needs at least one vertex")
+        self.lo = self.V.min(axis=0)
+        self.extent = self.V.max(axis=0) - self.lo
+        edges = None
+        if self.F is not None:
+            e = self.V[self.F[:, [1, 2, 0]]] - self.V[self.F]
+            edges = np.sqrt(np.einsum('ijk,ijk->ij', e, e)).max(axis=1)
+        if cell_mm is None:
+            edge = float(np.median(edges)) if edges is not None else \
+                float(np.cbrt(np.prod(np.maximum(self.extent, EPS)) / len(self.V)))
+            cell_mm = edge * SURFACE_CELL_EDGES
+        self.h = max(float(cell_mm), float(self.extent.max()) / (_CELL_BIAS - 2), EPS)
+        ijk = np.floor((self.V - self.lo) * (1.0 / self.h)).astype(np.int64)
+        self.vertices = _GridBuckets(_cell_keys(ijk), np.arange(len(self.V)))
+        # 八叉树各级的非空格（键升序唯一）：第 l 级格 = 细格坐标 >> l，直到只剩一格；
+        # 每级另存格坐标与“父格 → 子格”的 CSR，下降时逐级按下标展开，不再编码 / 查找键
+        self.levels: List[np.ndarray] = [self.vertices.keys]
+        self._level_ijk: List[np.ndarray] = [_cell_ijk(self.vertices.keys)]
+        self._children: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [None]
+        while len(self.levels[-1]) > 1:
+            keys, parent = np.unique(_cell_keys(self._level_ijk[-1] >> 1), return_inverse=True)
+            self.levels.append(keys)
+            self._level_ijk.append(_cell_ijk(keys))
+            self._children.append((np.r_[0, np.cumsum(np.bincount(parent, minlength=len(keys)))],
+                                   np.argsort(parent, kind='stable')))
+        self.max_edge = 0.0
+        self.big_triangles: Optional[Tuple[float, _GridBuckets]] = None
+        self._vertex_areas: Optional[np.ndarray] = None
+        if self.F is not None:
+            big = edges > SURFACE_BIG_EDGE_FACTOR * max(float(np.median(edges)), EPS)
+            small = np.flatnonzero(~big)
+            self.max_edge = float(edges[small].max()) if len(small) else 0.0
+            # 顶点 → 相邻（小）三角形的 CSR
+            order = np.argsort(self.F[small].ravel(), kind='stable')
+            self._vt_items = small[order // 3]
+            self._vt_start = np.r_[0, np.cumsum(np.bincount(self.F[small].ravel(), minlength=len(self.V)))]
+            if big.any():
+                bh = max(float(np.median(edges[big])) * SURFACE_CELL_EDGES, self.h)
+                self.big_triangles = (bh, self._triangle_buckets(np.flatnonzero(big), bh))
+
+    @classmethod
+    def from_stl(cls, path: str, weld_tol_mm: float = WELD_TOL_MM, cache: Optional['MeshCache'] = None,
+                 cell_mm: Optional[float] = None) -> Optional['SurfaceIndex']:
+        mesh = _load_stl_mesh(path, weld_tol_mm, cache)
+        return None if mesh is None or not len(mesh[0]) else cls(mesh[0], mesh[1], cell_mm)
+
+    def vertex_areas(self) -> np.ndarray:
+        """每个顶点分得的表面积（相邻三角形面积各取 1/3，mm²）；首次调用时计算。"""
+        if self._vertex_areas is None:
+            if self.F is None:
+                raise ValueError("vertex_areas needs triangles (SurfaceIndex built without F)")
+            V, F = self.V, self.F
+            area = 0.5 * np.linalg.norm(np.cross(V[F[:, 1]] - V[F[:, 0]], V[F[:, 2]] - V[F[:, 0]]), axis=1)
+            self._vertex_areas = np.bincount(F.ravel(), weights=np.repeat(area / 3.0, 3), minlength=len(V))
+        return self._vertex_areas
+
+    def _cell(self, P: np.ndarray, h: float) -> np.ndarray:
+        return np.floor((P - self.lo) * (1.0 / h)).astype(np.int64)
+
+    def _triangle_buckets(self, tris: np.ndarray, h: float) -> _GridBuckets:
+        """三角形登记到其包围盒覆盖的全部格子。"""
+        V, F = self.V, self.F[tris]
+        c0 = self._cell(np.minimum(np.minimum(V[F[:, 0]], V[F[:, 1]]), V[F[:, 2]]), h)
+        span = self._cell(np.maximum(np.maximum(V[F[:, 0]], V[F[:, 1]]), V[F[:, 2]]), h) - c0 + 1
+        n_cells = span.prod(axis=1)
+        k = np.repeat(np.arange(len(F)), n_cells)
+        # 逐三角形展开其包围盒内的格：局部序号 → (di, dj, dk)
+        local = np.arange(len(k)) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        sp = span[k]
+        d = np.stack([local // (sp[:, 1] * sp[:, 2]), (local // sp[:, 2]) % sp[:, 1], local % sp[:, 2]], axis=1)
+        return _GridBuckets(_cell_keys(c0[k] + d), tris[k])
+
+    def _descend(self, Q: np.ndarray, radius: np.ndarray, shrink: bool,
+                 slack: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        自顶向下展开 (查询, 格) 对，返回最细级中到格盒距离 ≤ 半径的 (查询下标, 格序号)，按查询分组连续；
+        格序号即 self.vertices 的桶号。
+        shrink=True：半径随“非空格最远角距离 + slack”的上界收紧（slack=0 为最近顶点查询）；否则为固定半径（球查询）。
+        """
+        live = np.flatnonzero(radius >= 0)
+        bound2 = np.where(radius >= 0, radius, 0.0) ** 2
+        pad = 1e-9 * self.h                              # 顶点落格的舍入余量
+        start = len(self.levels) - 1
+        r_max = float(radius[live].max()) if len(live) else np.inf
+        if np.isfinite(r_max):
+            # 半径有限：从格边 ≥ 2·半径的一级起步，每个查询的包围盒至多跨 2×2×2 格，省去上面各级
+            start = min(start, max(0, int(np.ceil(np.log2(max(2.0 * (r_max + pad) * (1 + 1e-9), EPS) / self.h)))))
+        if start == len(self.levels) - 1:
+            n_top = len(self.levels[start])
+            q = np.repeat(live, n_top)
+            node = np.tile(np.arange(n_top), len(live))
+        else:
+            h = self.h * (1 << start)
+            P = Q[live]
+            r = radius[live, None] + pad
+            c_lo = np.floor((P - r - self.lo) / h).astype(np.int64)
+            c_hi = np.floor((P + r - self.lo) / h).astype(np.int64)
+            cells = c_lo[:, None, :] + _OCT_CHILDREN[None]
+            ok = (cells <= c_hi[:, None, :]).all(axis=2)
+            child = _cell_keys(cells)[ok]
+            lv = self.levels[start]
+            pos = np.minimum(np.searchsorted(lv, child), len(lv) - 1)
+            exists = lv[pos] == child
+            q, node = np.repeat(live, 8)[ok.ravel()][exists], pos[exists]
+        for lvl in range(start, -1, -1):
+            h = self.h * (1 << lvl)
+            blo = self.lo + self._level_ijk[lvl][node] * h - pad
+            P = Q[q]
+            gap = np.maximum(np.maximum(blo - P, P - (blo + h + 2 * pad)), 0.0)
+            dmin2 = np.einsum('ij,ij->i', gap, gap)
+            if shrink and len(q):
+                far = np.maximum(np.abs(P - blo), np.abs(P - (blo + h + 2 * pad)))
+                uq, m, _ = _segment_min(q, np.einsum('ij,ij->i', far, far), node)
+                bound2[uq] = np.minimum(bound2[uq], (np.sqrt(m) + slack) ** 2 if slack else m)
+            keep = dmin2 <= bound2[q]
+            q, node = q[keep], node[keep]
+            if lvl == 0:
+                break
+            which, node = _csr_expand(*self._children[lvl], node)
+            q = q[which]
+        return q, node
+
+    def nearest_vertex(self, Q, max_dist: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        Q = np.asarray(Q, dtype=float).reshape(-1, 3)
+        dist = np.full(len(Q), np.inf)
+        arg = np.full(len(Q), -1, dtype=np.int64)
+        cap = np.inf if max_dist is None else float(max_dist)
+        for s in range(0, len(Q), SURFACE_QUERY_CHUNK):
+            Qc = Q[s:s + SURFACE_QUERY_CHUNK]
+            q, node = self._descend(Qc, np.full(len(Qc), cap), shrink=True)
+            which, v = _csr_expand(self.vertices.start, self.vertices.items, node)
+            q = q[which]
+            X = Qc[q] - self.V[v]
+            uq, d2, it = _segment_min(q, np.einsum('ij,ij->i', X, X), v)
+            dist[s + uq], arg[s + uq] = np.sqrt(d2), it
+        far = dist > cap
+        dist[far], arg[far] = np.inf, -1
+        return dist, arg
+
+    def _tri_d2(self, P: np.ndarray, t: np.ndarray) -> np.ndarray:
+        V, F = self.V, self.F
+        s, u, ab, ac, ap = _triangle_params(P, V[F[t, 0]], V[F[t, 1]], V[F[t, 2]])
+        X = ap - ab * s[:, None] - ac * u[:, None]
+        return np.nan_to_num(np.einsum('ij,ij->i', X, X), nan=np.inf)   # 退化三角形记为无穷远
+
+    def _big_triangle_search(self, Q: np.ndarray, limit: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """大三角形栅格上按切比雪夫环由近及远搜：搜完 r 环后未搜到的距离 ≥ r·h；limit < 0 的查询不搜。"""
+        h, buckets = self.big_triangles
+        best = np.full(len(Q), np.inf)
+        arg = np.full(len(Q), -1, dtype=np.int64)
+        cur = np.flatnonzero(limit >= 0)
+        if len(cur):
+            cell_hi = self._cell(self.lo + self.extent, h)
+            # 网格外的查询格钳到网格外一圈：沿被钳方向未搜的点仍至少相距 r·h，终止判据不变
+            qc = np.clip(self._cell(Q, h), -1, cell_hi + 1)
+            r_stop = np.minimum(np.maximum(qc, cell_hi - qc).max(axis=1), np.ceil(np.minimum(limit, 4.0 * _CELL_BIAS * h) / h))
+        r = 0
+        while len(cur):
+            off = _shell_offsets(r)
+            step = max(1, int(SURFACE_PAIR_BUDGET // (len(off) * max(buckets.mean_bucket(), 1.0))))
+            for s in range(0, len(cur), step):
+                c = cur[s:s + step]
+                key_i, t = buckets.gather(_cell_keys(qc[c, None, :] + off[None]))
+                q = c[key_i // len(off)]
+                uq, d2, it = _segment_min(q, self._tri_d2(Q[q], t), t)
+                better = d2 < best[uq]
+                best[uq[better]], arg[uq[better]] = d2[better], it[better]
+            cur = cur[(best[cur] > (r * h) ** 2) & (r < r_stop[cur])]
+            r += 1
+        return np.sqrt(best), arg
+
+    def closest_points(self, Q, max_dist: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.F is None:
+            raise ValueError("closest_points needs triangles (SurfaceIndex built without F)")
+        Q = np.asarray(Q, dtype=float).reshape(-1, 3)
+        n = len(Q)
+        cap = np.inf if max_dist is None else float(max_dist)
+        reach = self.max_edge / np.sqrt(3.0)     # 三角形上任一点到其最近顶点 ≤ 最长边 / √3
+        dv = np.full(n, np.inf)
+        dist = np.full(n, np.inf)
+        arg = np.full(n, -1, dtype=np.int64)
+        for s in range(0, n, SURFACE_QUERY_CHUNK):
+            Qc = Q[s:s + SURFACE_QUERY_CHUNK]
+            # 一次收紧式下降：任一非空格的最远角距离 D 给出 d ≤ D，最近三角形的顶点必在 D + e/√3 内，
+            # 保留下来的格既含最近顶点（Dv ≤ D），也覆盖半径 min(Dv, cap) + e/√3 的球
+            q, node = self._descend(Qc, np.full(len(Qc), cap + reach), shrink=True, slack=reach)
+            which, v = _csr_expand(self.vertices.start, self.vertices.items, node)
+            q = q[which]
+            X = Qc[q] - self.V[v]
+            d2v = np.einsum('ij,ij->i', X, X)
+            uq, m, _ = _segment_min(q, d2v, v)
+            dv[s + uq] = np.sqrt(m)
+            # 小三角形：半径 R = min(Dv, cap) + e/√3 球内的顶点 → 相邻三角形
+            Rc = np.minimum(dv[s:s + len(Qc)], cap) + reach
+            inside = d2v <= Rc[q] ** 2
+            q, v = q[inside], v[inside]
+            which, t = _csr_expand(self._vt_start, self._vt_items, v)
+            # 同一三角形经其三个顶点会重复出现：按 (查询, 三角形) 排序去重，结果按查询分组
+            pair = np.sort(q[which] * len(self.F) + t)
+            pair = pair[np.r_[True, pair[1:] != pair[:-1]]] if len(pair) else pair
+            q, t = pair // len(self.F), pair % len(self.F)
+            uq, d2, it = _segment_min(q, self._tri_d2(Qc[q], t), t)
+            dist[s + uq], arg[s + uq] = np.sqrt(d2), it
+        if self.big_triangles is not None:
+            # 大三角形：环搜半径取当前最好结果（表面距离不会更远）；其内部可离全部顶点都很远，不以 Dv 为门槛
+            db, tb = self._big_triangle_search(Q, np.minimum(np.minimum(dist, dv), cap))
+            better = db < dist
+            dist[better], arg[better] = db[better], tb[better]
+        far = dist > cap
+        dist[far], arg[far] = np.inf, -1
+        pts = np.full(Q.shape, np.nan)
+        ok = arg >= 0
+        if ok.any():
+            t = arg[ok]
+            pts[ok] = closest_point_on_triangles(Q[ok], self.V[self.F[t, 0]], self.V[self.F[t, 1]], self.V[self.F[t, 2]])
+        return dist, arg, pts
+
+_SURFACE_INDEXES: 'OrderedDict[Tuple, SurfaceIndex]' = OrderedDict()
+SURFACE_INDEX_SLOTS = 4   # 进程内保留的索引数（上下颌各一，另留两份给交互会话切换病例）
+_SURFACE_LOCK = threading.Lock()                  # 保护 _SURFACE_INDEXES / _SURFACE_BUILDING
+_SURFACE_BUILDING: Dict[Tuple, threading.Lock] = {}   # 正在建立的索引：同一 STL 只建一次，其余线程等待
+
+def surface_index(path: str, cache: Optional['MeshCache'] = None, weld_tol_mm: float = WELD_TOL_MM) -> Optional[SurfaceIndex]:
+    """按 (路径, mtime, 大小, 焊接容差) 复用已建的 SurfaceIndex；STL 不可读时返回 None。线程安全。"""
+    if not path or not os.path.isfile(path):
+        return None
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, float(weld_tol_mm))
+    with _SURFACE_LOCK:
+        hit = _SURFACE_INDEXES.get(key)
+        if hit is not None:
+            _SURFACE_INDEXES.move_to_end(key)
+            return hit
+        building = _SURFACE_BUILDING.setdefault(key, threading.Lock())
+    with building:
+        with _SURFACE_LOCK:
+            hit = _SURFACE_INDEXES.get(key)
+        if hit is not None:
+            return hit
+        idx = SurfaceIndex.from_stl(path, weld_tol_mm, cache)
+        with _SURFACE_LOCK:
+            if idx is not None:
+                _SURFACE_INDEXES[key] = idx
+                while len(_SURFACE_INDEXES) > SURFACE_INDEX_SLOTS:
+                    _SURFACE_INDEXES.popitem(last=False)
+            _SURFACE_BUILDING.pop(key, None)
+    return idx
+
+ARCH_PREFIXES = {'upper': ('1', '2'), 'lower': ('3', '4')}   # FDI 象限：1/2 上颌，3/4 下颌
+
+def arch_landmarks(landmarks, arch: str) -> LandmarkSet:
+    """合并地标表中属于 arch（'upper' / 'lower'）的部分（按 FDI 象限前缀；其余行置为无效）。"""
+    lm = as_landmark_set(landmarks)
+    mask = np.fromiter((n.startswith(ARCH_PREFIXES[arch]) for n in lm.names), bool, len(lm.names))
+    return LandmarkSet(lm.names, lm.index, lm.xyz, lm.valid & mask)
+
+class CaseMeshes:
+    """
+    一个病例的上下颌网格（needs 含 'mesh' 的指标的输入，见 run_metrics）：构造时只记路径，
+    index(arch) 按需经 surface_index 建立 / 复用 SurfaceIndex（多个指标并行取同一颌时只建一次）。
+    """
+    __slots__ = ('paths', 'cache')
+
+    def __init__(self, upper_path: Optional[str], lower_path: Optional[str], cache: Optional['MeshCache'] = None):
+        self.paths = {'upper': upper_path, 'lower': lower_path}
+        self.cache = cache
+
+    def available(self) -> bool:
+        return all(p and os.path.isfile(p) for p in self.paths.values())
+
+    def index(self, arch: str) -> Optional[SurfaceIndex]:
+        return surface_index(self.paths[arch], self.cache)
+
+    def digests(self) -> List[str]:
+        return [file_digest(self.paths[a]) for a in ('upper', 'lower')]
+
+# —— 地标贴面检查 / 吸附 ——
+SURFACE_DEFAULTS = {'mode': 'flag', 'tol_mm': 0.5, 'max_snap_mm': 3.0}
+
+def surface_cfg(value) -> Optional[Dict]:
+    """cfg['surface']：True / 'flag' / 'snap' / {'mode', 'tol_mm', 'max_snap_mm'} → 完整参数；假值为 None。"""
+    if not value:
+        return None
+    if value is True:
+        out = dict(SURFACE_DEFAULTS)
+    elif isinstance(value, str):
+        out = {**SURFACE_DEFAULTS, 'mode': value}
+    elif isinstance(value, dict):
+        unknown = set(value) - set(SURFACE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown surface options: {sorted(unknown)}")
+        out = {**SURFACE_DEFAULTS, **value}
+        out['tol_mm'], out['max_snap_mm'] = float(out['tol_mm']), float(out['max_snap_mm'])
+    else:
+        raise ValueError(f"cfg['surface'] must be True, 'flag', 'snap' or a dict, got {value!r}")
+    if out['mode'] not in ('flag', 'snap'):
+        raise ValueError(f"surface mode must be 'flag' or 'snap', got {out['mode']!r}")
+    return out
+
+def check_landmarks_on_surface(landmarks, index: SurfaceIndex, mode: str = 'flag', tol_mm: float = 0.5,
+                               max_snap_mm: float = 3.0) -> Tuple[LandmarkSet, Dict]:
+    """
+    全部有效地标一次查到网格表面的最近点（搜索半径限制在 max(tol_mm, max_snap_mm) 内）。
+    距离 ∈ (tol_mm, max_snap_mm] 的记入 'off_surface'（mode='snap' 时移到最近点并记入 'snapped'）；
+    超出搜索半径的只记入 'far'（多为标错牙或标错颌，吸附无意义）。
+    返回 (地标（snap 时为新表，原表不动）, 报告)。
+    """
+    lm = as_landmark_set(landmarks)
+    rows = np.flatnonzero(lm.valid)
+    dist, _, pts = index.closest_points(lm.xyz[rows], max_dist=max(float(tol_mm), float(max_snap_mm)))
+    near = np.isfinite(dist)
+    off = near & (dist > tol_mm)
+    report = {'checked': int(len(rows)), 'tol_mm': float(tol_mm),
+              'max_dist_mm': round(float(dist[near].max()), 3) if near.any() else None,
+              'off_surface': {lm.names[i]: round(float(d), 3) for i, d in zip(rows[off], dist[off])},
+              'far': [lm.names[i] for i in rows[~near]]}
+    if mode != 'snap':
+        return lm, report
+    out = LandmarkSet(lm.names, lm.index, lm.xyz.copy(), lm.valid.copy())
+    out.xyz[rows[off]] = pts[off]
+    report['snapped'] = [lm.names[i] for i in rows[off]]
+    return out, report
+
+def compute_surface_check(landmarks, frame: Dict, local: Optional[LandmarkSet] = None,
+                          mesh: Optional[CaseMeshes] = None, tol_mm: float = 0.5,
+                          max_snap_mm: float = 3.0) -> Optional[Dict]:
+    """
+    注册表中的 'surface'：上下颌地标（按 arch_landmarks 划分）各查到本颌网格表面，
+    返回 {'upper': 报告, 'lower': 报告}（该颌 STL 不可读时为 None），报告见 check_landmarks_on_surface（mode='flag'）。
+    吸附（mode='snap'）改动地标、须在建坐标系之前，不经注册表（见 generate_metrics）。
+    """
+    if mesh is None:
+        return None
+    out = {}
+    for arch in ('upper', 'lower'):
+        index = mesh.index(arch)
+        out[arch] = None if index is None else check_landmarks_on_surface(
+            arch_landmarks(landmarks, arch), index, 'flag', tol_mm, max_snap_mm)[1]
+    return out
+
+# ================================
+# Occlusal contacts：上下颌网格间的逐顶点距离图与咬合接触
+#   上颌每个顶点到下颌表面的带符号距离（及反向），经 SurfaceIndex.closest_points 分块查询：
+#   搜索半径限制在 max_dist_mm 内，远离对颌的牙龈 / 底座在八叉树粗级即被剪掉；
+#   查询按 CONTACT_CHUNK 个顶点一块提交到线程池（索引只读共享，numpy 大数组运算释放 GIL），临时内存随块释放。
+#   距离 ≤ contact_mm 的顶点为接触；沿网格边连通的接触顶点构成接触斑，按最近地标归到牙位，
+#   面积取顶点分得的表面积，质心在咬合坐标系下给出。
+# ================================
+CONTACT_DEFAULTS = {'contact_mm': 0.1, 'max_dist_mm': 2.0, 'workers': None}
+CONTACT_CHUNK = 1 << 16           # 每个线程任务的查询顶点数
+CONTACT_TOOTH_RADIUS_MM = 8.0     # 接触顶点距最近地标超过该值时不归牙位
+CONTACT_MAX_PATCHES = 50          # 报告中列出的接触斑数（按面积降序）
+CONTACT_MIN_AREA_MM2 = 0.5        # 一组牙的接触面积低于该值视为无接触
+CONTACT_LOCK_U = 1.0              # 后牙接触质心越过颊尖 / 舌尖（|u| > 该值，见 contact_checks）记为锁牙合样接触
+_CONTACT_ANTERIOR = ('11', '12', '13', '21', '22', '23')
+_CONTACT_POSTERIOR = {'right': ('14', '15', '16', '17'), 'left': ('24', '25', '26', '27')}
+_CONTACT_BUCCAL = ('mb', 'db', 'b', 'bg')
+_CONTACT_LINGUAL = ('ml', 'dl', 'l', 'lgb')
+
+def contacts_cfg(value) -> Optional[Dict]:
+    """cfg['contacts']：True / 接触阈值（mm）/ {'contact_mm', 'max_dist_mm', 'workers'} → 完整参数；假值为 None。"""
+    if value is None or value is False:
+        return None
+    if value is True:
+        out = dict(CONTACT_DEFAULTS)
+    elif isinstance(value, (int, float)):
+        out = {**CONTACT_DEFAULTS, 'contact_mm': float(value)}
+    elif isinstance(value, dict):
+        unknown = set(value) - set(CONTACT_DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown contacts options: {sorted(unknown)}")
+        out = {**CONTACT_DEFAULTS, **value}
+    else:
+        raise ValueError(f"cfg['contacts'] must be True, a contact threshold (mm) or a dict, got {value!r}")
+    out['contact_mm'], out['max_dist_mm'] = float(out['contact_mm']), float(out['max_dist_mm'])
+    if not 0.0 <= out['contact_mm'] <= out['max_dist_mm']:
+        raise ValueError(f"contacts needs 0 <= contact_mm <= max_dist_mm, got {out['contact_mm']} / {out['max_dist_mm']}")
+    return out
+
+def surface_distance_map(Q, index: SurfaceIndex, max_dist_mm: Optional[float] = None,
+                         workers: Optional[int] = None) -> np.ndarray:
+    """
+    Q (n,3) 各点到 index 表面的带符号距离：符号取最近三角形的法向（STL 外法向，负值为穿入对颌），
+    最近点落在棱 / 顶点上时以所取三角形为准；超出 max_dist_mm 的为 inf。
+    按 CONTACT_CHUNK 分块，workers（缺省 CPU 核数）> 1 时多线程并行。
+    """
+    Q = np.asarray(Q, dtype=float).reshape(-1, 3)
+    out = np.full(len(Q), np.inf)
+    V, F = index.V, index.F
+
+    def _chunk(s: int) -> None:
+        Qc = Q[s:s + CONTACT_CHUNK]
+        d, t, pts = index.closest_points(Qc, max_dist_mm)
+        ok = np.flatnonzero(t >= 0)
+        f = F[t[ok]]
+        n = np.cross(V[f[:, 1]] - V[f[:, 0]], V[f[:, 2]] - V[f[:, 0]])
+        inside = np.einsum('ij,ij->i', Qc[ok] - pts[ok], n) < 0
+        out[s + ok] = np.where(inside, -d[ok], d[ok])
+
+    starts = range(0, len(Q), CONTACT_CHUNK)
+    workers = (os.cpu_count() or 1) if workers is None else int(workers)
+    if workers <= 1 or len(starts) <= 1:
+        for s in starts:
+            _chunk(s)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+            list(pool.map(_chunk, starts))
+    return out
+
+def _nearest_tooth(P: np.ndarray, landmarks: Optional[LandmarkSet]) -> Tuple[List[str], np.ndarray]:
+    """P 各点按最近地标归牙位（名称前两位 FDI 码）：返回 (牙位表, 下标)；无地标或距离超过 CONTACT_TOOTH_RADIUS_MM 为 -1。"""
+    idx = np.full(len(P), -1, dtype=np.int64)
+    if landmarks is None:
+        return [], idx
+    rows = [i for i in np.flatnonzero(landmarks.valid) if landmarks.names[i][:2].isdigit()]
+    teeth = sorted({landmarks.names[i][:2] for i in rows})
+    if not rows or not len(P):
+        return teeth, idx
+    L = landmarks.xyz[rows]
+    code = np.searchsorted(teeth, [landmarks.names[i][:2] for i in rows])
+    step = max(1, SURFACE_PAIR_BUDGET // len(L))
+    for s in range(0, len(P), step):
+        X = P[s:s + step, None, :] - L[None]
+        d2 = np.einsum('ijk,ijk->ij', X, X)
+        j = d2.argmin(axis=1)
+        idx[s:s + step] = np.where(d2[np.arange(len(j)), j] <= CONTACT_TOOTH_RADIUS_MM ** 2, code[j], -1)
+    return teeth, idx
+
+def _edge_components(n: int, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """n 个结点、边 (u, v) 的连通分量编号（0..k-1）：向量化并查集——各边两端的根挂到较小者，再指针跳跃压缩。"""
+    label = np.arange(n)
+    while True:
+        lu, lv = label[u], label[v]
+        diff = lu != lv
+        if not diff.any():
+            break
+        np.minimum.at(label, np.maximum(lu[diff], lv[diff]), np.minimum(lu[diff], lv[diff]))
+        while True:
+            nxt = label[label]
+            if np.array_equal(nxt, label):
+                break
+            label = nxt
+    return np.unique(label, return_inverse=True)[1]
+
+def _arch_contacts(index: SurfaceIndex, dist: np.ndarray, frame: Dict, landmarks: Optional[LandmarkSet],
+                   contact_mm: float) -> Dict:
+    """单颌的接触汇总：接触 / 穿入面积、按牙位的面积与质心、接触斑（质心为咬合坐标系，mm）。"""
+    area = index.vertex_areas()
+    hit = np.isfinite(dist)
+    c = np.flatnonzero(dist <= contact_mm)
+    rep = {'vertices': int(len(dist)), 'contact_vertices': int(len(c)),
+           'contact_area_mm2': round(float(area[c].sum()), 2),
+           'penetration_area_mm2': round(float(area[dist < 0].sum()), 2),
+           'min_dist_mm': round(float(dist[hit].min()), 3) if hit.any() else None,
+           'teeth': {}, 'unassigned_area_mm2': 0.0, 'n_patches': 0, 'patches': []}
+    if not len(c):
+        return rep
+    R = np.stack([np.asarray(frame[k], float) for k in ('ex', 'ey', 'ez')], axis=0)
+    local = (index.V[c] - np.asarray(frame['origin'], float)) @ R.T
+    w, dc = area[c], dist[c]
+
+    def _groups(g: np.ndarray, k: int):
+        """按组号 g（0..k-1）汇总：面积、面积加权质心、最小距离。"""
+        a = np.bincount(g, weights=w, minlength=k)
+        cen = np.stack([np.bincount(g, weights=w * local[:, j], minlength=k) for j in range(3)], axis=1)
+        cen /= np.maximum(a, EPS)[:, None]
+        dmin = np.full(k, np.inf)
+        np.minimum.at(dmin, g, dc)
+        return a, cen, dmin
+
+    teeth, tooth = _nearest_tooth(index.V[c], landmarks)
+    a, cen, dmin = _groups(tooth + 1, len(teeth) + 1)     # 组 0 = 未归牙位
+    rep['unassigned_area_mm2'] = round(float(a[0]), 2)
+    rep['teeth'] = {t: {'area_mm2': round(float(a[i + 1]), 2), 'centroid': np.round(cen[i + 1], 2).tolist(),
+                        'min_dist_mm': round(float(dmin[i + 1]), 3)}
+                    for i, t in enumerate(teeth) if a[i + 1] > 0}
+
+    # 接触斑：两端都是接触顶点的网格边连通
+    pos = np.full(len(index.V), -1, dtype=np.int64)
+    pos[c] = np.arange(len(c))
+    PF = pos[index.F]
+    u, v = [], []
+    for i, j in ((0, 1), (1, 2), (2, 0)):
+        sel = (PF[:, i] >= 0) & (PF[:, j] >= 0)
+        u.append(PF[sel, i])
+        v.append(PF[sel, j])
+    comp = _edge_components(len(c), np.concatenate(u), np.concatenate(v))
+    k = int(comp.max()) + 1
+    pa, pcen, pmin = _groups(comp, k)
+    count = np.bincount(comp, minlength=k)
+    major = np.bincount(comp * (len(teeth) + 1) + tooth + 1, weights=w,
+                        minlength=k * (len(teeth) + 1)).reshape(k, -1).argmax(axis=1) - 1
+    order = np.argsort(-pa, kind='stable')[:CONTACT_MAX_PATCHES]
+    rep['n_patches'] = k
+    rep['patches'] = [{'area_mm2': round(float(pa[p]), 3), 'vertices': int(count[p]),
+                       'centroid': np.round(pcen[p], 2).tolist(), 'min_dist_mm': round(float(pmin[p]), 3),
+                       'tooth': teeth[major[p]] if major[p] >= 0 else None} for p in order]
+    return rep
+
+def occlusal_contacts(upper: SurfaceIndex, lower: SurfaceIndex, frame: Dict, lm_upper=None, lm_lower=None,
+                      contact_mm: float = 0.1, max_dist_mm: float = 2.0, workers: Optional[int] = None) -> Dict:
+    """
+    上下颌网格的咬合接触：上颌每个顶点到下颌表面的带符号距离（及反向，见 surface_distance_map），
+    距离 ≤ contact_mm（含穿入）的为接触。lm_upper / lm_lower 用于把接触归到牙位（可省）。
+    返回 {'contact_mm', 'max_dist_mm', 'upper': {...}, 'lower': {...}}，各颌见 _arch_contacts。
+    """
+    out = {'contact_mm': float(contact_mm), 'max_dist_mm': float(max_dist_mm)}
+    for arch, index, other, lm in (('upper', upper, lower, lm_upper), ('lower', lower, upper, lm_lower)):
+        with trace_stage(f'distance_map_{arch}', vertices=len(index.V)):
+            dist = surface_distance_map(index.V, other, max_dist_mm, workers)
+        out[arch] = _arch_contacts(index, dist, frame, None if lm is None else as_landmark_set(lm), contact_mm)
+    return out
+
+def contact_checks(contacts: Dict, landmarks, frame: Dict, crossbite: Optional[Dict] = None,
+                   overbite: Optional[Dict] = None, local: Optional[LandmarkSet] = None) -> Dict:
+    """
+    用实际接触复核地标判定（以上颌各牙的接触为准），consistent 为 True / False / None（无从判断）：
+      overbite：开𬌗时前牙（13–23）应无接触；其余类别有前牙接触即为一致。
+      crossbite：逐侧取后牙（14–17 / 24–27）接触质心的颊舌位置 u = ±(y − 中线) / 半颊舌宽（颊向为正；
+        中线与半宽由该侧上颌颊尖、舌尖地标的平均 Y 给出）。u > CONTACT_LOCK_U（接触越过颊尖，上牙颊面抵下牙舌面）
+        记为反锁样，u < −CONTACT_LOCK_U（越过舌尖）记为正锁样，其余为“无”；该侧无接触时锁牙合视为一致。
+    """
+    loc = _local_table(landmarks, frame, local)
+    if crossbite is None:
+        crossbite = compute_crossbite(landmarks, frame, local=loc)
+    if overbite is None:
+        overbite = compute_overbite(landmarks, frame, local=loc)
+    teeth = (contacts.get('upper') or {}).get('teeth') or {}
+
+    def _area(codes) -> float:
+        return float(sum(teeth[t]['area_mm2'] for t in codes if t in teeth))
+
+    ant = _area(_CONTACT_ANTERIOR)
+    cat = overbite.get('category')
+    if cat in (None, '缺失'):
+        ok = None
+    elif cat == '开𬌗':
+        ok = ant < CONTACT_MIN_AREA_MM2
+    else:
+        ok = True if ant >= CONTACT_MIN_AREA_MM2 else None
+    out = {'overbite': {'landmark': cat, 'anterior_contact_mm2': round(ant, 2), 'consistent': ok}, 'crossbite': {}}
+
+    for side, codes in _CONTACT_POSTERIOR.items():
+        status = (crossbite.get(side) or {}).get('status')
+        area = _area(codes)
+        rec = {'landmark': status, 'contact_mm2': round(area, 2), 'contact_u': None, 'contact': None, 'consistent': None}
+        if area >= CONTACT_MIN_AREA_MM2:
+            y = sum(teeth[t]['area_mm2'] * teeth[t]['centroid'][1] for t in codes if t in teeth) / area
+            yb = [p[1] for p in (loc.pick([f'{t}{s}' for s in _CONTACT_BUCCAL])[1] for t in codes) if p is not None]
+            yl = [p[1] for p in (loc.pick([f'{t}{s}' for s in _CONTACT_LINGUAL])[1] for t in codes) if p is not None]
+            half = abs(np.mean(yb) - np.mean(yl)) / 2.0 if yb and yl else 0.0
+            if half > EPS:
+                sgn = 1.0 if side == 'left' else -1.0
+                u = sgn * (y - (np.mean(yb) + np.mean(yl)) / 2.0) / half
+                rec['contact_u'] = round(float(u), 2)
+                rec['contact'] = '反锁' if u > CONTACT_LOCK_U else '正锁' if u < -CONTACT_LOCK_U else '无'
+        if status in ('无', '正锁', '反锁'):
+            if rec['contact'] is not None:
+                rec['consistent'] = rec['contact'] == status
+            elif area < CONTACT_MIN_AREA_MM2 and status != '无':
+                rec['consistent'] = True
+        out['crossbite'][side] = rec
+    return out
+
+def compute_contacts(landmarks, frame: Dict, local: Optional[LandmarkSet] = None, mesh: Optional[CaseMeshes] = None,
+                     deps: Optional[Dict] = None, contact_mm: float = 0.1, max_dist_mm: float = 2.0,
+                     workers: Optional[int] = None) -> Optional[Dict]:
+    """
+    注册表中的 'contacts'：occlusal_contacts 的接触报告，'checks' 为 contact_checks 的复核
+    （锁牙合 / 覆𬌗取 deps 中的 crossbite / overbite 结果）。任一颌 STL 不可读时为 None。
+    当前 memo（use_memo）按 (两颌 STL 摘要, 地标, 坐标轴, 阈值) 缓存整份报告。
+    """
+    if mesh is None or not mesh.available():
+        return None
+    deps = deps or {}
+    memo, key = _ACTIVE_MEMO.get(), None
+    if memo is not None:
+        key = memo_key('contacts', mesh.digests(), landmarks,
+                       {k: np.asarray(frame[k], float) for k in ('origin', 'ex', 'ey', 'ez')},
+                       {'contact_mm': float(contact_mm), 'max_dist_mm': float(max_dist_mm)})
+        hit = memo.get(key, _MEMO_MISS)
+        if hit is not _MEMO_MISS:
+            return hit
+    upper, lower = mesh.index('upper'), mesh.index('lower')
+    if upper is None or lower is None:
+        return None
+    res = occlusal_contacts(upper, lower, frame, arch_landmarks(landmarks, 'upper'),
+                            arch_landmarks(landmarks, 'lower'), contact_mm, max_dist_mm, workers)
+    res['checks'] = contact_checks(res, landmarks, frame, crossbite=deps.get('crossbite'),
+                                   overbite=deps.get('overbite'), local=local)
+    if key is not None:
+        memo.put(key, res)
+    return res
+
+# —— 网格分析注册为指标（brief=False：须点名；代价高，workers>1 时进线程池）——
+register_metric(MetricSpec('surface', compute_surface_check, None,
+                           {k: SURFACE_DEFAULTS[k] for k in ('tol_mm', 'max_snap_mm')},
+                           needs=('landmarks', 'mesh'), cost=20.0, brief=False, schema=('upper', 'lower')))
+register_metric(MetricSpec('contacts', compute_contacts, None, dict(CONTACT_DEFAULTS),
+                           needs=('frame', 'landmarks', 'mesh'), requires=('crossbite', 'overbite'),
+                           cost=100.0, brief=False,
+                           schema=('contact_mm', 'max_dist_mm', 'upper', 'lower', 'checks')))
 
 # ==========================================
 # Public API: analyze_case_brief (核心接口)
@@ -1772,20 +4999,722 @@ def _brief_lines_to_kv(brief_lines):
 
 
 
+# ==========================================
+# Public API: generate_metrics_batch
+# 输入：manifest（.json / .jsonl）或目录（<case>_U/_L 的 STL+JSON）
+# 输出：JSONL，每完成一个病例写一行（单例出错不影响其他病例）
+# ==========================================
+CASE_FILE_SUFFIXES = {
+    'upper_stl': '_U.stl',
+    'lower_stl': '_L.stl',
+    'upper_json': '_U.json',
+    'lower_json': '_L.json',
+}
+
+CASE_LMK_SUFFIXES = {'upper_json': '_U.lmk', 'lower_json': '_L.lmk'}   # 目录中没有对应 JSON 时的替代
+
+def discover_cases(source: str) -> List[Dict[str, str]]:
+    """
+    目录：按 <case>_U.stl / <case>_L.stl / <case>_U.json / <case>_L.json 归组（JSON 缺失时用 <case>_U.lmk 等）；
+          STL 可缺省（退化为纯地标坐标系），JSON 缺失的病例保留，由 worker 报错。
+    manifest：.jsonl（每行一个病例）或 .json（列表，或 {"cases": [...]}）；
+          相对路径按 manifest 所在目录解析。
+    .lmk 容器：记录 <case>_U / <case>_L 组成病例，STL 取容器同目录下的 <case>_U.stl / <case>_L.stl（若有）。
+    每个病例：{'case', 'upper_stl', 'lower_stl', 'upper_json', 'lower_json'}
+    """
+    if os.path.isdir(source):
+        return _cases_from_dir(source)
+    if source.endswith(LMK_SUFFIX):
+        return _cases_from_lmk(source)
+    return _cases_from_manifest(source)
+
+def _cases_from_lmk(path: str) -> List[Dict[str, str]]:
+    path = os.path.abspath(path)
+    base = os.path.dirname(path)
+    groups: Dict[str, Dict[str, str]] = {}
+    for rec in open_lmk(path).records:
+        for key, sfx in CASE_LMK_SUFFIXES.items():
+            tag = sfx[:-len(LMK_SUFFIX)]
+            if rec.endswith(tag) and len(rec) > len(tag):
+                groups.setdefault(rec[:-len(tag)], {})[key] = f"{path}#{rec}"
+    cases = []
+    for cid in sorted(groups):
+        stl = {k: os.path.join(base, f"{cid}{CASE_FILE_SUFFIXES[k]}") for k in ('upper_stl', 'lower_stl')}
+        cases.append({'case': cid, **{k: p if os.path.exists(p) else '' for k, p in stl.items()},
+                      **{k: groups[cid].get(k, '') for k in CASE_LMK_SUFFIXES}})
+    return cases
+
+def _cases_from_dir(root: str) -> List[Dict[str, str]]:
+    groups: Dict[str, Dict[str, str]] = {}
+    alt: Dict[str, Dict[str, str]] = {}
+    for fn in sorted(os.listdir(root)):
+        for table, suffixes in ((groups, CASE_FILE_SUFFIXES), (alt, CASE_LMK_SUFFIXES)):
+            for key, sfx in suffixes.items():
+                if fn.endswith(sfx) and len(fn) > len(sfx):
+                    table.setdefault(fn[:-len(sfx)], {})[key] = os.path.join(root, fn)
+    for cid, g in alt.items():
+        for key, path in g.items():
+            groups.setdefault(cid, {}).setdefault(key, path)
+    cases = []
+    for cid in sorted(groups):
+        g = groups[cid]
+        cases.append({'case': cid, **{k: g.get(k, '') for k in CASE_FILE_SUFFIXES}})
+    return cases
+
+def _cases_from_manifest(path: str) -> List[Dict[str, str]]:
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            entries = data.get('cases', []) if isinstance(data, dict) else data
+    cases = []
+    for i, e in enumerate(entries):
+        c = {'case': str(e.get('case', e.get('id', i)))}
+        for k in CASE_FILE_SUFFIXES:
+            v = e.get(k) or ''
+            c[k] = os.path.join(base, v) if (v and not os.path.isabs(v)) else v
+        cases.append(c)
+    return cases
+
+def _run_batch_case(case: Dict[str, str], cfg: Optional[Dict] = None) -> Dict:
+    """worker：单病例计算；异常被收进记录，不向上抛。"""
+    import time, traceback
+    t0 = time.perf_counter()
+    rec = {'case': case.get('case')}
+    try:
+        for k in ('upper_json', 'lower_json'):
+            if not case.get(k):
+                raise FileNotFoundError(f"missing {k}")
+        kv = generate_metrics(case.get('upper_stl', ''), case.get('lower_stl', ''),
+                              case['upper_json'], case['lower_json'], cfg=cfg)
+        rec.update({'ok': True, 'metrics': kv})
+    except Exception as e:
+        rec.update({'ok': False, 'error': f"{type(e).__name__}: {e}",
+                    'traceback': traceback.format_exc(limit=3)})
+    rec['elapsed_s'] = round(time.perf_counter() - t0, 4)
+    return rec
+
+def _run_batch_case_isolated(case: Dict[str, str], cfg: Optional[Dict] = None) -> Dict:
+    """在独占的单 worker 进程池里重跑一例：进程池再次崩溃即可确认是该病例本身致命（段错误 / 被杀等）。"""
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(_run_batch_case, case, cfg).result()
+        except BrokenProcessPool as e:
+            return {'case': case.get('case'), 'ok': False,
+                    'error': f"BrokenProcessPool: {e}", 'elapsed_s': None}
+
+def iter_metrics_batch(cases: List[Dict[str, str]], workers: Optional[int] = None,
+                       cfg: Optional[Dict] = None):
+    """
+    按完成顺序逐个产出记录（dict）。workers<=1 时在当前进程串行执行；
+    否则使用进程池，在途任务数限制为 workers*4，避免一次性提交上万个 future。
+    某个 worker 进程崩溃（BrokenProcessPool）时，无法区分哪一例是“肇事者”：所有在途病例逐个
+    放进单 worker 进程池重跑（只有单独跑仍崩溃的才记为失败），随后重建进程池继续。
+    """
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = (os.cpu_count() or 1) if workers is None else int(workers)
+    if workers <= 1:
+        for c in cases:
+            yield _run_batch_case(c, cfg)
+        return
+
+    pending = list(reversed(cases))
+    max_inflight = workers * 4
+    pool = ProcessPoolExecutor(max_workers=workers)
+    inflight: Dict = {}
+    try:
+        while pending or inflight:
+            while pending and len(inflight) < max_inflight:
+                c = pending.pop()
+                inflight[pool.submit(_run_batch_case, c, cfg)] = c
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            suspects = []
+            for fut in done:
+                c = inflight.pop(fut)
+                try:
+                    rec = fut.result()
+                except BrokenProcessPool:
+                    suspects.append(c)
+                    continue
+                yield rec
+            if suspects:
+                suspects.extend(inflight.values())
+                inflight.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                for c in suspects:
+                    yield _run_batch_case_isolated(c, cfg)
+                pool = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def generate_metrics_batch(
+    source,
+    out_path: str = "",
+    workers: Optional[int] = None,
+    cfg: Optional[Dict] = None,
+    progress=None,
+    table_path: str = "",
+) -> Dict:
+    """
+    source：manifest 路径 / 目录 / 病例列表（同 discover_cases 的输出）
+    out_path：JSONL 输出路径（每完成一例写一行并 flush）；为空则不落盘
+    table_path：列式输出（.parquet / .npz，见 MetricsTableWriter）；给出时按 cfg['result']='structured' 计算
+    progress：回调 progress(done, total, record)
+    返回汇总：{'total', 'ok', 'failed', 'elapsed_s'}（写了列式文件时另有 'table'：实际路径，
+    'dropped_columns'：Parquet 首个 row group 之后才出现、未能写入的列）
+    """
+    import time
+    cases = discover_cases(source) if isinstance(source, str) else list(source)
+    if table_path:
+        cfg = {**(cfg or {}), 'result': 'structured'}
+    total = len(cases)
+    n_ok = n_fail = 0
+    t0 = time.perf_counter()
+    f = open(out_path, 'w', encoding='utf-8') if out_path else None
+    table = MetricsTableWriter(table_path) if table_path else None
+    try:
+        for rec in iter_metrics_batch(cases, workers=workers, cfg=cfg):
+            if rec.get('ok'):
+                n_ok += 1
+            else:
+                n_fail += 1
+            if f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+            if table is not None:
+                table.append_record(rec)
+            if progress:
+                progress(n_ok + n_fail, total, rec)
+    finally:
+        if f:
+            f.close()
+        if table is not None:
+            table.close()
+    summary = {'total': total, 'ok': n_ok, 'failed': n_fail,
+               'elapsed_s': round(time.perf_counter() - t0, 3)}
+    if table is not None:
+        summary['table'] = table.path
+        summary['dropped_columns'] = sorted(table.dropped_columns)
+    return summary
+
+# ==========================
+# Columnar cohort export：结构化结果（cfg['result']='structured'）按列追加写出
+#   flatten_result：嵌套 dict → {'metrics.overjet.value_mm': -6.7, ...}（点号路径）；
+#     ≤4 个数的短列表拆成 .0/.1/...（如 frame.origin），其余列表存 JSON 文本
+#   列类型由首个非空值决定：float（整数亦按浮点）/ bool / str；之后类型冲突的列升为 str
+#   .parquet（需 pyarrow）：按 row group 追加；首个 row group 定 schema，之后才出现的列记入 dropped_columns
+#   .npz（无 pyarrow 时的替代）：每个 row group 先落一个分片，close 时逐列合并（内存只占一列）；
+#     float 空值为 NaN，bool 存 int8（1/0，空值 -1），str 空值为 ''；'__schema__' 记各列类型
+# ==========================
+TABLE_ROW_GROUP = 8192
+
+def flatten_result(obj, prefix: str = '', out: Optional[Dict] = None) -> Dict[str, object]:
+    out = {} if out is None else out
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            flatten_result(v, f"{prefix}.{k}" if prefix else str(k), out)
+    elif isinstance(obj, (list, tuple)):
+        if 0 < len(obj) <= 4 and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in obj):
+            for i, v in enumerate(obj):
+                out[f"{prefix}.{i}"] = float(v)
+        else:
+            out[prefix] = json.dumps(list(obj), ensure_ascii=False, default=str)
+    elif isinstance(obj, np.generic):
+        out[prefix] = obj.item()
+    else:
+        out[prefix] = obj
+    return out
+
+def _value_kind(v) -> Optional[str]:
+    if v is None or (isinstance(v, float) and v != v):
+        return None
+    if isinstance(v, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(v, (int, float)):
+        return 'float'
+    return 'str'
+
+def _column_array(kind: Optional[str], vals: List) -> np.ndarray:
+    if kind == 'float':
+        return np.array([np.nan if v is None else float(v) for v in vals], dtype=np.float64)
+    if kind == 'bool':
+        return np.array([-1 if v is None else int(bool(v)) for v in vals], dtype=np.int8)
+    return np.array(['' if v is None else str(v) for v in vals], dtype=str)
+
+def _convert_column(arr: np.ndarray, src: Optional[str], dst: Optional[str]) -> np.ndarray:
+    """npz 分片合并时把某一片的列转成最终类型（只会升为 str）。"""
+    if src == dst or dst != 'str':
+        return arr
+    if src == 'float':
+        return np.array(['' if v != v else repr(float(v)) for v in arr.tolist()], dtype=str)
+    if src == 'bool':
+        return np.array(['' if v < 0 else str(bool(v)) for v in arr.tolist()], dtype=str)
+    return arr.astype(str)
+
+class MetricsTableWriter:
+    """
+    逐例追加、按列写出：w.append_record(batch 记录) 或 w.append(扁平 dict)；用完 close()（或 with 语句）。
+    backend='auto'：pyarrow 可用且路径不是 .npz 时写 Parquet，否则写 .npz（扩展名随之改为 .npz，见 self.path）。
+    """
+    def __init__(self, path: str, backend: str = 'auto', row_group_size: int = TABLE_ROW_GROUP):
+        pq = _optional_module('pyarrow.parquet') if backend in ('auto', 'parquet') else None
+        if backend == 'auto':
+            backend = 'parquet' if (pq is not None and not path.endswith('.npz')) else 'npz'
+        if backend == 'parquet' and pq is None:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow); use a .npz path instead")
+        if backend not in ('parquet', 'npz'):
+            raise ValueError(f"backend must be 'auto', 'parquet' or 'npz', got {backend!r}")
+        if backend == 'npz' and not path.endswith('.npz'):
+            path = os.path.splitext(path)[0] + '.npz'
+        self.path = path
+        self.backend = backend
+        self.row_group_size = int(row_group_size)
+        self.kinds: Dict[str, Optional[str]] = {}
+        self.rows = 0
+        self.dropped_columns: set = set()
+        self._cols: Dict[str, List] = {}
+        self._n = 0
+        self._parts: List[Tuple[str, Dict[str, Optional[str]]]] = []
+        self._pq_writer = None
+        self._pq_schema = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append_record(self, rec: Dict) -> None:
+        """batch 记录 {'case', 'ok', 'error', 'elapsed_s', 'metrics': 结构化结果} → 一行。"""
+        row = {'case': None if rec.get('case') is None else str(rec.get('case')), 'ok': bool(rec.get('ok')),
+               'error': rec.get('error'), 'elapsed_s': rec.get('elapsed_s')}
+        res = rec.get('metrics')
+        if isinstance(res, dict):
+            flatten_result(res if 'metrics' in res else {'brief': res}, '', row)
+        self.append(row)
+
+    def append(self, row: Dict[str, object]) -> None:
+        locked = self._pq_schema is not None
+        for k, v in row.items():
+            col = self._cols.get(k)
+            if col is None:
+                if locked and k not in self.kinds:
+                    self.dropped_columns.add(k)
+                    continue
+                col = self._cols[k] = [None] * self._n
+            kind = _value_kind(v)
+            old = self.kinds.get(k)
+            if kind is not None and old != kind:
+                if old is None and not (locked and k in self.kinds):
+                    self.kinds[k] = kind
+                elif not locked:
+                    self.kinds[k] = 'str'
+                elif old == 'str':
+                    v = str(v)
+                else:
+                    v = None   # Parquet schema 已定，类型不符的值记为空
+            col.append(v)
+        self._n += 1
+        for col in self._cols.values():
+            if len(col) < self._n:
+                col.append(None)
+        if self._n >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._n == 0:
+            return
+        for k in self.kinds:
+            self._cols.setdefault(k, [None] * self._n)
+        if self.backend == 'parquet':
+            self._flush_parquet()
+        else:
+            fn = f"{self.path}.part{len(self._parts):05d}.npz"
+            np.savez(fn, **{f"c{i}": _column_array(self.kinds.get(k), v) for i, (k, v) in enumerate(self._cols.items())})
+            self._parts.append((fn, {k: self.kinds.get(k) for k in self._cols}))
+        self.rows += self._n
+        self._n = 0
+        self._cols = {k: [] for k in self._cols}
+
+    def _flush_parquet(self) -> None:
+        pa = _optional_module('pyarrow')
+        pq = _optional_module('pyarrow.parquet')
+        types = {'float': pa.float64(), 'bool': pa.bool_(), 'str': pa.string(), None: pa.string()}
+        if self._pq_schema is None:
+            for k in self._cols:
+                self.kinds.setdefault(k, None)
+            self._pq_schema = pa.schema([(k, types[self.kinds[k]]) for k in self._cols])
+            self._pq_writer = pq.ParquetWriter(self.path, self._pq_schema)
+        arrays = []
+        for field in self._pq_schema:
+            kind = self.kinds.get(field.name)
+            vals = self._cols.get(field.name) or [None] * self._n
+            if kind == 'float':
+                vals = [None if v is None else float(v) for v in vals]
+            elif kind in ('str', None):
+                vals = [None if v is None else str(v) for v in vals]
+            arrays.append(pa.array(vals, type=field.type))
+        self._pq_writer.write_table(pa.Table.from_arrays(arrays, schema=self._pq_schema))
+
+    def close(self) -> None:
+        self.flush()
+        if self.backend == 'parquet':
+            if self._pq_writer is None:   # 没有任何行：写一个只有 schema 的空表
+                pa = _optional_module('pyarrow')
+                _optional_module('pyarrow.parquet').write_table(pa.table({}), self.path)
+            else:
+                self._pq_writer.close()
+                self._pq_writer = None
+            return
+        self._merge_npz_parts()
+
+    def _merge_npz_parts(self) -> None:
+        import zipfile
+        parts = [(np.load(fn), kinds) for fn, kinds in self._parts]
+        columns = list(dict.fromkeys(k for _, kinds in self._parts for k in kinds))
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name in columns:
+                    final = self.kinds.get(name)
+                    pieces = []
+                    for z, kinds in parts:
+                        n = len(z['c0']) if 'c0' in z.files else 0
+                        if name in kinds:
+                            arr = z[f"c{list(kinds).index(name)}"]
+                            pieces.append(_convert_column(arr, kinds[name], final))
+                        else:
+                            pieces.append(_column_array(final, [None] * n))
+                    arr = np.concatenate(pieces) if pieces else _column_array(final, [])
+                    with zf.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                        np.lib.format.write_array(f, arr, allow_pickle=False)
+                with zf.open('__schema__.npy', 'w') as f:
+                    np.lib.format.write_array(f, np.array(json.dumps({k: self.kinds.get(k) for k in columns})))
+            os.replace(tmp, self.path)
+        finally:
+            for z, _ in parts:
+                z.close()
+            for fn, _ in self._parts:
+                if os.path.exists(fn):
+                    os.remove(fn)
+            self._parts = []
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+def read_metrics_table(path: str, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """读回 MetricsTableWriter 的输出：{列名: ndarray}；只读所选列（Parquet 列裁剪 / npz 按成员读取）。"""
+    if path.endswith('.npz'):
+        with np.load(path) as z:
+            names = [n for n in z.files if n != '__schema__'] if columns is None else list(columns)
+            return {n: z[n] for n in names}
+    pq = _optional_module('pyarrow.parquet')
+    if pq is None:
+        raise ImportError("reading Parquet needs pyarrow")
+    table = pq.read_table(path, columns=columns)
+    return {n: table.column(n).to_numpy(zero_copy_only=False) for n in table.column_names}
+
 # ==========================
 # 可选：命令行入口（直接落盘）
+#   单例：python calc_p.py --upper_stl ... --lower_stl ... --upper_json ... --lower_json ... --out ...
+#   批量：python calc_p.py batch <manifest|dir> --out results.jsonl [--workers N]
+#   缓存：python calc_p.py cache prewarm|prune|info [paths...] --dir <cache> [--max-bytes 4G]
+#         python calc_p.py cache prune|info --memo --dir <memo> [--max-bytes 1G]
+#   常驻：python calc_p.py daemon [start|stop|status] [--socket <path>] [--idle-timeout 600]
+#         启动后，同一用户的后续命令行调用自动经 Unix socket 交给它执行（--no-daemon 强制本地）；
+#         用 python -m calc_p 调用还可省去每次编译本脚本（__main__ 不走 .pyc 缓存）
 # ==========================
-if __name__ == "__main__":
-    import argparse
+def _main_batch(argv):
+    import argparse, sys
+    ap = argparse.ArgumentParser(prog="calc_p.py batch", description="Cohort batch → JSONL (one line per case)")
+    ap.add_argument("source", help="manifest (.json/.jsonl) 或病例目录")
+    ap.add_argument("--out", default="", help="输出 JSONL 路径")
+    ap.add_argument("--table", default="", help="列式输出：.parquet（需 pyarrow）或 .npz，每例一行、数值指标各成一列")
+    ap.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数；1 = 串行）")
+    ap.add_argument("--max_points", type=int, default=None)
+    ap.add_argument("--metrics", default=None, help="只算其中几项，逗号分隔（如 overjet,overbite）")
+    ap.add_argument("--strict-labels", action="store_true", help="地标标签不在 dict.json 协议内或重复时该病例记为失败")
+    ap.add_argument("--frame-bootstrap", type=int, default=0, metavar="RESAMPLES",
+                    help="几何咬合平面 bootstrap 次数：标记坐标系不稳定的病例（如 200）")
+    ap.add_argument("--surface", choices=('flag', 'snap'), default=None,
+                    help="地标贴面检查：flag 只报告离面地标，snap 把离面不远的地标吸附到表面再计算")
+    ap.add_argument("--contacts", type=float, nargs='?', const=CONTACT_DEFAULTS['contact_mm'], default=None, metavar="MM",
+                    help=f"上下颌咬合接触图：距离 ≤ MM（缺省 {CONTACT_DEFAULTS['contact_mm']}）的顶点为接触，按牙位汇总并复核锁牙合 / 覆𬌗")
+    args = ap.parse_args(argv)
+    if not args.out and not args.table:
+        ap.error("--out 与 --table 至少给出一个")
+
+    cfg = {}
+    if args.max_points is not None:
+        cfg['max_points'] = args.max_points
+    if args.metrics:
+        cfg['metrics'] = [m.strip() for m in args.metrics.split(',') if m.strip()]
+    if args.strict_labels:
+        cfg['strict_labels'] = True
+    if args.frame_bootstrap:
+        cfg['frame_bootstrap'] = args.frame_bootstrap
+    if args.surface:
+        cfg['surface'] = args.surface
+    if args.contacts is not None:
+        # 病例已按进程并行：病例内的距离图不再开线程，免得超额订阅
+        cfg['contacts'] = {'contact_mm': args.contacts, 'workers': None if args.workers == 1 else 1}
+
+    def _progress(done, total, rec):
+        tag = 'ok' if rec.get('ok') else f"FAILED ({rec.get('error')})"
+        res = rec.get('metrics') or {}
+        boot = res.get('_frame_bootstrap') or (res.get('frame') or {}).get('bootstrap')
+        if boot and boot.get('unstable'):
+            tag += ' (unstable frame)'
+        surf = res.get('_surface') or res.get('surface') or {}
+        n_off = sum(len(r['off_surface']) + len(r['far']) for r in surf.values() if r)
+        if n_off:
+            tag += f' ({n_off} landmark(s) off surface)'
+        print(f"[{done}/{total}] {rec.get('case')}: {tag}", file=sys.stderr, flush=True)
+
+    summary = generate_metrics_batch(args.source, out_path=args.out, workers=args.workers,
+                                     cfg=cfg, progress=_progress, table_path=args.table)
+    saved = ', '.join(p for p in (args.out, summary.get('table')) if p)
+    dropped = summary.get('dropped_columns')
+    if dropped:
+        print(f"warning: {len(dropped)} column(s) first seen after the first row group were not written to "
+              f"{summary['table']}: {', '.join(dropped)}", file=sys.stderr)
+    print(f"saved to: {saved} ({summary['ok']}/{summary['total']} ok, "
+          f"{summary['failed']} failed, {summary['elapsed_s']}s)")
+    return 0 if summary['failed'] == 0 else 1
+
+def _parse_size(text: str) -> int:
+    """'500M' / '4G' / '123456' → 字节数。"""
+    text = str(text).strip().upper().rstrip('B')
+    mult = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}.get(text[-1:], 1)
+    return int(float(text[:-1] if mult > 1 else text) * mult)
+
+def _main_cache(argv):
+    import argparse, glob
+    ap = argparse.ArgumentParser(prog="calc_p.py cache", description="Mesh cache maintenance")
+    ap.add_argument("action", choices=["prewarm", "prune", "info"])
+    ap.add_argument("paths", nargs="*", help="prewarm：STL 文件或目录")
+    ap.add_argument("--dir", default=None, help=f"缓存目录（默认 ${MESH_CACHE_ENV}；--memo 时 ${MEMO_ENV}）")
+    ap.add_argument("--max-bytes", default=None, help="容量上限，如 2G / 500M")
+    ap.add_argument("--weld-tol", type=float, default=WELD_TOL_MM, help="焊接容差 mm")
+    ap.add_argument("--memo", action="store_true", help=f"目标为结果缓存（ResultMemo，默认目录 ${MEMO_ENV}）")
+    args = ap.parse_args(argv)
+    args.dir = args.dir or os.environ.get(MEMO_ENV if args.memo else MESH_CACHE_ENV)
+    if not args.dir:
+        ap.error(f"--dir 或环境变量 {MEMO_ENV if args.memo else MESH_CACHE_ENV} 必须提供")
+
+    if args.memo:
+        if args.action == 'prewarm':
+            ap.error("prewarm 仅适用于网格缓存")
+        memo = ResultMemo(args.dir, _parse_size(args.max_bytes) if args.max_bytes else MEMO_DISK_MAX_BYTES)
+        res = memo.prune() if args.action == 'prune' else None
+        ents = memo.entries()
+        print(f"{len(ents)} entries, {sum(e['bytes'] for e in ents)} bytes in {args.dir}"
+              + (f" ({res['removed']} removed)" if res else ""))
+        return 0
+
+    cache = MeshCache(args.dir, _parse_size(args.max_bytes) if args.max_bytes else MESH_CACHE_MAX_BYTES)
+    if args.action == 'prewarm':
+        files = []
+        for p in args.paths:
+            files.extend(sorted(glob.glob(os.path.join(p, '*.stl'))) if os.path.isdir(p) else [p])
+        n = cache.prewarm(files, args.weld_tol,
+                          progress=lambda i, t, p: print(f"[{i}/{t}] {p}", flush=True))
+        print(f"prewarmed {n} new / {len(files)} files into {args.dir}")
+    elif args.action == 'prune':
+        res = cache.prune()
+        print(f"removed {res['removed']} entries; {res['bytes']} bytes remain in {args.dir}")
+    else:
+        ents = cache.entries()
+        print(f"{len(ents)} entries, {sum(e['bytes'] for e in ents)} bytes in {args.dir}")
+    return 0
+
+def _main_convert(argv):
+    import argparse, glob
+    ap = argparse.ArgumentParser(prog="calc_p.py convert", description="Slicer markups JSON → binary .lmk landmark container")
+    ap.add_argument("sources", nargs="+", help="Markups JSON 文件或目录（目录取其中的 *.json）")
+    ap.add_argument("--out", required=True, help="*.lmk：写成一个容器（每个 JSON 一条记录）；否则为目录，每个 JSON 一个 .lmk")
+    ap.add_argument("--strict-labels", action="store_true", help="跳过含协议外或重复标签的文件")
+    args = ap.parse_args(argv)
+
+    files = []
+    for p in args.sources:
+        files.extend(sorted(glob.glob(os.path.join(p, '*.json'))) if os.path.isdir(p) else [p])
+    res = convert_markups(files, args.out, strict=args.strict_labels)
+    for src, why in res['skipped']:
+        print(f"skipped {src}: {why}", file=sys.stderr)
+    for rec, iss in res['issues'].items():
+        print(f"warning {rec}: {iss}", file=sys.stderr)
+    print(f"converted {res['records']} / {len(files)} files → {args.out}")
+    return 0
+
+def _daemon_warmup() -> None:
+    """常驻进程预热：导入各子命令会用到的模块，并在合成数据上把建系与 11 项指标走一遍。"""
+    import argparse, glob, hashlib, pickle, time, traceback  # noqa: F401
+    import concurrent.futures  # noqa: F401
+    names, index = landmark_protocol()
+    rng = np.random.default_rng(0)
+    P = rng.normal(size=(400, 3)) * [20.0, 25.0, 1.0]
+    lm = LandmarkSet.empty()
+    lm.xyz[:] = rng.normal(size=lm.xyz.shape) * 10.0
+    lm.valid[:] = True
+    frame_res = build_occlusal_frame(lm, geom_points=P)
+    if frame_res.get('frame') is not None:
+        make_brief_report(lm, frame_res['frame'], local=frame_res.get('local'))
+    frame_memo_from_cfg({})
+
+def _main_daemon(argv):
+    import argparse, signal, socketserver, io, contextlib, traceback
+    ap = argparse.ArgumentParser(prog="calc_p.py daemon", description="Resident warm process for calc_p CLI calls")
+    ap.add_argument("action", nargs="?", default="start", choices=["start", "stop", "status"])
+    ap.add_argument("--socket", default=daemon_socket_path(), help=f"Unix socket 路径（默认 ${DAEMON_SOCKET_ENV} 或临时目录）")
+    ap.add_argument("--idle-timeout", type=float, default=0.0, help="空闲多少秒后自动退出（0 = 不退出）")
+    args = ap.parse_args(argv)
+    if args.action != 'start':
+        resp = _daemon_request({'cmd': args.action}, args.socket)
+        print(resp.get('stdout', '') if resp else f"not running ({args.socket})", end='' if resp else '\n')
+        return 0 if resp else 1
+    if not hasattr(socketserver, 'UnixStreamServer') or not hasattr(os, 'fork'):
+        print("daemon mode needs Unix sockets and fork()", file=sys.stderr)
+        return 2
+    if _daemon_request({'cmd': 'status'}, args.socket) is not None:
+        print(f"already running on {args.socket}", file=sys.stderr)
+        return 1
+    if os.path.exists(args.socket):
+        os.remove(args.socket)   # 上次异常退出留下的失效 socket
+
+    # 预热：fork 出的子进程继承已导入的模块、展开好的协议表与已初始化的 LAPACK 路径
+    _daemon_warmup()
+    source = _source_digest()   # 本进程加载的代码；客户端的源码哈希不同即拒绝并退出，由客户端本地执行
+
+    class _Handler(socketserver.StreamRequestHandler):
+        # 每个请求在 fork 出的子进程里执行：可自由 chdir / 改环境变量 / 重定向输出，互不干扰
+        def handle(self):
+            req = json.loads(self.rfile.readline() or b'{}')
+            cmd = req.get('cmd')
+            if cmd in ('status', 'stop'):
+                out = f"running (pid {os.getppid()}) on {args.socket}\n"
+                if cmd == 'stop':
+                    os.kill(os.getppid(), signal.SIGTERM)
+                    out = f"stopping (pid {os.getppid()})\n"
+                self.wfile.write(json.dumps({'code': 0, 'stdout': out}).encode('utf-8') + b"\n")
+                return
+            if req.get('source') != source:
+                os.kill(os.getppid(), signal.SIGTERM)
+                self.wfile.write(json.dumps({'code': 1, 'stale': True}).encode('utf-8') + b"\n")
+                return
+            os.chdir(req.get('cwd') or '/')
+            os.environ.update(req.get('env') or {})
+            out, err = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                try:
+                    code = _main(req.get('argv') or [])
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                    if not isinstance(e.code, (int, type(None))):
+                        print(e.code, file=sys.stderr)
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+            resp = {'code': int(code or 0), 'stdout': out.getvalue(), 'stderr': err.getvalue()}
+            self.wfile.write(json.dumps(resp, ensure_ascii=False).encode('utf-8') + b"\n")
+
+    import time
+
+    class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        last_request = time.monotonic()
+
+        def process_request(self, request, client_address):
+            self.last_request = time.monotonic()
+            super().process_request(request, client_address)
+
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+    old_umask = os.umask(0o177)   # socket 仅本用户可连
+    try:
+        server = _Server(args.socket, _Handler)
+    finally:
+        os.umask(old_umask)
+    print(f"calc_p daemon (pid {os.getpid()}) listening on {args.socket}", flush=True)
+    server.timeout = 1.0
+    try:
+        with server:
+            while not stop:
+                server.handle_request()   # 超时返回时顺带回收已结束的子进程
+                idle = time.monotonic() - server.last_request
+                if args.idle_timeout and not server.active_children and idle > args.idle_timeout:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+def _main(argv=None):
+    import argparse, sys
+    argv = sys.argv[1:] if argv is None else list(argv)
+    argv = [a for a in argv if a != '--no-daemon']
+    if argv and argv[0] in ('daemon', '--daemon'):
+        return _main_daemon(argv[1:])
+    if argv and argv[0] == 'batch':
+        return _main_batch(argv[1:])
+    if argv and argv[0] == 'cache':
+        return _main_cache(argv[1:])
+    if argv and argv[0] == 'convert':
+        return _main_convert(argv[1:])
+
     ap = argparse.ArgumentParser(description="Ortho analysis → brief key-value JSON")
     ap.add_argument("--upper_stl", required=True)
     ap.add_argument("--lower_stl", required=True)
     ap.add_argument("--upper_json", required=True)
     ap.add_argument("--lower_json", required=True)
     ap.add_argument("--out", required=True, help="输出 JSON 路径")
-    args = ap.parse_args()
-
-    kv = generate_metrics(args.upper_stl, args.lower_stl, args.upper_json, args.lower_json, out_path=args.out)
+    ap.add_argument("--metrics", default=None, help="只算其中几项，逗号分隔（如 overjet,overbite）")
+    ap.add_argument("--structured", action="store_true", help="输出结构化结果（brief + 各指标完整数值 + 坐标系）")
+    ap.add_argument("--uncertainty", type=int, default=0, metavar="SAMPLES",
+                    help="蒙特卡洛样本数：输出各指标的置信区间与类别翻转概率（如 1000）")
+    ap.add_argument("--frame-bootstrap", type=int, default=0, metavar="RESAMPLES",
+                    help="几何咬合平面 bootstrap 次数：输出 ez/ex 夹角离散度与各指标敏感度（如 200）")
+    ap.add_argument("--surface", choices=('flag', 'snap'), default=None,
+                    help="地标贴面检查：flag 只报告离面地标，snap 把离面不远的地标吸附到表面再计算")
+    ap.add_argument("--contacts", type=float, nargs='?', const=CONTACT_DEFAULTS['contact_mm'], default=None, metavar="MM",
+                    help=f"上下颌咬合接触图：距离 ≤ MM（缺省 {CONTACT_DEFAULTS['contact_mm']}）的顶点为接触，按牙位汇总并复核锁牙合 / 覆𬌗")
+    ap.add_argument("--sigma-mm", type=float, default=UNCERTAINTY_DEFAULTS['sigma_mm'], help="地标标注噪声（每轴标准差，mm）")
+    ap.add_argument("--profile", default=None, metavar="TRACE_JSON",
+                    help="记录各阶段耗时 / CPU / 峰值内存，写成 Chrome trace（chrome://tracing、Perfetto 可打开）")
+    args = ap.parse_args(argv)
+
+    cfg = {'metrics': [m.strip() for m in args.metrics.split(',') if m.strip()]} if args.metrics else {}
+    if args.structured:
+        cfg['result'] = 'structured'
+    if args.frame_bootstrap:
+        cfg['frame_bootstrap'] = args.frame_bootstrap
+    if args.surface:
+        cfg['surface'] = args.surface
+    if args.contacts is not None:
+        cfg['contacts'] = args.contacts
+    if args.uncertainty:
+        cfg['uncertainty'] = {'samples': args.uncertainty, 'sigma_mm': args.sigma_mm}
+    tracer = StageTracer() if args.profile else None
+    if tracer is not None:
+        cfg['trace'] = tracer
+    try:
+        kv = generate_metrics(args.upper_stl, args.lower_stl, args.upper_json, args.lower_json, out_path=args.out, cfg=cfg)
+    finally:
+        if tracer is not None:
+            tracer.close()
     print(f"saved to: {args.out} ({len(kv)} items)")
+    if tracer is not None:
+        tracer.write_chrome_trace(args.profile)
+        print(f"profile: {args.profile} ({len(tracer.events)} events)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
 
 
@@ -0,0 +1,661 @@
+"""
+本地指标服务：标准库 asyncio HTTP 外壳 + 常驻（已预热）的计算进程池，封装 calc_p.generate_metrics。
+
+    python server_p.py [--host 127.0.0.1] [--port 8765] [--workers N] [--root <repo>] [--queue 64] [--cors-origin URL ...]
+
+  GET  /health          {"ok", "workers", "queued", "inflight"}
+  POST /metrics         单病例 → {"ok", "metrics", "elapsed_s", "queue_ms"}（计算失败为 422 + "error"）
+  POST /metrics/batch   {"cases": [...], "cfg": {...}} → {"results": [...]}（与 cases 同序；单个病例的请求错误记在该位置）
+  GET  /ws              WebSocket：拖动地标时推送变化的指标（见 LiveSession）
+
+病例字段（键名同 calc_p.CASE_FILE_SUFFIXES）：
+  路径引用：upper_stl / lower_stl / upper_json / lower_json，相对 --root，且不得越出 root
+  按编号：  {"case": "1"} → <root>/assets/1_U.stl、1_L.stl、1_U.json、1_L.json（与前端 ./assets 约定一致；
+            JSON 缺失时取 1_U.lmk / 1_L.lmk）
+  上传：    upper_stl_data / lower_stl_data（base64 STL），upper_json_data / lower_json_data（Markups JSON 对象）
+  cfg：     只透传 REQUEST_CFG_KEYS 中的项（如 {"metrics": ["overjet", "overbite"]}）；
+            uncertainty / frame_bootstrap / contacts 的次数与线程数截到 REQUEST_CFG_LIMITS
+
+跨域：只对 --cors-origin 列出的来源（默认前端 http://localhost:8001）回 Access-Control-Allow-Origin，
+WebSocket 握手带其他 Origin 时拒绝；--cors-origin '*' 放开。
+
+队列满时立即返回 503（Retry-After），不在服务端无限堆积；空闲 worker 一次取走队列中已到达的
+若干病例（至多 batch_max）作为一批提交，合并进程间往返。
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import calc_p
+
+REPO_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 512 << 20
+REQUEST_CFG_KEYS = ('metrics', 'max_points', 'sampler', 'frame', 'dtype', 'stream_geometry', 'strict_labels', 'result', 'uncertainty', 'frame_bootstrap', 'surface', 'contacts')
+# 请求可开的重计算项：按 calc_p 的解析函数补全参数后，次数 / 线程数截到服务端上限（未给出的线程数取上限）
+REQUEST_CFG_LIMITS = {
+    'uncertainty': (calc_p.uncertainty_cfg, 'samples', 2000),
+    'frame_bootstrap': (calc_p.bootstrap_cfg, 'resamples', 1000),
+    'contacts': (calc_p.contacts_cfg, 'workers', 2),
+}
+DEFAULT_CORS_ORIGINS = ('http://localhost:8001', 'http://127.0.0.1:8001')   # 前端 http.server 的默认端口（见 Readme）
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# ================================
+# Worker 进程：启动即导入 numpy / calc_p 并展开协议表；按批计算
+# ================================
+def _warm_worker() -> None:
+    calc_p.landmark_protocol()
+    calc_p.frame_memo_from_cfg({})
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _mp_context():
+    """
+    计算进程的启动方式：POSIX 上用 forkserver（预导入 calc_p）。进程池崩溃后的重建 / 重跑发生在服务运行中，
+    直接 fork 会让新 worker 继承已打开的客户端连接，服务端关闭连接后对端仍收不到 EOF。
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(['calc_p'])
+    return ctx
+
+
+def _materialize(case: Dict, tmp: str) -> Dict[str, str]:
+    """上传的 *_data 写入临时目录，返回纯路径病例（网格缓存按内容哈希，临时路径不影响命中）。"""
+    out = {'case': case.get('case')}
+    for key, sfx in calc_p.CASE_FILE_SUFFIXES.items():
+        data = case.get(f'{key}_data')
+        if data is None:
+            out[key] = case.get(key) or ''
+            continue
+        fn = os.path.join(tmp, f"upload{sfx}")
+        if key.endswith('_stl'):
+            with open(fn, 'wb') as f:
+                f.write(base64.b64decode(data))
+        else:
+            with open(fn, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+        out[key] = fn
+    return out
+
+
+def _open_live_case(case: Dict, cfg: Dict) -> 'calc_p.CaseState':
+    """交互会话建病例（在服务进程的线程池中执行：CaseState 需常驻本进程）。"""
+    if any(k.endswith('_data') for k in case):
+        with tempfile.TemporaryDirectory(prefix='lmk-') as tmp:
+            case = _materialize(case, tmp)
+            return calc_p.open_case(case['upper_stl'], case['lower_stl'], case['upper_json'], case['lower_json'], cfg)
+    for k in ('upper_json', 'lower_json'):
+        if not case.get(k):
+            raise FileNotFoundError(f"missing {k}")
+    return calc_p.open_case(case.get('upper_stl', ''), case.get('lower_stl', ''), case['upper_json'], case['lower_json'], cfg)
+
+
+def _run_cases(batch: List[Tuple[Dict, Dict]]) -> List[Dict]:
+    """worker：一批 (病例, cfg)；逐个调用 calc_p._run_batch_case（单例异常——含上传数据解码失败——不影响同批其他病例）。"""
+    records = []
+    for case, cfg in batch:
+        try:
+            if any(k.endswith('_data') for k in case):
+                with tempfile.TemporaryDirectory(prefix='lmk-') as tmp:
+                    rec = calc_p._run_batch_case(_materialize(case, tmp), cfg)
+            else:
+                rec = calc_p._run_batch_case(case, cfg)
+        except Exception as e:
+            rec = {'case': case.get('case'), 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        rec.pop('traceback', None)
+        records.append(rec)
+    return records
+
+
+def _run_case_isolated(case: Dict, cfg: Dict) -> Dict:
+    """进程池崩溃后的重跑（在服务进程的线程里调用）：单 worker 独占进程池里算一例，再次崩溃即确认是该病例本身致命。"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=_mp_context()) as pool:
+        try:
+            return pool.submit(_run_cases, [(case, cfg)]).result()[0]
+        except BrokenProcessPool as e:
+            return {'case': case.get('case'), 'ok': False, 'error': f"BrokenProcessPool: {e}"}
+
+
+# ================================
+# 服务
+# ================================
+class MetricsServer:
+    """
+    root：路径引用的根目录；workers：计算进程数（默认 CPU 核数）
+    queue_size：等待中的病例上限（超过即 503）；batch_max：单批最多病例数
+    cfg：服务端基础 cfg（mesh_cache / memo 等只能在此配置，请求不可覆盖）
+    cors_origins：允许跨域访问的来源（含 '*' 即不限）
+    """
+    def __init__(self, root: str = REPO_ROOT, workers: Optional[int] = None, queue_size: int = 64,
+                 batch_max: int = 16, cfg: Optional[Dict] = None, cors_origins=DEFAULT_CORS_ORIGINS):
+        self.root = os.path.realpath(root)
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.queue_size = int(queue_size)
+        self.batch_max = max(1, int(batch_max))
+        self.cfg = dict(cfg or {})
+        self.cors_origins = frozenset(cors_origins or ())
+        self.queue: Optional[asyncio.Queue] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.inflight = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._threads: Optional[ThreadPoolExecutor] = None   # 交互会话的建系 / 增量重算
+        self._tasks: set = set()
+        self._server = None
+
+    # ---- 生命周期 ----
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context(), initializer=_warm_worker)
+
+    async def start(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._slots = asyncio.Semaphore(self.workers)
+        self.pool = self._new_pool()
+        self._threads = ThreadPoolExecutor(max_workers=max(4, self.workers), thread_name_prefix='live')
+        # 预热：让每个 worker 进程先起来并完成导入，首个请求不付解释器启动的代价
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)))
+        self._spawn(self._dispatch())
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for t in list(self._tasks):
+            t.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    # ---- 排队与批量派发 ----
+    def submit_nowait(self, case: Dict, cfg: Dict) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((case, cfg, fut, asyncio.get_running_loop().time()))
+        except asyncio.QueueFull:
+            raise HttpError(503, 'server busy: queue full', {'Retry-After': '1'})
+        return fut
+
+    async def _dispatch(self):
+        while True:
+            await self._slots.acquire()
+            first = await self.queue.get()
+            # 空闲 worker 取走已到达的病例：队列越长批越大，空闲时不引入额外等待
+            n = min(self.batch_max, max(1, math.ceil((self.queue.qsize() + 1) / self.workers)))
+            batch = [first]
+            while len(batch) < n and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self._spawn(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        self.inflight += len(batch)
+        t0 = loop.time()
+        items = [(c, cfg) for c, cfg, _, _ in batch]
+        pool = self.pool
+        try:
+            try:
+                records = await loop.run_in_executor(pool, _run_cases, items)
+            except BrokenProcessPool:
+                # 一个 worker 崩溃会牵连同池所有在途批次：只替换本批所用的那个池（并发的批次可能已换过），
+                # 本批病例逐个在独占进程里重跑，只有单独跑仍崩溃的才记为失败
+                if self.pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._new_pool()
+                records = [await loop.run_in_executor(self._threads, _run_case_isolated, c, cfg) for c, cfg in items]
+        except Exception as e:
+            records = [{'case': c.get('case'), 'ok': False, 'error': f"{type(e).__name__}: {e}"} for c, _, _, _ in batch]
+        finally:
+            self.inflight -= len(batch)
+            self._slots.release()
+        for (_, _, fut, t_in), rec in zip(batch, records):
+            rec['queue_ms'] = round((t0 - t_in) * 1e3, 2)
+            if not fut.done():
+                fut.set_result(rec)
+
+    # ---- 请求 → 病例 ----
+    def _resolve(self, rel: str) -> str:
+        path = os.path.realpath(os.path.join(self.root, rel))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise HttpError(403, f"path outside server root: {rel}")
+        return path
+
+    def _case_from_request(self, req: Dict) -> Dict:
+        if not isinstance(req, dict):
+            raise HttpError(400, 'case must be a JSON object')
+        case = {'case': str(req.get('case', req.get('id', '')))}
+        by_id = req.get('case') is not None and not any(req.get(k) or req.get(f'{k}_data') for k in calc_p.CASE_FILE_SUFFIXES)
+        for key, sfx in calc_p.CASE_FILE_SUFFIXES.items():
+            if req.get(f'{key}_data') is not None:
+                case[f'{key}_data'] = req[f'{key}_data']
+            elif req.get(key):
+                case[key] = self._resolve(str(req[key]))
+            elif by_id:
+                p = self._resolve(os.path.join('assets', f"{case['case']}{sfx}"))
+                if not os.path.exists(p) and key in calc_p.CASE_LMK_SUFFIXES:
+                    p = self._resolve(os.path.join('assets', f"{case['case']}{calc_p.CASE_LMK_SUFFIXES[key]}"))
+                case[key] = p if os.path.exists(p) else ''
+        return case
+
+    def _cfg_from_request(self, req_cfg) -> Dict:
+        cfg = dict(self.cfg)
+        if not isinstance(req_cfg, dict):
+            return cfg
+        cfg.update({k: v for k, v in req_cfg.items() if k in REQUEST_CFG_KEYS})
+        for key, (parse, field, cap) in REQUEST_CFG_LIMITS.items():
+            if key not in req_cfg:
+                continue
+            try:
+                opts = parse(cfg[key])
+                if opts is not None:
+                    n = opts.get(field)
+                    opts[field] = cap if n is None else max(1, min(int(n), cap))
+            except (TypeError, ValueError) as e:
+                raise HttpError(400, f"cfg['{key}']: {e}")
+            cfg[key] = opts
+        return cfg
+
+    def _cors_origin(self, headers: Dict[str, str]) -> Optional[str]:
+        """请求的 Origin 在允许列表内时返回应回写的 Access-Control-Allow-Origin 值，否则 None。"""
+        if '*' in self.cors_origins:
+            return '*'
+        origin = headers.get('origin')
+        return origin if origin in self.cors_origins else None
+
+    # ---- HTTP ----
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if method == 'GET' and path == '/health':
+            return 200, {'ok': True, 'workers': self.workers, 'queued': self.queue.qsize(), 'inflight': self.inflight}
+        if method != 'POST' or path not in ('/metrics', '/metrics/batch'):
+            raise HttpError(404, f"no route: {method} {path}")
+        try:
+            req = json.loads(body.decode('utf-8') or '{}')
+        except ValueError as e:
+            raise HttpError(400, f"invalid JSON body: {e}")
+        if path == '/metrics':
+            rec = await self.submit_nowait(self._case_from_request(req), self._cfg_from_request(req.get('cfg')))
+            return (200 if rec.get('ok') else 422), rec
+        cases = req.get('cases')
+        if not isinstance(cases, list):
+            raise HttpError(400, "'cases' must be a list")
+        if len(cases) > self.queue.maxsize - self.queue.qsize():
+            raise HttpError(503, 'server busy: batch does not fit in queue', {'Retry-After': '1'})
+        cfg = self._cfg_from_request(req.get('cfg'))
+        futs = []
+        for c in cases:
+            try:
+                case = self._case_from_request(c)
+            except HttpError as e:
+                # 单个病例的请求错误（如路径越出 root）只记在该位置，不连累整批
+                fut = asyncio.get_running_loop().create_future()
+                fut.set_result({'case': str(c.get('case', c.get('id', ''))) if isinstance(c, dict) else None,
+                                'ok': False, 'error': str(e)})
+                futs.append(fut)
+                continue
+            futs.append(self.submit_nowait(case, cfg))
+        return 200, {'results': list(await asyncio.gather(*futs))}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    req = await _read_request(reader)
+                except HttpError as e:
+                    writer.write(_response(e.status, {'ok': False, 'error': str(e)}, e.headers, keep_alive=False))
+                    break
+                if req is None:
+                    break
+                method, path, headers, body = req
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                cors = self._cors_origin(headers)
+                if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                    if 'origin' in headers and cors is None:   # 浏览器不对 WebSocket 做同源限制，在此按来源拒绝
+                        writer.write(_response(403, {'ok': False, 'error': 'origin not allowed'}, keep_alive=False))
+                    else:
+                        await self._serve_ws(reader, writer, headers)
+                    break
+                if method == 'OPTIONS':   # CORS 预检（前端由 http.server 另开端口提供）
+                    writer.write(_response(204, None, keep_alive=keep_alive, cors=cors))
+                else:
+                    try:
+                        status, payload = await self._route(method, path, body)
+                        extra = {}
+                    except HttpError as e:
+                        status, payload, extra = e.status, {'ok': False, 'error': str(e)}, e.headers
+                    writer.write(_response(status, payload, extra, keep_alive=keep_alive, cors=cors))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # ---- WebSocket ----
+    async def _serve_ws(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            writer.write(_response(400, {'ok': False, 'error': 'missing Sec-WebSocket-Key'}, keep_alive=False))
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('latin-1')).digest()).decode('latin-1')
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+        session = LiveSession(self, writer)
+        try:
+            while True:
+                op, data = await _ws_recv(reader, writer)
+                if op is None:
+                    break
+                if op != WS_TEXT:
+                    continue
+                try:
+                    msg = json.loads(data.decode('utf-8'))
+                except ValueError as e:
+                    await session.send({'type': 'error', 'error': f"invalid JSON: {e}"})
+                    continue
+                await session.handle(msg)
+        finally:
+            session.close()
+
+
+# ================================
+# 交互会话：拖动地标 → 合并 / 防抖 → 增量重算 → 只推送变化的键
+# ================================
+class LiveSession:
+    """
+    一条 WebSocket 连接上的一个病例（calc_p.CaseState）。消息（JSON 文本帧）：
+      → {"type": "open", "case": "1" | 路径 / 上传字段, "cfg": {...}}
+      ← {"type": "metrics", "full": true, "metrics": {键: 值}}
+      → {"type": "edit", "landmarks": {label: [x,y,z] | null}, "seq": n}
+      ← {"type": "metrics", "seq": n, "metrics": {只含变化的键}, "frame_changed": bool}
+    编辑先并入 pending（同一地标只留最新坐标）；静默 debounce_s 或距首个编辑满 max_wait_s 后整批计算，
+    连续拖动时也保证约每帧一次推送。计算期间若有更新的编辑到达，在指标之间取消本轮：
+    未算完的指标留在 CaseState.stale 中随下一轮补算，过期结果不推送。推送内容相对“上次已推送”求差。
+    每轮计算绑定发起时的病例；重新 open 时先等在途计算退出，换病例后旧病例的结果一律丢弃。
+    """
+    def __init__(self, server: 'MetricsServer', writer: asyncio.StreamWriter,
+                 debounce_s: float = 0.008, max_wait_s: float = 0.016):
+        self.server = server
+        self.writer = writer
+        self.debounce_s = debounce_s
+        self.max_wait_s = max_wait_s
+        self.case: Optional['calc_p.CaseState'] = None
+        self.pending: Dict[str, object] = {}
+        self.seq = None
+        self.sent: Dict[str, str] = {}
+        self._frame_changed = False
+        self._newer = threading.Event()   # 计算线程据此在指标之间取消
+        self._wake = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+        self._running = None   # 线程池中在途的计算（concurrent.futures.Future）
+
+    async def send(self, msg: Dict):
+        self.writer.write(_ws_frame(WS_TEXT, json.dumps(msg, ensure_ascii=False).encode('utf-8')))
+        await self.writer.drain()
+
+    async def handle(self, msg: Dict):
+        kind = msg.get('type') if isinstance(msg, dict) else None
+        if kind == 'open':
+            await self.open(msg)
+        elif kind == 'edit':
+            if self.case is None:
+                await self.send({'type': 'error', 'seq': msg.get('seq'), 'error': "no case open; send {'type': 'open'} first"})
+                return
+            edits = msg.get('landmarks')
+            if isinstance(edits, dict):
+                self.pending.update(edits)
+                self.seq = msg.get('seq', self.seq)
+                self._newer.set()
+                self._wake.set()
+        else:
+            await self.send({'type': 'error', 'error': f"unknown message type: {kind!r}"})
+
+    async def open(self, msg: Dict):
+        loop = asyncio.get_running_loop()
+        self.close()
+        if self._running is not None:
+            # 取消 pump 不会停下线程里的计算：等它在下一个指标边界退出（_newer 已置位），再换病例
+            await asyncio.wait([asyncio.wrap_future(self._running)])
+            self._running = None
+        self.pending.clear()
+        self.seq = None
+        self._frame_changed = False
+        try:
+            case = self.server._case_from_request(msg)
+            cfg = self.server._cfg_from_request(msg.get('cfg'))
+            self.case = await loop.run_in_executor(self.server._threads, _open_live_case, case, cfg)
+        except Exception as e:
+            self.case = None
+            await self.send({'type': 'error', 'error': f"{type(e).__name__}: {e}"})
+            return
+        self.sent = dict(self.case.kv)
+        await self.send({'type': 'metrics', 'full': True, 'metrics': self.sent})
+        self._pump_task = self.server._spawn(self._pump())
+
+    def close(self):
+        self._newer.set()
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+
+    def _compute(self, case: 'calc_p.CaseState', edits: Dict) -> Tuple[Optional[Dict], bool]:
+        _, frame_changed = case.apply_edits(edits)
+        return case.refresh(cancel=self._newer.is_set), frame_changed
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            t_first = loop.time()
+            while True:   # 防抖：静默 debounce_s 或等满 max_wait_s
+                self._wake.clear()
+                remain = min(self.debounce_s, self.max_wait_s - (loop.time() - t_first))
+                if remain <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wake.wait(), remain)
+                except asyncio.TimeoutError:
+                    break
+            edits, self.pending = self.pending, {}
+            seq = self.seq
+            case = self.case
+            self._newer.clear()
+            self._running = self.server._threads.submit(self._compute, case, edits)
+            try:
+                done, frame_changed = await asyncio.wrap_future(self._running)
+            except Exception as e:
+                await self.send({'type': 'error', 'seq': seq, 'error': f"{type(e).__name__}: {e}"})
+                continue
+            if case is not self.case:
+                continue   # 计算期间换了病例：结果作废
+            self._frame_changed |= frame_changed
+            if done is None:
+                continue   # 被更新的编辑取消；_wake 已置位，下一轮接着算
+            kv = case.kv
+            delta = {k: v for k, v in kv.items() if self.sent.get(k) != v}
+            delta.update({k: None for k in self.sent if k not in kv})   # 如坐标系缺失时指标键被“错误”取代
+            self.sent = dict(kv)
+            await self.send({'type': 'metrics', 'seq': seq, 'metrics': delta, 'frame_changed': self._frame_changed})
+            self._frame_changed = False
+
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def _ws_frame(opcode: int, payload: bytes = b'') -> bytes:
+    """服务端帧（不加掩码，单帧 FIN）。"""
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < (1 << 16):
+        head = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return head + payload
+
+
+async def _ws_recv(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Tuple[Optional[int], bytes]:
+    """读一条完整消息（合并分片）；ping 自动回 pong；收到 close 回 close 并返回 (None, b'')。"""
+    opcode, chunks, size = None, [], 0
+    while True:
+        b1, b2 = await reader.readexactly(2)
+        fin, op, masked, n = b1 & 0x80, b1 & 0x0F, b2 & 0x80, b2 & 0x7F
+        if n == 126:
+            n = struct.unpack('!H', await reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack('!Q', await reader.readexactly(8))[0]
+        size += n
+        if size > MAX_BODY_BYTES:
+            writer.write(_ws_frame(WS_CLOSE, struct.pack('!H', 1009)))
+            return None, b''
+        mask = await reader.readexactly(4) if masked else None
+        data = await reader.readexactly(n)
+        if mask:
+            data = (np.frombuffer(data, dtype=np.uint8) ^ np.resize(np.frombuffer(mask, dtype=np.uint8), n)).tobytes()
+        if op == WS_CLOSE:
+            writer.write(_ws_frame(WS_CLOSE, data[:2]))
+            return None, b''
+        if op == WS_PING:
+            writer.write(_ws_frame(WS_PONG, data))
+            continue
+        if op == WS_PONG:
+            continue
+        if op != 0:
+            opcode = op
+        chunks.append(data)
+        if fin:
+            return opcode, b''.join(chunks)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """读一个 HTTP/1.1 请求；连接关闭返回 None。只支持 Content-Length 请求体。"""
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').strip().split(' ')
+    if len(parts) != 3:
+        raise HttpError(400, 'malformed request line')
+    method, target, _ = parts
+    headers: Dict[str, str] = {}
+    while True:
+        h = await reader.readline()
+        if h in (b'\r\n', b'\n', b''):
+            break
+        k, _, v = h.decode('latin-1').partition(':')
+        headers[k.strip().lower()] = v.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise HttpError(411, 'chunked request bodies are not supported; send Content-Length')
+    n = int(headers.get('content-length') or 0)
+    if n > MAX_BODY_BYTES:
+        raise HttpError(413, f"request body exceeds {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(n) if n else b''
+    return method.upper(), target.split('?', 1)[0], headers, body
+
+
+_REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+            411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+            503: 'Service Unavailable'}
+
+
+def _response(status: int, payload, headers: Optional[Dict[str, str]] = None, keep_alive: bool = True,
+              cors: Optional[str] = None) -> bytes:
+    """cors：Access-Control-Allow-Origin 的值（None 则不带 CORS 头，浏览器跨域读取被拒）。"""
+    body = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = [
+        f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(body)}",
+    ]
+    if cors is not None:
+        head += [f"Access-Control-Allow-Origin: {cors}",
+                 "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+                 "Access-Control-Allow-Headers: Content-Type",
+                 "Vary: Origin"]
+    head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    return ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+
+# ==========================
+# 命令行入口
+# ==========================
+def _main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Local metrics service for the web viewer (HTTP/JSON)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--workers", type=int, default=None, help="计算进程数（默认 CPU 核数）")
+    ap.add_argument("--root", default=REPO_ROOT, help="路径引用的根目录（默认仓库根）")
+    ap.add_argument("--queue", type=int, default=64, help="等待队列上限，超出返回 503")
+    ap.add_argument("--batch-max", type=int, default=16, help="单批最多病例数")
+    ap.add_argument("--mesh-cache", default=None, help="网格缓存目录（同 calc_p cfg['mesh_cache']）")
+    ap.add_argument("--memo", default=None, help="结果缓存目录（同 calc_p cfg['memo']）")
+    ap.add_argument("--cors-origin", action="append", default=None, metavar="URL",
+                    help=f"允许跨域访问的前端来源，可重复（默认 {' '.join(DEFAULT_CORS_ORIGINS)}；'*' 不限）")
+    args = ap.parse_args(argv)
+
+    cfg = {}
+    if args.mesh_cache:
+        cfg['mesh_cache'] = args.mesh_cache
+    if args.memo:
+        cfg['memo'] = args.memo
+    server = MetricsServer(args.root, workers=args.workers, queue_size=args.queue,
+                           batch_max=args.batch_max, cfg=cfg, cors_origins=args.cors_origin or DEFAULT_CORS_ORIGINS)
+
+    async def _serve():
+        await server.start(args.host, args.port)
+        print(f"serving on http://{args.host}:{args.port} ({server.workers} workers, root={server.root})", flush=True)
+        try:
+            await server.serve_forever()
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
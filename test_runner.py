@@ -17,8 +17,8 @@ except ImportError:
     print("Please ensure the file exists and there are no issues within the script.")
     sys.exit(1)
 
-# Define the absolute paths to the asset files
-workspace_root = r'c:\MISC\Deepcare\LandmarkPlayer'
+# Define the absolute paths to the asset files (relative to this script's location)
+workspace_root = os.path.dirname(os.path.abspath(__file__))
 upper_stl_path = os.path.join(workspace_root, 'assets', '1_U.stl')
 lower_stl_path = os.path.join(workspace_root, 'assets', '1_L.stl')
 upper_json_path = os.path.join(workspace_root, 'assets', '1_U.json')
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS = os.path.join(ROOT, 'assets')
+sys.path.insert(0, os.path.join(ROOT, 'js', 'metrics'))
+
+import calc_p  # noqa: E402
+
+
+def asset_landmarks(case: str) -> 'calc_p.LandmarkSet':
+    return calc_p._merge_landmarks(calc_p._load_landmarks_json(os.path.join(ASSETS, f'{case}_U.json')),
+                                   calc_p._load_landmarks_json(os.path.join(ASSETS, f'{case}_L.json')))
+
+
+def perturbed_cases(n: int, seed: int = 5, sigma_mm: float = 0.6, max_drop: float = 0.5):
+    """assets/ 两例加高斯扰动并随机删点（每例删除比例 ∈ [0, max_drop)）；建不出坐标系时沿用原例的坐标系。"""
+    rng = np.random.default_rng(seed)
+    base = [asset_landmarks(c) for c in ('1', '2')]
+    base_frames = [calc_p.build_occlusal_frame(b)['frame'] for b in base]
+    sets, frames = [], []
+    for k in range(n):
+        drop = rng.random() * max_drop
+        pts = {name: (np.asarray(p) + rng.normal(0.0, sigma_mm, 3)).tolist()
+               for name, p in base[k % 2].to_dict().items() if rng.random() > drop}
+        ls = calc_p.LandmarkSet.from_mapping(pts)
+        frames.append(calc_p.build_occlusal_frame(ls)['frame'] or base_frames[k % 2])
+        sets.append(ls)
+    return sets, frames
+
+
+@pytest.fixture(scope='session')
+def cases():
+    return perturbed_cases(300)
+
+
+def write_stl(path: str, vertices: np.ndarray, faces: np.ndarray) -> str:
+    """二进制 STL（法向置零）。"""
+    tri = np.asarray(vertices, np.float32)[np.asarray(faces)]
+    rec = np.zeros(len(tri), dtype=[('n', '<f4', 3), ('v', '<f4', (3, 3)), ('attr', '<u2')])
+    rec['v'] = tri
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 80)
+        f.write(np.uint32(len(tri)).tobytes())
+        f.write(rec.tobytes())
+    return path
+
+
+def grid_surface(lm: 'calc_p.LandmarkSet', n: int = 40, seed: int = 0):
+    """覆盖地标包围盒的起伏网格（顶点 n×n）：合成的“牙列”表面，供建系 / 网格相关路径使用。"""
+    rng = np.random.default_rng(seed)
+    P = lm.xyz[lm.valid]
+    lo, hi = P.min(axis=0), P.max(axis=0)
+    u, v = np.meshgrid(np.linspace(lo[0], hi[0], n), np.linspace(lo[1], hi[1], n))
+    w = P[:, 2].mean() + rng.normal(0.0, 0.3, u.shape)
+    V = np.stack([u, v, w], axis=-1).reshape(-1, 3)
+    i = np.arange(n - 1)[:, None] * n + np.arange(n - 1)[None, :]
+    F = np.concatenate([np.stack([i, i + 1, i + n], -1).reshape(-1, 3),
+                        np.stack([i + 1, i + n + 1, i + n], -1).reshape(-1, 3)])
+    return V, F
@@ -0,0 +1,111 @@
+"""batch_metrics 与逐例 compute_* 的口径一致性：扰动 + 随机删点的 assets/ 病例，逐字段比对。"""
+import numpy as np
+
+import calc_p
+
+
+def _get(r, *path):
+    for k in path:
+        if not isinstance(r, dict) or r.get(k) is None:
+            return None
+        r = r[k]
+    return r
+
+
+def _fields(name, r):
+    """compute_* 结果 → {batch 字段: (值, 容差)}；容差为 compute 侧舍入的半个单位。"""
+    d1, d2 = 0.051, 0.0051
+    out = {}
+    if name == 'arch_form':
+        out['form'] = (r['form'], 0)
+        for k in ('ICW_mm', 'IMW_mm', 'AD_mm', 'ICW_IMW', 'AD_ICW'):
+            out[k] = (_get(r, 'indices', k), d2)
+    elif name == 'arch_width':
+        for arch in ('upper', 'lower'):
+            for seg in ('anterior', 'middle', 'posterior'):
+                out[f'{arch}_{seg}_mm'] = (_get(r, arch, f'{seg}_mm'), 1e-9)
+                out[f'{arch}_{seg}_dx_mm'] = (_get(r, arch, 'dx_mm', seg), 1e-9)
+        for seg in ('anterior', 'middle', 'posterior'):
+            out[f'diff_{seg}_mm'] = (_get(r, 'diff_UL_mm', seg), 1e-9)
+        out['segments'] = (sum(v is not None for v in (r.get('diff_UL_mm') or {}).values()), 0)
+        out['upper_is_narrow'] = (r['upper_is_narrow'], 0)
+        out['quality'] = (r['quality'], 0)
+    elif name == 'bolton':
+        for part in ('anterior', 'overall'):
+            for k in ('ratio', 'sum_upper_mm', 'sum_lower_mm', 'discrep_mm'):
+                out[f'{part}_{k}'] = (_get(r, part, k), d2)
+            for k in ('status', 'n_upper', 'n_lower'):
+                out[f'{part}_{k}'] = (_get(r, part, k), 0)
+    elif name == 'canine':
+        for side in ('right', 'left'):
+            out[f'{side}_dx_mm'] = (_get(r, side, 'dx_mm'), d1)
+            out[f'{side}_label'] = (_get(r, side, 'label'), 0)
+            out[f'{side}_source'] = (_get(r, side, 'source'), 0)
+    elif name == 'crossbite':
+        for side in ('right', 'left'):
+            out[f'{side}_margin_mm'] = (_get(r, side, 'margin_mm'), d2)
+            for k in ('status', 'pairs_cross', 'pairs_scissor'):
+                out[f'{side}_{k}'] = (_get(r, side, k), 0)
+    elif name == 'crowding':
+        for arch in ('upper', 'lower'):
+            for k in ('ald_mm', 'gap_sum_mm', 'required_sum_mm'):
+                out[f'{arch}_{k}'] = (_get(r, arch, k), 1e-9)
+            for k in ('n_pairs', 'n_teeth', 'quality'):
+                out[f'{arch}_{k}'] = (_get(r, arch, k), 0)
+    elif name == 'spee':
+        out['depth_mm'] = (r, d1)
+    elif name == 'midline':
+        # 缺失时 compute 给 is_pass=False 且无 upper / lower；batch 记为 NaN / '缺失'
+        missing = r['quality'] == 'missing'
+        out['is_pass'] = (None if missing else r['is_pass'], 0)
+        for arch in ('upper', 'lower'):
+            out[f'{arch}_signed_y_mm'] = (_get(r, arch, 'signed_y_mm'), d1)
+            out[f'{arch}_dir'] = ('缺失' if missing else _get(r, arch, 'dir'), 0)
+    elif name == 'molar':
+        for side in ('right', 'left'):
+            out[f'{side}_dx_mm'] = (_get(r, side, 'dx_mm'), d1)
+            out[f'{side}_is_complete_distal'] = (_get(r, side, 'is_complete_distal'), 0)
+    elif name == 'overbite':
+        for k in ('value_mm', 'right_mm', 'left_mm'):
+            out[k] = (r.get(k), d1)
+        for side in ('right', 'left'):
+            out[f'{side}_ratio'] = (_get(r, 'ratios', side), d2)
+            out[f'{side}_crown_height_mm'] = (_get(r, 'crown_heights_mm', side), d1)
+        out['category'] = (r['category'], 0)
+        out['side_of_max'] = (r.get('side_of_max') or '', 0)
+    elif name == 'overjet':
+        for k in ('value_mm', 'right_mm', 'left_mm'):
+            out[k] = (r.get(k), d1)
+        for side in ('right', 'left'):
+            out[f'{side}_source'] = (_get(r, 'per_side', side, 'source') or 'missing', 0)
+        out['category'] = (r['category'], 0)
+        out['side_of_max'] = (r.get('side_of_max') or '', 0)
+    return out
+
+
+def _same(a, b, tol) -> bool:
+    """a：compute 侧（None = 缺失）；b：batch 侧（NaN = 缺失）。"""
+    if isinstance(b, (float, np.floating)) or (isinstance(b, (int, np.integer)) and isinstance(a, float)):
+        A = np.nan if a is None else float(a)
+        B = float(b)
+        return (np.isnan(A) and np.isnan(B)) or abs(A - B) <= tol
+    if isinstance(b, (int, np.integer)):
+        return a is not None and int(a) == int(b)
+    return a == str(b)
+
+
+def test_batch_metrics_match_compute(cases):
+    sets, frames = cases
+    res = calc_p.batch_metrics(sets, frames)
+    bad = []
+    for name in calc_p.brief_metrics():
+        spec = calc_p.METRIC_REGISTRY[name]
+        unchecked = set(res[name])
+        for c, (ls, f) in enumerate(zip(sets, frames)):
+            for field, (want, tol) in _fields(name, spec.compute(ls, f, **spec.params)).items():
+                unchecked.discard(field)
+                got = res[name][field][c]
+                if not _same(want, got, tol):
+                    bad.append((name, field, c, want, got))
+        assert not unchecked, f"{name}: batch fields without a compute_* counterpart in the test: {sorted(unchecked)}"
+    assert not bad, f"{len(bad)} mismatches, e.g. {bad[:10]}"
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+import calc_p
+from conftest import ASSETS, asset_landmarks, grid_surface, write_stl
+
+
+def _rebuilt_kv(points, geom_base):
+    """从头重建：普通 dict → LandmarkSet → 坐标系（同一几何基座）→ brief。"""
+    lm = calc_p.LandmarkSet.from_mapping(points)
+    frame = calc_p.build_occlusal_frame(lm, geom_base=geom_base)['frame']
+    if frame is None:
+        return {"错误": "坐标系缺失，无法生成报告"}
+    return calc_p._brief_lines_to_kv(calc_p.make_brief_report(lm, frame))
+
+
+def test_random_edits_match_rebuilt_report(tmp_path):
+    rng = np.random.default_rng(12)
+    lm = asset_landmarks('1')
+    V, F = grid_surface(lm)
+    upper = write_stl(str(tmp_path / 'u.stl'), V, F)
+    lower = write_stl(str(tmp_path / 'l.stl'), V - [0.0, 0.0, 1.0], F)
+    case = calc_p.open_case(upper, lower, os.path.join(ASSETS, '1_U.json'), os.path.join(ASSETS, '1_L.json'),
+                            cfg={'memo': False})
+    assert case.geom_base is not None
+
+    points = lm.to_dict()
+    original = dict(points)
+    labels = sorted(original)
+    frame_labels = sorted(calc_p.FRAME_LANDMARKS.intersection(labels))
+    kv = dict(case.kv)
+    saw_frame_change = False
+    for step in range(80):
+        edits = {}
+        for _ in range(int(rng.integers(1, 5))):
+            label = str(rng.choice(frame_labels if rng.random() < 0.3 else labels))
+            if rng.random() < 0.3:
+                edits[label] = None
+            else:
+                edits[label] = (np.asarray(original[label]) + rng.normal(0.0, 1.0, 3)).tolist()
+        for label, p in edits.items():
+            if p is None:
+                points.pop(label, None)
+            else:
+                points[label] = p
+        out = calc_p.update_landmarks(case, edits)
+        saw_frame_change |= out['frame_changed']
+        kv.update(out['metrics'] or {})
+        want = _rebuilt_kv(points, case.geom_base)
+        assert case.kv == want, f"step {step}: {edits}"
+        if "错误" not in want:
+            assert {k: kv[k] for k in want} == want, f"step {step}: changed keys out of sync"
+        else:
+            kv = dict(want)
+    assert saw_frame_change
@@ -0,0 +1,99 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+import calc_p
+from conftest import ASSETS
+
+ORIENTATION = '[-1.0, -0.0, -0.0, -0.0, -1.0, -0.0, 0.0, 0.0, 1.0]'
+
+
+def _doc(*points) -> bytes:
+    """Slicer Markups 文档（label / position 原样写入，便于构造非法值）。"""
+    cps = ',\n'.join(
+        '{"id": "%d", "label": %s, "description": "", "position": %s, "orientation": %s, "positionStatus": "defined"}'
+        % (i, label, pos, ORIENTATION) for i, (label, pos) in enumerate(points, 1))
+    return ('{"markups": [{"type": "Fiducial", "coordinateSystem": "LPS", "coordinateUnits": "mm", '
+            '"controlPoints": [\n%s\n]}]}' % cps).encode('utf-8')
+
+
+MALFORMED = {
+    'null_position': _doc(('"11m"', '[1.0, 2.0, 3.0]'), ('"12m"', 'null'), ('"13m"', '[4, 5, 6]')),
+    'missing_label': _doc(('"11m"', '[1.0, 2.0, 3.0]')).replace(b'"label": "11m", ', b''),
+    'nan': _doc(('"11m"', '[NaN, 2.0, 3.0]'), ('"12m"', '[1.0, 2.0, 3.0]')),
+    'escaped_labels': _doc(('"1\\u0031m"', '[1.0, 2.0, 3.0]'), ('"x\\"y"', '[4.0, 5.0, 6.0]'),
+                           ('"a\\\\b"', '[7.0, 8.0, 9.0]')),
+    'duplicates': _doc(('"11m"', '[1.0, 2.0, 3.0]'), ('"21m"', '[0.0, 0.0, 0.0]'), ('"11m"', '[9.0, 8.0, 7.0]')),
+    'duplicate_then_invalid': _doc(('"11m"', '[1.0, 2.0, 3.0]'), ('"11m"', '[1.0, Infinity, 3.0]')),
+    'empty_and_numeric_label': _doc(('""', '[1.0, 2.0, 3.0]'), ('5', '[4.0, 5.0, 6.0]'), ('"12m"', '[1, 1, 1]')),
+    'short_position': _doc(('"11m"', '[1.0, 2.0]'), ('"12m"', '[1.0, 2.0, 3.0]')),
+    'position_first': _doc(('"11m"', '[1.0, 2.0, 3.0]')).replace(
+        b'"label": "11m", "description": "", "position": [1.0, 2.0, 3.0]',
+        b'"position": [1.0, 2.0, 3.0], "description": "", "label": "11m"'),
+}
+INPUTS = {**{os.path.basename(p): open(p, 'rb').read() for p in sorted(glob.glob(os.path.join(ASSETS, '*.json')))},
+          **MALFORMED}
+
+
+def _result(parsed):
+    lm = calc_p._landmark_set_from_points(*parsed)
+    return list(lm.names), lm.to_dict()
+
+
+@pytest.mark.parametrize('name', list(INPUTS))
+def test_parse_paths_agree(name):
+    raw = INPUTS[name]
+    want = _result(calc_p._markups_points(json.loads(raw.decode('utf-8'))))
+    got = {'json': want}
+    scanned = calc_p._scan_markups(raw.decode('utf-8'))
+    if scanned is not None:
+        got['scan'] = _result(scanned)
+    elif name in MALFORMED and name not in ('null_position', 'missing_label', 'empty_and_numeric_label',
+                                            'short_position', 'position_first'):
+        pytest.fail(f"scan path fell back on {name}")
+    orjson = pytest.importorskip('orjson')
+    try:
+        got['orjson'] = _result(calc_p._markups_points(orjson.loads(raw)))
+    except ValueError:
+        assert name in ('nan', 'duplicate_then_invalid')   # orjson 不接受 NaN / Infinity，parse_markups 交给 scan
+    for backend, res in got.items():
+        assert res == want, backend
+    lm, info = calc_p.parse_markups(raw)
+    assert (list(lm.names), lm.to_dict()) == want
+    if not name.endswith('.json'):
+        return
+    assert 'scan' in got and len(want[1]) > 100
+
+
+def test_malformed_inputs_keep_last_valid_point():
+    assert _result(calc_p._scan_markups(MALFORMED['duplicates'].decode()))[1]['11m'] == [9.0, 8.0, 7.0]
+    assert '11m' not in calc_p.parse_markups(MALFORMED['duplicate_then_invalid'])[0].to_dict()
+    assert '11m' not in calc_p.parse_markups(MALFORMED['nan'])[0].to_dict()
+    assert set(calc_p.parse_markups(MALFORMED['null_position'])[0].to_dict()) == {'11m', '13m'}
+    assert calc_p.parse_markups(MALFORMED['missing_label'])[0].to_dict() == {}
+    assert set(calc_p.parse_markups(MALFORMED['escaped_labels'])[0].to_dict()) == {'11m', 'x"y', 'a\\b'}
+
+
+def test_lmk_round_trip(tmp_path):
+    sources = []
+    for name, raw in INPUTS.items():
+        path = tmp_path / (name if name.endswith('.json') else f'{name}.json')
+        path.write_bytes(raw)
+        sources.append(str(path))
+    out = str(tmp_path / 'x.lmk')
+    summary = calc_p.convert_markups(sources, out)
+    assert summary['records'] == len(sources) - 1   # missing_label 没有控制点
+    assert [s for s, _ in summary['skipped']] == [str(tmp_path / 'missing_label.json')]
+    for src in sources:
+        rec = os.path.splitext(os.path.basename(src))[0]
+        if rec == 'missing_label':
+            continue
+        want, _ = calc_p.load_markups(src)
+        got, _ = calc_p.load_markups(f'{out}#{rec}')   # 容器内各记录共用一张名表（含全部额外标签）
+        # .lmk 坐标存 float32
+        assert got.to_dict() == {k: np.float32(v).astype(float).tolist() for k, v in want.to_dict().items()}, rec
+        n = len(calc_p.landmark_protocol()[0])
+        assert list(got.names[:n]) == list(want.names[:n]) and set(want.names) <= set(got.names)
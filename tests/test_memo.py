@@ -0,0 +1,31 @@
+"""ResultMemo：磁盘命中与冷算给出同样的坐标系结果；key 随模块源码变化。"""
+import numpy as np
+
+import calc_p
+from conftest import ASSETS, asset_landmarks, grid_surface, write_stl
+
+
+def test_code_version_is_source_digest():
+    assert calc_p.CODE_VERSION == calc_p._source_digest()
+
+
+def test_frame_memo_hit_matches_cold_build(tmp_path):
+    lm = asset_landmarks('1')
+    V, F = grid_surface(lm)
+    upper = write_stl(str(tmp_path / 'u.stl'), V, F)
+    lower = write_stl(str(tmp_path / 'l.stl'), V - [0.0, 0.0, 2.0], F)
+    cfg = {'memo': str(tmp_path / 'memo')}
+
+    cold = calc_p._case_occlusal_frame(lm, upper, lower, {'memo': False}, None)
+    calc_p._case_occlusal_frame(lm, upper, lower, cfg, calc_p.ResultMemo(cfg['memo']))
+    memo = calc_p.ResultMemo(cfg['memo'])   # 新实例：内存层为空，只能从磁盘命中
+    hit = calc_p._case_occlusal_frame(lm, upper, lower, cfg, memo)
+
+    assert memo.hits == 1
+    assert set(hit) == set(cold)
+    assert hit['geom_base'] is not None
+    for k in ('origin', 'ex', 'ey', 'ez'):
+        np.testing.assert_allclose(hit['frame'][k], cold['frame'][k])
+    assert set(hit['geom_base']) == set(cold['geom_base'])
+    for k, v in cold['geom_base'].items():
+        np.testing.assert_equal(hit['geom_base'][k], v)
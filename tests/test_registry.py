@@ -0,0 +1,44 @@
+import threading
+
+import numpy as np
+
+import calc_p
+from conftest import asset_landmarks, grid_surface, write_stl
+
+
+def _recording_registry(threads):
+    """注册表副本：各指标的 compute 记下执行线程。"""
+    reg = {}
+    for name, spec in calc_p.METRIC_REGISTRY.items():
+        def compute(*args, _fn=spec.compute, _name=name, **kw):
+            threads[_name] = threading.get_ident()
+            return _fn(*args, **kw)
+        reg[name] = calc_p.MetricSpec(name, compute, spec.report, spec.params, spec.needs, spec.requires,
+                                      spec.landmarks, spec.cost, spec.brief, spec.schema, spec.format)
+    return reg
+
+
+def test_mesh_metrics_run_on_pool(tmp_path):
+    lm = asset_landmarks('1')
+    frame = calc_p.build_occlusal_frame(lm)['frame']
+    V, F = grid_surface(lm)
+    lower = V.copy()
+    lower[:, 2] -= 0.05
+    mesh = calc_p.CaseMeshes(write_stl(str(tmp_path / 'u.stl'), V, F), write_stl(str(tmp_path / 'l.stl'), lower, F))
+    threads = {}
+    reg = _recording_registry(threads)
+    names = calc_p.brief_metrics() + ['surface', 'contacts']
+    assert calc_p.brief_metrics() == [n for n in calc_p.METRIC_REGISTRY if n not in ('surface', 'contacts')]
+
+    seq = calc_p.run_metrics(names, lm, frame, mesh=mesh, registry=reg)
+    par = calc_p.run_metrics(names, lm, frame, mesh=mesh, registry=reg, workers=2)
+    main = threading.get_ident()
+    assert threads['surface'] != main and threads['contacts'] != main
+    assert all(threads[n] == main for n in calc_p.brief_metrics())
+    assert list(par) == list(seq) == calc_p.metric_order(names)
+    np.testing.assert_equal(par, seq)
+
+    checks = seq['contacts']['checks']
+    assert checks['overbite']['landmark'] == seq['overbite']['category']
+    assert checks['crossbite']['right']['landmark'] == seq['crossbite']['right']['status']
+    assert seq['surface']['upper']['checked'] + seq['surface']['lower']['checked'] == int(lm.valid.sum())
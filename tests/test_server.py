@@ -0,0 +1,25 @@
+import asyncio
+import json
+
+import server_p
+from conftest import ROOT
+
+
+def test_batch_request_error_stays_in_its_slot():
+    async def run():
+        server = server_p.MetricsServer(root=ROOT, workers=1)
+        await server.start(port=0)
+        try:
+            body = {'cases': [{'case': '1'}, {'case': 'x', 'upper_json': '../../etc/passwd'}, 'oops', {'case': '2'}],
+                    'cfg': {'metrics': ['overjet']}}
+            return await server._route('POST', '/metrics/batch', json.dumps(body).encode())
+        finally:
+            server.close()
+
+    status, payload = asyncio.run(run())
+    assert status == 200
+    res = payload['results']
+    assert [r['case'] for r in res] == ['1', 'x', None, '2']
+    assert res[0]['ok'] and res[3]['ok']
+    assert not res[1]['ok'] and 'outside server root' in res[1]['error']
+    assert not res[2]['ok'] and 'JSON object' in res[2]['error']
@@ -0,0 +1,40 @@
+import math
+
+import numpy as np
+import pytest
+
+import calc_p
+
+ROWS = [
+    {'case': '1', 'a': 1.0, 'flag': True},
+    {'case': '2', 'a': 2.0, 'flag': False},
+    {'case': '3', 'a': 'n/a', 'flag': None, 'late': 5.0},   # 第二个 row group：a 类型冲突，late 首次出现
+    {'case': '4', 'a': None, 'flag': True, 'late': 6.0},
+]
+
+
+@pytest.mark.parametrize('backend', ['npz', 'parquet'])
+def test_writer_round_trip_with_type_conflict_and_late_column(tmp_path, backend):
+    if backend == 'parquet':
+        pytest.importorskip('pyarrow')
+    with calc_p.MetricsTableWriter(str(tmp_path / f'cohort.{backend}'), backend=backend, row_group_size=2) as w:
+        for row in ROWS:
+            w.append(row)
+    table = calc_p.read_metrics_table(w.path)
+    assert w.rows == len(ROWS)
+    assert table['case'].tolist() == ['1', '2', '3', '4']
+
+    if backend == 'npz':
+        # 冲突列升为 str（之前分片的数值转成文本），后出现的列补空值
+        assert w.dropped_columns == set()
+        assert table['a'].tolist() == ['1.0', '2.0', 'n/a', '']
+        assert table['flag'].tolist() == [1, 0, -1, 1]
+        late = table['late'].tolist()
+        assert math.isnan(late[0]) and math.isnan(late[1]) and late[2:] == [5.0, 6.0]
+    else:
+        # 首个 row group 定 schema：冲突值记为空，后出现的列记入 dropped_columns
+        assert w.dropped_columns == {'late'}
+        assert 'late' not in table
+        a = table['a'].tolist()
+        assert a[:2] == [1.0, 2.0] and all(v is None or v != v for v in a[2:])
+        assert table['flag'].tolist() == [True, False, None, True]